@@ -7,7 +7,7 @@ from contacts.models import (Company, Person, Group,
                              PhoneNumber, EmailAddress,
                              InstantMessenger, WebSite,
                              StreetAddress, SpecialDate,
-                             Location)
+                             Location, DuplicateCandidate)
 
 class EmailAddressInline(admin.TabularInline):
         model = EmailAddress
@@ -86,7 +86,15 @@ class LocationAdmin(admin.ModelAdmin):
                 })
         )
 
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+        list_display = ('contact', 'duplicate', 'score', 'reasons', 'status')
+        list_editable = ('status',)
+        list_filter = ('status',)
+        ordering = ('-score',)
+        raw_id_fields = ('contact', 'duplicate')
+
 admin.site.register(Company, CompanyAdmin)
 admin.site.register(Person, PersonAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Location, LocationAdmin)
+admin.site.register(DuplicateCandidate, DuplicateCandidateAdmin)
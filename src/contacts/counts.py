@@ -0,0 +1,205 @@
+"""
+Count providers for the paginated list views.
+
+A count provider is a callable taking a queryset and returning the number
+of rows to paginate over. The provider used by the list views is chosen
+with the ``CONTACTS_LIST_COUNT`` setting:
+
+``'exact'``
+    Run ``COUNT(*)`` on every request. This is the default.
+``'cached'``
+    Cache the exact count until a contact or group is saved or deleted.
+``'table'``
+    Read the count of people, companies or groups from the
+    ``contacts_list_counts`` table, which signals keep up to date.
+``'estimate'``
+    Use the query planner's row estimate where the database offers one,
+    falling back to an exact count elsewhere.
+
+The setting may also be the dotted path of a custom provider.
+"""
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_by_path
+
+from contacts.models import Contact, Group, ListCount
+
+GENERATION_KEY = 'contacts:count:generation'
+
+
+class CountPaginator(Paginator):
+    """
+    Paginator that takes the number of objects from a count provider.
+
+    Pages are always sliced to ``per_page`` rows, so an estimated count
+    never hides rows from the last page.
+    """
+    def __init__(self, object_list, per_page, counter, **kwargs):
+        super(CountPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = self.counter(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+
+def exact_count(queryset):
+    return queryset.count()
+
+
+def _generation():
+    """
+    Return the token the cached counts are stored under. It is random, so
+    a token that is evicted never comes back to revive older entries.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(GENERATION_KEY, generation, None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def cached_count(queryset):
+    """
+    Return the exact count of ``queryset``, cached until the next change
+    to a contact or group.
+    """
+    sql = unicode(queryset.query).encode('utf-8')
+    key = 'contacts:count:%s:%s' % (_generation(),
+                                     hashlib.md5(sql).hexdigest())
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count)
+    return count
+
+
+def _count_key(model):
+    return model._meta.model_name
+
+
+def table_count(queryset):
+    """
+    Return the number of rows of the queryset's model from the counter
+    table. Filters on the queryset beyond its manager are not taken into
+    account. The counter is built with an exact count the first time it
+    is read, and kept up to date only while this is the configured
+    provider; call ``invalidate()`` after switching to it and after
+    writes that bypass the model signals, such as bulk loads or turning a
+    person into a company.
+    """
+    key = _count_key(queryset.model)
+    try:
+        return ListCount.objects.get(key=key).count
+    except ListCount.DoesNotExist:
+        count = queryset.model._default_manager.count()
+        try:
+            with transaction.atomic():
+                ListCount.objects.create(key=key, count=count)
+        except IntegrityError:
+            # Another request built the counter first.
+            return ListCount.objects.get(key=key).count
+        return count
+
+
+def estimated_count(queryset):
+    """
+    Return the planner's estimate of the rows ``queryset`` returns on
+    PostgreSQL and MySQL, and an exact count elsewhere.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor not in ('postgresql', 'mysql'):
+        return queryset.count()
+
+    sql, params = queryset.values('pk').query.sql_with_params()
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    cursor.execute('EXPLAIN %s' % sql, params)
+    columns = [column[0] for column in cursor.description]
+    return int(cursor.fetchone()[columns.index('rows')] or 0)
+
+
+COUNTERS = {
+    'exact': exact_count,
+    'cached': cached_count,
+    'table': table_count,
+    'estimate': estimated_count,
+}
+
+
+def get_counter():
+    """
+    Return the count provider named by ``CONTACTS_LIST_COUNT``.
+    """
+    name = getattr(settings, 'CONTACTS_LIST_COUNT', 'exact')
+    if name in COUNTERS:
+        return COUNTERS[name]
+    return import_by_path(name, 'CONTACTS_LIST_COUNT: ')
+
+
+def _bump_generation():
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate():
+    """
+    Forget every cached count and counter row, for writes that bypass the
+    model signals such as ``bulk_create``.
+    """
+    _bump_generation()
+    ListCount.objects.all().delete()
+
+
+def _counted_keys(instance):
+    if isinstance(instance, Contact):
+        if instance.is_company:
+            return ['contact', 'company']
+        return ['contact', 'person']
+    return ['group']
+
+
+def _adjust(instance, amount):
+    for key in _counted_keys(instance):
+        ListCount.objects.filter(key=key).update(count=F('count') + amount)
+
+
+@receiver(post_save)
+def count_saved(sender, instance, created, **kwargs):
+    if not isinstance(instance, (Contact, Group)):
+        return
+    _bump_generation()
+    if created and get_counter() is table_count:
+        _adjust(instance, 1)
+
+
+@receiver(post_delete)
+def count_deleted(sender, instance, **kwargs):
+    if not isinstance(instance, (Contact, Group)):
+        return
+    _bump_generation()
+    if get_counter() is table_count:
+        _adjust(instance, -1)
@@ -0,0 +1,338 @@
+"""
+Duplicate contact detection.
+
+Comparing every pair of contacts does not scale, so contacts are first
+grouped into blocks by blocking keys stored in ``contacts_blocking_keys``:
+
+``n:<last name>:<first initial>``
+    people, by normalized last name and first initial
+``c:<name>``
+    companies, by normalized name
+``e:<address>`` and ``d:<domain>``
+    each email address, and its domain
+``p:<digits>``
+    the last ``PHONE_SUFFIX_DIGITS`` digits of each phone number
+
+Only contacts sharing a block are scored against each other. Blocks are
+read in key order from the key index, and blocks larger than
+``max_block_size`` (a free mail domain, a common surname) are skipped, so
+the work grows with the number of contacts rather than its square.
+Pairs scoring at least ``threshold`` are written to
+``contacts_duplicate_candidates`` for review.
+"""
+import difflib
+from itertools import combinations
+
+from django.db import transaction
+
+from contacts.models import (Contact, EmailAddress, PhoneNumber,
+                             BlockingKey, DuplicateCandidate)
+from contacts.normalize import name_key
+from contacts.pagination import seek
+
+PHONE_SUFFIX_DIGITS = 7
+KEY_LENGTH = 100
+
+NAME_WEIGHT = 0.5
+EMAIL_WEIGHT = 0.3
+PHONE_WEIGHT = 0.2
+
+# Contacts are looked up this many at a time, which keeps each query
+# under the parameter limits of SQLite and Oracle.
+LOOKUP_BATCH_SIZE = 500
+
+
+def contact_keys(is_company, name, first_name, last_name):
+    if is_company:
+        name = name_key(name)
+        return name and [u'c:%s' % name] or []
+    last_name = name_key(last_name)
+    if not last_name:
+        return []
+    return [u'n:%s:%s' % (last_name, name_key(first_name)[:1])]
+
+
+def email_keys(address):
+    if not address:
+        return []
+    keys = [u'e:%s' % address]
+    domain = address.rpartition('@')[2]
+    if domain:
+        keys.append(u'd:%s' % domain)
+    return keys
+
+
+def phone_keys(digits):
+    if not digits or len(digits) < PHONE_SUFFIX_DIGITS:
+        return []
+    return [u'p:%s' % digits[-PHONE_SUFFIX_DIGITS:]]
+
+
+def iter_values(queryset, fields, chunk_size):
+    """
+    Yield lists of ``(pk,) + fields`` tuples from ``queryset``, seeking
+    past the last primary key for each chunk.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def _in_batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        yield ids[start:start + LOOKUP_BATCH_SIZE]
+
+
+def load_features(contact_ids):
+    """
+    Return the values pairs of contacts are scored on, by contact key.
+    """
+    features = {}
+    for ids in _in_batches(contact_ids):
+        contacts = Contact.objects.filter(pk__in=ids).values_list(
+            'pk', 'is_company', 'name', 'first_name', 'middle_name',
+            'last_name')
+        for pk, is_company, name, first, middle, last in contacts:
+            if is_company:
+                full_name = name_key(name)
+            else:
+                full_name = u' '.join(name_key(part)
+                                      for part in (first, middle, last)
+                                      if part)
+            features[pk] = {
+                'is_company': is_company,
+                'name': full_name,
+                'emails': set(),
+                'phones': set(),
+            }
+
+        emails = EmailAddress.objects.filter(contact__in=ids).values_list(
+            'contact', 'normalized_address')
+        for contact_id, address in emails:
+            if address and contact_id in features:
+                features[contact_id]['emails'].add(address)
+
+        phones = PhoneNumber.objects.filter(contact__in=ids).values_list(
+            'contact', 'normalized_number')
+        for contact_id, digits in phones:
+            if contact_id in features:
+                features[contact_id]['phones'].update(
+                    key[2:] for key in phone_keys(digits))
+    return features
+
+
+def score(a, b):
+    """
+    Return how likely two contacts are to be the same, from 0 to 1, and
+    the reasons.
+    """
+    if a['is_company'] != b['is_company']:
+        return 0.0, []
+
+    value = 0.0
+    reasons = []
+    if a['name'] and b['name']:
+        ratio = difflib.SequenceMatcher(None, a['name'], b['name']).ratio()
+        value += NAME_WEIGHT * ratio
+        if ratio >= 0.9:
+            reasons.append('name')
+    if a['emails'] & b['emails']:
+        value += EMAIL_WEIGHT
+        reasons.append('email')
+    if a['phones'] & b['phones']:
+        value += PHONE_WEIGHT
+        reasons.append('phone')
+    return min(value, 1.0), reasons
+
+
+class DuplicateFinder(object):
+    """
+    Rebuild the blocking keys and write the duplicate candidates.
+
+    Pairs that have already been dismissed are not suggested again;
+    unreviewed candidates are replaced. Merging a pair deletes its
+    candidates along with the merged contact.
+    """
+    def __init__(self, threshold=0.5, max_block_size=50, batch_size=250,
+                 progress=None):
+        self.threshold = threshold
+        self.max_block_size = max_block_size
+        self.batch_size = batch_size
+        self.progress = progress
+        self.keys = 0
+        self.blocks = 0
+        self.oversized_blocks = 0
+        self.pairs = 0
+        self.candidates = 0
+        self.oversized_keys = set()
+
+    def run(self):
+        self.build_keys()
+
+        reviewed = set(DuplicateCandidate.objects
+                       .exclude(status=DuplicateCandidate.NEW)
+                       .values_list('contact', 'duplicate'))
+        DuplicateCandidate.objects.filter(
+            status=DuplicateCandidate.NEW).delete()
+
+        pending = []
+        for pair in self.candidate_pairs():
+            if pair in reviewed:
+                continue
+            pending.append(pair)
+            if len(pending) >= self.batch_size:
+                self.write(pending)
+                pending = []
+        self.write(pending)
+        return self.candidates
+
+    def build_keys(self):
+        """
+        Replace every blocking key, reading contacts, email addresses and
+        phone numbers a chunk at a time.
+        """
+        BlockingKey.objects.all().delete()
+        sources = (
+            (Contact.objects.all(),
+             ('is_company', 'name', 'first_name', 'last_name'),
+             lambda pk, *values: (pk, contact_keys(*values))),
+            (EmailAddress.objects.all(), ('contact', 'normalized_address'),
+             lambda pk, contact_id, address: (contact_id,
+                                              email_keys(address))),
+            (PhoneNumber.objects.all(), ('contact', 'normalized_number'),
+             lambda pk, contact_id, digits: (contact_id,
+                                             phone_keys(digits))),
+        )
+        for queryset, fields, keys_for in sources:
+            for rows in iter_values(queryset, fields, self.batch_size * 4):
+                keys = []
+                for row in rows:
+                    contact_id, row_keys = keys_for(*row)
+                    keys.extend(BlockingKey(contact_id=contact_id,
+                                            key=key[:KEY_LENGTH])
+                                for key in row_keys)
+                with transaction.atomic():
+                    BlockingKey.objects.bulk_create(keys)
+                self.keys += len(keys)
+
+    def iter_blocks(self):
+        """
+        Yield the blocking key and sorted contact keys of each block of
+        more than one and at most ``max_block_size`` contacts.
+        """
+        chunk_size = self.batch_size * 4
+        queryset = BlockingKey.objects.order_by('key', 'id')
+        current_key = None
+        contacts = set()
+        last = None
+        while True:
+            chunk = queryset
+            if last is not None:
+                chunk = seek(queryset, ('key', 'id'), last)
+            rows = list(chunk.values_list('key', 'id', 'contact')
+                        [:chunk_size])
+            for key, pk, contact_id in rows:
+                if key != current_key:
+                    for block in self._block(current_key, contacts):
+                        yield block
+                    current_key = key
+                    contacts = set()
+                contacts.add(contact_id)
+            if len(rows) < chunk_size:
+                break
+            last = list(rows[-1][:2])
+        for block in self._block(current_key, contacts):
+            yield block
+
+    def _block(self, key, contacts):
+        if len(contacts) < 2:
+            return []
+        self.blocks += 1
+        if len(contacts) > self.max_block_size:
+            self.oversized_blocks += 1
+            self.oversized_keys.add(key)
+            return []
+        return [(key, sorted(contacts))]
+
+    def candidate_pairs(self):
+        """
+        Yield each pair of contacts sharing a block once, from the first
+        block they share. Blocks are taken about ``batch_size * 4``
+        contacts at a time, so memory use depends on the batch size and
+        the number of oversized blocks rather than on the number of pairs.
+        """
+        chunk = []
+        size = 0
+        for key, contacts in self.iter_blocks():
+            chunk.append((key, contacts))
+            size += len(contacts)
+            if size >= self.batch_size * 4:
+                for pair in self._first_pairs(chunk):
+                    yield pair
+                chunk = []
+                size = 0
+        for pair in self._first_pairs(chunk):
+            yield pair
+
+    def _first_pairs(self, blocks):
+        """
+        Yield the pairs of ``blocks`` that do not share an earlier block.
+        The keys of their contacts up to the last block are read a batch
+        of contacts at a time. A shared key outside ``blocks`` belongs to
+        an earlier chunk: it can't be a block of one contact, and the
+        oversized blocks are left out.
+        """
+        if not blocks:
+            return
+        positions = dict((key, i) for i, (key, contacts) in enumerate(blocks))
+        keys = {}
+        for ids in _in_batches(set(contact for key, contacts in blocks
+                                   for contact in contacts)):
+            rows = BlockingKey.objects.filter(contact__in=ids,
+                                              key__lte=blocks[-1][0])
+            for contact_id, key in rows.values_list('contact', 'key'):
+                if key not in self.oversized_keys:
+                    keys.setdefault(contact_id, set()).add(key)
+
+        for i, (key, contacts) in enumerate(blocks):
+            for a, b in combinations(contacts, 2):
+                shared = keys[a] & keys[b]
+                if not any(positions.get(other, -1) < i for other in shared):
+                    yield a, b
+
+    def write(self, pairs):
+        """
+        Score ``pairs`` and save those reaching the threshold.
+        """
+        if not pairs:
+            return
+        ids = set()
+        for a, b in pairs:
+            ids.add(a)
+            ids.add(b)
+        features = load_features(ids)
+
+        candidates = []
+        for a, b in pairs:
+            if a not in features or b not in features:
+                continue
+            value, reasons = score(features[a], features[b])
+            if value >= self.threshold:
+                candidates.append(DuplicateCandidate(
+                    contact_id=a, duplicate_id=b, score=value,
+                    reasons=','.join(reasons)))
+        DuplicateCandidate.objects.bulk_create(candidates)
+
+        self.pairs += len(pairs)
+        self.candidates += len(candidates)
+        if self.progress is not None:
+            self.progress(self)
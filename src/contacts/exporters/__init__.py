@@ -0,0 +1,6 @@
+"""
+Exporters for writing whole address books out in constant memory.
+
+Contacts are read in primary key order a chunk at a time, with the child
+rows of each chunk loaded in bulk, and written out as they are read.
+"""
@@ -0,0 +1,48 @@
+from contacts.models import Contact
+from contacts.prefetch import prefetch_children
+
+
+def iter_contacts(queryset=None, chunk_size=500, companies=False):
+    """
+    Yield the contacts of ``queryset`` with their child rows loaded, and
+    with their ``company`` loaded too if ``companies`` is true.
+
+    Chunks are fetched by seeking past the last primary key seen rather
+    than with OFFSET, so every chunk costs the same however deep the
+    export is.
+    """
+    if queryset is None:
+        queryset = Contact.objects.all()
+    queryset = queryset.order_by('pk')
+
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        contacts = prefetch_children(chunk[:chunk_size])
+        if not contacts:
+            return
+        if companies:
+            load_companies(contacts)
+
+        for contact in contacts:
+            yield contact
+
+        last_pk = contacts[-1].pk
+        if len(contacts) < chunk_size:
+            return
+
+
+def load_companies(contacts):
+    """
+    Set the ``company`` of each of ``contacts`` with a single query.
+    """
+    company_ids = set(contact.company_id for contact in contacts
+                      if contact.company_id)
+    if not company_ids:
+        return
+    companies = Contact.objects.in_bulk(company_ids)
+    for contact in contacts:
+        if contact.company_id in companies:
+            contact.company = companies[contact.company_id]
@@ -0,0 +1,86 @@
+"""
+Streaming exporter for CSV files.
+
+Each contact is one row under a header of ``COLUMNS``. A contact's email
+addresses, phone numbers and web sites are each joined into one cell with
+``MULTI_VALUE_SEPARATOR``; only its first street address and birthday
+are written.
+"""
+from __future__ import absolute_import
+
+import csv
+
+from contacts.exporters.base import iter_contacts
+
+COLUMNS = ('kind', 'name', 'prefix', 'first_name', 'middle_name',
+           'last_name', 'suffix', 'nickname', 'title', 'company', 'email',
+           'phone', 'url', 'street', 'street2', 'city', 'province',
+           'postal_code', 'country', 'birthday', 'about')
+
+MULTI_VALUE_SEPARATOR = '; '
+
+
+class Echo(object):
+    """
+    File-like object handing back whatever is written to it, so that a
+    ``csv.writer`` can format one row at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def contact_row(contact):
+    """
+    Return the cells of ``contact`` keyed by column.
+    """
+    row = {
+        'kind': contact.is_company and 'company' or 'person',
+        'name': contact.name,
+        'prefix': contact.prefix,
+        'first_name': contact.first_name,
+        'middle_name': contact.middle_name,
+        'last_name': contact.last_name,
+        'suffix': contact.suffix,
+        'nickname': contact.nickname,
+        'title': contact.title,
+        'about': contact.about,
+    }
+    if contact.company_id:
+        row['company'] = contact.company.name
+    row['email'] = MULTI_VALUE_SEPARATOR.join(
+        email.email_address for email in contact.email_address.all())
+    row['phone'] = MULTI_VALUE_SEPARATOR.join(
+        phone.phone_number for phone in contact.phone_number.all())
+    row['url'] = MULTI_VALUE_SEPARATOR.join(
+        site.url for site in contact.web_site.all())
+
+    addresses = contact.street_address.all()
+    if addresses:
+        address = addresses[0]
+        for field in ('street', 'street2', 'city', 'province', 'postal_code',
+                      'country'):
+            row[field] = getattr(address, field)
+    for special_date in contact.special_date.all():
+        if special_date.occasion.lower() == 'birthday':
+            row['birthday'] = special_date.date.isoformat()
+            break
+    return row
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+
+def iter_csv(queryset=None, chunk_size=500):
+    """
+    Yield the header and one line per contact in ``queryset`` as UTF-8
+    text.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for contact in iter_contacts(queryset, chunk_size, companies=True):
+        row = contact_row(contact)
+        yield writer.writerow([_encode(row.get(column))
+                               for column in COLUMNS])
@@ -0,0 +1,133 @@
+"""
+Streaming exporter for vCard 3.0 files.
+
+Cards use the properties read by ``contacts.importers.vcard``, so an
+export can be imported again.
+"""
+from __future__ import absolute_import
+
+from contacts.exporters.base import iter_contacts
+from contacts.importers.vcard import PHONE_TYPES, PLACE_TYPES
+
+# Location names and the TYPE parameter written for them.
+LOCATION_TYPES = dict((name.lower(), type) for type, name, is_phone
+                      in PHONE_TYPES + PLACE_TYPES)
+
+# ``InstantMessenger.service`` values and the IMPP scheme written for them,
+# the reverse of ``contacts.importers.vcard.IM_SCHEMES``.
+IM_SERVICE_SCHEMES = {
+    'aim': 'aim',
+    'msn': 'msnim',
+    'icq': 'icq',
+    'jabber': 'xmpp',
+    'yahoo': 'ymsgr',
+    'skype': 'skype',
+    'qq': 'qq',
+    'sametime': 'sametime',
+    'gadu-gadu': 'gg',
+    'google-talk': 'gtalk',
+}
+
+LINE_LENGTH = 75
+
+
+def escape(value):
+    if value is None:
+        return u''
+    return (unicode(value).replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """
+    Fold a content line into lines of at most ``LINE_LENGTH`` octets.
+    """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= LINE_LENGTH:
+        return encoded + '\r\n'
+
+    lines = []
+    current = ''
+    for char in line:
+        octets = char.encode('utf-8')
+        if len(current) + len(octets) > LINE_LENGTH:
+            lines.append(current)
+            current = ' '
+        current += octets
+    lines.append(current)
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def _type_param(location, *extra):
+    types = list(extra)
+    if location is not None:
+        type = LOCATION_TYPES.get((location.name or '').lower())
+        if type:
+            types.append(type)
+    if not types:
+        return u''
+    return u';TYPE=%s' % u','.join(types)
+
+
+def contact_lines(contact):
+    """
+    Return the unfolded content lines of the card for ``contact``.
+    """
+    lines = [u'BEGIN:VCARD', u'VERSION:3.0']
+    if contact.is_company:
+        lines.append(u'FN:%s' % escape(contact.name))
+        lines.append(u'ORG:%s' % escape(contact.name))
+        lines.append(u'X-ABShowAs:COMPANY')
+    else:
+        full_name = u' '.join(part for part in (contact.prefix,
+                                                contact.first_name,
+                                                contact.middle_name,
+                                                contact.last_name,
+                                                contact.suffix) if part)
+        lines.append(u'FN:%s' % escape(full_name))
+        lines.append(u'N:%s' % u';'.join(escape(part) for part in (
+            contact.last_name, contact.first_name, contact.middle_name,
+            contact.prefix, contact.suffix)))
+        if contact.company_id and contact.company.name:
+            lines.append(u'ORG:%s' % escape(contact.company.name))
+        if contact.title:
+            lines.append(u'TITLE:%s' % escape(contact.title))
+    if contact.nickname:
+        lines.append(u'NICKNAME:%s' % escape(contact.nickname))
+    if contact.about:
+        lines.append(u'NOTE:%s' % escape(contact.about))
+
+    for phone in contact.phone_number.all():
+        lines.append(u'TEL%s:%s' % (_type_param(phone.location, 'VOICE'),
+                                    escape(phone.phone_number)))
+    for email in contact.email_address.all():
+        lines.append(u'EMAIL%s:%s' % (_type_param(email.location, 'INTERNET'),
+                                      escape(email.email_address)))
+    for address in contact.street_address.all():
+        lines.append(u'ADR%s:%s' % (_type_param(address.location), u';'.join(
+            escape(part) for part in ('', address.street2, address.street,
+                                      address.city, address.province,
+                                      address.postal_code, address.country))))
+    for site in contact.web_site.all():
+        lines.append(u'URL%s:%s' % (_type_param(site.location),
+                                    escape(site.url)))
+    for im in contact.instant_messenger.all():
+        scheme = IM_SERVICE_SCHEMES.get(im.service)
+        account = escape(im.im_account)
+        if scheme:
+            account = u'%s:%s' % (scheme, account)
+        lines.append(u'IMPP%s:%s' % (_type_param(im.location), account))
+    for special_date in contact.special_date.all():
+        if special_date.occasion.lower() == 'birthday':
+            lines.append(u'BDAY:%s' % special_date.date.isoformat())
+
+    lines.append(u'END:VCARD')
+    return lines
+
+
+def iter_vcards(queryset=None, chunk_size=500):
+    """
+    Yield the vCard of every contact in ``queryset`` as UTF-8 text.
+    """
+    for contact in iter_contacts(queryset, chunk_size, companies=True):
+        yield ''.join(fold(line) for line in contact_lines(contact))
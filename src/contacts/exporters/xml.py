@@ -0,0 +1,83 @@
+"""
+Streaming exporter for XML contact dumps.
+
+The output uses the element layout read by ``Contact.create_from_xml`` and
+``contacts.importers.xml.XMLImporter``, so an export can be imported again.
+The company of a person is written as a ``<company>`` element holding the
+company's name, which the importer resolves to a company again. Companies
+are written before people, so that the importer meets each company before
+the people working there.
+"""
+from __future__ import absolute_import
+
+from lxml import etree
+
+from contacts.exporters.base import iter_contacts
+from contacts.importers.xml import CHILD_ELEMENTS, element_fields
+from contacts.models import Contact
+from contacts.prefetch import CHILD_RELATIONS
+
+CHILD_TAGS = dict((model, tag) for tag, model in CHILD_ELEMENTS.items())
+
+
+def fields_element(tag, obj):
+    """
+    Build an element named ``tag`` with one child element per field of
+    ``obj``. Empty values are left out.
+    """
+    element = etree.Element(tag)
+    fields = element_fields(type(obj))
+    for field in type(obj)._meta.fields:
+        if field.name not in fields:
+            continue
+        value = getattr(obj, field.attname)
+        if value is None or value == '':
+            continue
+        etree.SubElement(element, field.name).text = field.value_to_string(obj)
+    return element
+
+
+def location_element(location):
+    return fields_element('Location', location)
+
+
+def child_element(child):
+    element = fields_element(CHILD_TAGS[type(child)], child)
+    if getattr(child, 'location_id', None) is not None:
+        element.append(location_element(child.location))
+    return element
+
+
+def contact_element(contact):
+    """
+    Build the ``<Contact>`` element for ``contact``, its company and its
+    child rows.
+    """
+    element = fields_element('Contact', contact)
+    if contact.company_id is not None and contact.company.name:
+        etree.SubElement(element, 'company').text = contact.company.name
+    for relation in CHILD_RELATIONS:
+        for child in getattr(contact, relation).all():
+            element.append(child_element(child))
+    return element
+
+
+def export_xml(target, queryset=None, chunk_size=500):
+    """
+    Write the contacts of ``queryset`` to ``target``, a path or file
+    object, companies first, and return the number of contacts written.
+    """
+    if queryset is None:
+        queryset = Contact.objects.all()
+
+    count = 0
+    with etree.xmlfile(target, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('Contacts'):
+            for is_company in (True, False):
+                for contact in iter_contacts(
+                        queryset.filter(is_company=is_company), chunk_size,
+                        companies=not is_company):
+                    xf.write(contact_element(contact))
+                    count += 1
+    return count
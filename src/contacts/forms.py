@@ -1,8 +1,60 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.db.models.query import prefetch_related_objects
 from django.forms import ModelForm, Form
-from django.contrib.contenttypes.generic import generic_inlineformset_factory as inlineformset_factory
+from django.forms.models import BaseInlineFormSet, inlineformset_factory
+from django.forms.util import flatatt
+from django.utils.html import format_html
 
-from contacts.models import Company, Person, Group, PhoneNumber, EmailAddress, InstantMessenger, WebSite, StreetAddress, SpecialDate
+from contacts import objectcache
+from contacts.models import Contact, Company, Person, Group, Location, PhoneNumber, EmailAddress, InstantMessenger, WebSite, StreetAddress, SpecialDate
+
+class CompanyAutocomplete(forms.HiddenInput):
+	"""
+	A company picker that asks the ``contacts_company_autocomplete`` view
+	for suggestions as the user types. Only the selected company is read
+	when the form is rendered.
+	"""
+	is_hidden = False
+	
+	class Media:
+		js = ('contacts/js/autocomplete.js',)
+	
+	def company_name(self, value):
+		if value in (None, ''):
+			return ''
+		try:
+			return Company.objects.filter(pk=value).values_list('name', flat=True).first() or ''
+		except (TypeError, ValueError):
+			return ''
+	
+	def render(self, name, value, attrs=None):
+		hidden = super(CompanyAutocomplete, self).render(name, value, attrs)
+		final_attrs = self.build_attrs(attrs)
+		field_id = final_attrs.get('id', 'id_%s' % name)
+		text_attrs = {
+			'type': 'text',
+			'id': '%s_name' % field_id,
+			'value': self.company_name(value),
+			'list': '%s_list' % field_id,
+			'autocomplete': 'off',
+			'data-autocomplete-url': reverse('contacts_company_autocomplete'),
+			'data-autocomplete-for': field_id,
+		}
+		return hidden + format_html('<input{0} /><datalist id="{1}_list"></datalist>', flatatt(text_attrs), field_id)
+
+class CompanyField(forms.ModelChoiceField):
+	"""
+	Choose a company through ``CompanyAutocomplete`` instead of a select
+	listing every company.
+	"""
+	widget = CompanyAutocomplete
+	
+	def __init__(self, *args, **kwargs):
+		kwargs.setdefault('required', False)
+		kwargs.setdefault('label', 'Company')
+		super(CompanyField, self).__init__(Company.objects.all(), *args, **kwargs)
 
 class CompanyCreateForm(ModelForm):
 	class Meta:
@@ -14,11 +66,15 @@ class CompanyUpdateForm(ModelForm):
 		model = Company
 
 class PersonCreateForm(ModelForm):
+	company = CompanyField()
+	
 	class Meta:
 		model = Person
 		fields = ('first_name', 'last_name', 'title', 'company', 'about')
 
 class PersonUpdateForm(ModelForm):
+	company = CompanyField()
+	
 	class Meta:
 		model = Person
 		fields = ('first_name', 'last_name', 'title', 'company')
@@ -33,9 +89,134 @@ class GroupUpdateForm(ModelForm):
 		model = Group
 		exclude = ('slug',)
 
-PhoneNumberFormSet = inlineformset_factory(PhoneNumber, extra=1)
-EmailAddressFormSet = inlineformset_factory(EmailAddress, extra=1)
-InstantMessengerFormSet = inlineformset_factory(InstantMessenger, extra=1)
-WebSiteFormSet = inlineformset_factory(WebSite, extra=1)
-StreetAddressFormSet = inlineformset_factory(StreetAddress, extra=1)
-SpecialDateFormSet = inlineformset_factory(SpecialDate, extra=1)
\ No newline at end of file
+class LoadedChoiceField(forms.ModelChoiceField):
+	"""
+	A model choice over ``objects``, a list loaded up front, so that
+	neither rendering nor validating the field queries the database.
+	"""
+	def __init__(self, objects, *args, **kwargs):
+		model = objects and type(objects[0]) or Location
+		super(LoadedChoiceField, self).__init__(model._default_manager.none(), *args, **kwargs)
+		self.objects = dict((unicode(obj.pk), obj) for obj in objects)
+		choices = [(obj.pk, self.label_from_instance(obj)) for obj in objects]
+		if self.empty_label is not None:
+			choices.insert(0, (u'', self.empty_label))
+		self.choices = choices
+	
+	def to_python(self, value):
+		if value in self.empty_values:
+			return None
+		try:
+			return self.objects[unicode(getattr(value, 'pk', value))]
+		except KeyError:
+			raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+class ContactChildFormSet(BaseInlineFormSet):
+	"""
+	An inline formset for the child rows of a contact that can be given
+	the rows, as ``rows``, and every location, as ``locations``, instead of
+	querying for them. The location choices are worked out once for the
+	formset and shared by its forms.
+	"""
+	def __init__(self, *args, **kwargs):
+		self.rows = kwargs.pop('rows', None)
+		locations = kwargs.pop('locations', None)
+		super(ContactChildFormSet, self).__init__(*args, **kwargs)
+		if self.rows is not None:
+			# Fill in the result cache of the formset's queryset, as
+			# prefetch_related does, so that it is never run.
+			self.rows = sorted(self.rows, key=lambda row: row.pk)
+			queryset = self.get_queryset()
+			queryset._result_cache = self.rows
+			queryset._prefetch_done = True
+		self.locations = None
+		if locations is not None and 'location' in self.form.base_fields:
+			limit = self.model._meta.get_field('location').rel.limit_choices_to
+			self.locations = [location for location in locations
+				if all(getattr(location, name) == value for name, value in limit.items())]
+	
+	def add_fields(self, form, index):
+		super(ContactChildFormSet, self).add_fields(form, index)
+		if self.rows is not None:
+			name = self._pk_field.name
+			field = form.fields[name]
+			form.fields[name] = LoadedChoiceField(self.rows, initial=field.initial,
+				required=False, widget=field.widget)
+		if self.locations is not None:
+			field = form.fields['location']
+			form.fields['location'] = LoadedChoiceField(self.locations,
+				required=field.required, label=field.label, help_text=field.help_text)
+
+PhoneNumberFormSet = inlineformset_factory(Contact, PhoneNumber, formset=ContactChildFormSet, extra=1)
+EmailAddressFormSet = inlineformset_factory(Contact, EmailAddress, formset=ContactChildFormSet, extra=1)
+InstantMessengerFormSet = inlineformset_factory(Contact, InstantMessenger, formset=ContactChildFormSet, extra=1)
+WebSiteFormSet = inlineformset_factory(Contact, WebSite, formset=ContactChildFormSet, extra=1)
+StreetAddressFormSet = inlineformset_factory(Contact, StreetAddress, formset=ContactChildFormSet, extra=1)
+SpecialDateFormSet = inlineformset_factory(Contact, SpecialDate, formset=ContactChildFormSet, extra=1)
+
+# The child formsets of the contact edit pages, by template variable.
+CONTACT_FORMSETS = (
+	('phone_formset', PhoneNumberFormSet, 'phone_number'),
+	('email_formset', EmailAddressFormSet, 'email_address'),
+	('im_formset', InstantMessengerFormSet, 'instant_messenger'),
+	('website_formset', WebSiteFormSet, 'web_site'),
+	('address_formset', StreetAddressFormSet, 'street_address'),
+	('special_date_formset', SpecialDateFormSet, 'special_date'),
+)
+
+def contact_formsets(contact, data=None):
+	"""
+	Return the child formsets of ``contact`` by template variable. The
+	child rows are loaded with one query per table and the locations with
+	one query, and shared by every formset and widget.
+	"""
+	prefetch_related_objects([contact], [relation for name, formset_class, relation in CONTACT_FORMSETS])
+	locations = list(Location.objects.all())
+	locations_by_pk = dict((location.pk, location) for location in locations)
+	
+	formsets = {}
+	for name, formset_class, relation in CONTACT_FORMSETS:
+		rows = list(getattr(contact, relation).all())
+		for row in rows:
+			if getattr(row, 'location_id', None) in locations_by_pk:
+				row.location = locations_by_pk[row.location_id]
+		formsets[name] = formset_class(data, instance=contact, rows=rows, locations=locations)
+	return formsets
+
+def update_fields(form):
+	"""
+	Return the model fields to write for the changes in ``form``: the
+	fields it changed and the fields the model sets itself, such as
+	``date_modified`` and normalized copies.
+	"""
+	opts = form.instance._meta
+	names = set(form.changed_data)
+	for field in opts.fields:
+		if not (field.editable or field.primary_key or getattr(field, 'auto_now_add', False)):
+			names.add(field.name)
+	return [field.name for field in opts.fields if field.name in names and not field.primary_key]
+
+def save_changes(form, formsets=()):
+	"""
+	Save what ``form`` and ``formsets`` changed in one transaction.
+	Changed rows are written with ``update_fields``, new rows inserted and
+	deleted rows removed; unchanged forms and formsets are skipped.
+	Returns whether anything was written.
+	"""
+	formsets = [formset for formset in formsets if formset.has_changed()]
+	if not (form.has_changed() or formsets):
+		return False
+	
+	with objectcache.atomic():
+		if form.has_changed():
+			instance = form.save(commit=False)
+			instance.save(update_fields=update_fields(form))
+			form.save_m2m()
+		for formset in formsets:
+			formset.save(commit=False)
+			for changed_form in formset.saved_forms:
+				if changed_form.instance.pk is None:
+					changed_form.instance.save()
+				else:
+					changed_form.instance.save(update_fields=update_fields(changed_form))
+	return True
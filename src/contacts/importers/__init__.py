@@ -0,0 +1,7 @@
+"""
+Bulk importers for loading large contact dumps.
+
+The importers parse their source one contact at a time and hand the
+resulting objects to a ``ContactBatch``, which writes them to the database
+with ``bulk_create`` once a batch is full.
+"""
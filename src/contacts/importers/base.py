@@ -0,0 +1,149 @@
+import time
+
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+
+from contacts import counts, objectcache, recent, search
+from contacts.models import Contact
+from contacts.slugs import allocate_slugs
+
+
+class ImportStats(object):
+    """
+    Running totals for an import.
+    """
+    def __init__(self):
+        self.read = 0
+        self.contacts = 0
+        self.children = 0
+        self.skipped = 0
+        self.batches = 0
+        self.location_hits = 0
+        self.location_misses = 0
+        self.company_hits = 0
+        self.company_misses = 0
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def rate(self):
+        """
+        Contacts written per second.
+        """
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.contacts / elapsed
+
+    @property
+    def read_rate(self):
+        """
+        Records read per second.
+        """
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.read / elapsed
+
+
+class ContactBatch(object):
+    """
+    Collects unsaved contacts and their child rows and writes them with
+    ``bulk_create``.
+
+    ``bulk_create`` does not hand back primary keys on every backend, so the
+    batch allocates contact keys itself, the same way ``loaddata`` writes
+    fixtures with explicit keys, and resets the sequences afterwards. It is
+    meant for bulk loads and should not race other writers of contacts.
+    ``bulk_create`` neither calls ``save()`` nor sends signals, so the batch
+    fills in derived columns, makes the slugs unique and refreshes the list
+    counts, the recent contact lists, the search index and the detail cache
+    itself.
+    """
+    def __init__(self, batch_size=500, stats=None, progress=None):
+        self.batch_size = batch_size
+        self.stats = stats or ImportStats()
+        self.progress = progress
+        self.contacts = []
+        self.children = []
+        self.existing = set()
+
+    def add(self, contact, children=()):
+        """
+        Queue a contact and its child rows, flushing when the batch is full.
+        """
+        self.contacts.append(contact)
+        for child in children:
+            self.children.append((contact, child))
+
+        if len(self.contacts) >= self.batch_size:
+            self.flush()
+
+    def add_children(self, contact_id, children):
+        """
+        Queue child rows for a contact that is already saved.
+        """
+        self.existing.add(contact_id)
+        for child in children:
+            child.contact_id = contact_id
+            self.children.append((None, child))
+
+        if len(self.existing) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the queued contacts and child rows in one transaction.
+        """
+        if not self.contacts and not self.children:
+            return
+
+        with objectcache.atomic():
+            next_pk = (Contact.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+            for offset, contact in enumerate(self.contacts):
+                contact.pk = next_pk + offset
+            allocate_slugs(self.contacts)
+            Contact.objects.bulk_create(self.contacts)
+
+            rows = {}
+            for contact, child in self.children:
+                if contact is not None:
+                    child.contact_id = contact.pk
+                if hasattr(child, 'denormalize'):
+                    child.denormalize()
+                rows.setdefault(type(child), []).append(child)
+            for model, objs in rows.items():
+                model.objects.bulk_create(objs)
+
+            reset_sequences([Contact])
+            counts.invalidate()
+            recent.invalidate()
+            indexed = list(self.contacts)
+            if self.existing:
+                indexed.extend(Contact.objects.filter(pk__in=self.existing))
+            search.index_contacts(indexed)
+            objectcache.invalidate([contact.pk for contact in indexed])
+
+        self.stats.contacts += len(self.contacts)
+        self.stats.children += len(self.children)
+        self.stats.batches += 1
+        self.contacts = []
+        self.children = []
+        self.existing = set()
+
+        if self.progress is not None:
+            self.progress(self.stats)
+
+
+def reset_sequences(models):
+    """
+    Move the primary key sequences of ``models`` past the rows written with
+    explicit keys. Backends without sequences return no SQL.
+    """
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(sql)
@@ -0,0 +1,45 @@
+from contacts.models import Company
+from contacts.slugs import save_with_slug
+
+
+class CompanyResolver(object):
+    """
+    Resolve imported company names to ``Company`` rows.
+
+    The names and keys of the existing companies are read once when the
+    resolver is created and matched without regard to case; a missing
+    company is created the first time it is asked for. Use one resolver
+    per import.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._by_name = {}
+        for pk, name in Company.objects.values_list('pk', 'name'):
+            if name:
+                self._by_name.setdefault(name.strip().lower(), pk)
+
+    def get(self, name):
+        """
+        Return the key of the company called ``name``, or None.
+        """
+        if not name:
+            return None
+        return self._by_name.get(name.strip().lower())
+
+    def resolve(self, name, **attrs):
+        """
+        Return the key of the company called ``name``, creating it with
+        ``attrs`` if there is none yet.
+        """
+        pk = self.get(name)
+        if pk is not None:
+            self.hits += 1
+            return pk
+
+        self.misses += 1
+        name = name.strip()
+        company = Company(name=name, **attrs)
+        save_with_slug(company, name)
+        self._by_name[name.lower()] = company.pk
+        return company.pk
@@ -0,0 +1,230 @@
+"""
+Bulk importer for CSV files.
+
+Each row describes one person or company. A column mapping names the
+field each CSV column fills in; the fields are the columns written by
+``contacts.exporters.csv`` (``first_name``, ``company``, ``email``,
+``phone``, ``street``, ``birthday`` and so on), which are also used when
+no mapping is given. The ``email``, ``phone`` and ``url`` cells may hold
+several values separated by semicolons.
+
+Rows are validated a chunk at a time and written with ``bulk_create``.
+Rows that fail validation are copied to a reject file together with the
+reason, and the rest of the import carries on.
+"""
+from __future__ import absolute_import
+
+import csv
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.template.defaultfilters import slugify
+
+from contacts.exporters.csv import COLUMNS
+from contacts.importers.base import ContactBatch
+from contacts.importers.companies import CompanyResolver
+from contacts.importers.locations import LocationResolver
+from contacts.models import (Contact, PhoneNumber, EmailAddress, WebSite,
+                             StreetAddress, SpecialDate)
+
+CONTACT_FIELDS = ('name', 'prefix', 'first_name', 'middle_name',
+                  'last_name', 'suffix', 'nickname', 'title', 'about')
+ADDRESS_FIELDS = ('street', 'street2', 'city', 'province', 'postal_code',
+                  'country')
+MULTI_VALUE_FIELDS = (
+    ('email', EmailAddress, 'email_address'),
+    ('phone', PhoneNumber, 'phone_number'),
+    ('url', WebSite, 'url'),
+)
+
+
+def _decode(value):
+    if value is None:
+        return u''
+    try:
+        return value.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        raise ValidationError(u'The row is not valid UTF-8.')
+
+
+def _clean(model, field, value):
+    """
+    Run the validation of ``model.field`` on ``value``, naming the field
+    in any error.
+    """
+    try:
+        return model._meta.get_field(field).clean(value, None)
+    except ValidationError, e:
+        raise ValidationError(u'%s: %s' % (field, u' '.join(e.messages)))
+
+
+class CSVImporter(object):
+    """
+    Import contacts from a CSV file.
+
+    ``mapping`` maps CSV column headers to fields; columns it leaves out
+    are ignored. Child rows are filed under the location named
+    ``location``. Rejected rows are written to ``rejects``, a file object,
+    if one is given.
+    """
+    def __init__(self, mapping=None, batch_size=500, chunk_size=100,
+                 location='Other', rejects=None, progress=None):
+        self.mapping = mapping
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.location = location
+        self.rejects = rejects
+        self.progress = progress
+
+    def run(self, source):
+        """
+        Import every row of ``source``, a path or file object, and return
+        the ``ImportStats``.
+        """
+        if isinstance(source, basestring):
+            with open(source, 'rb') as f:
+                return self.run(f)
+
+        self.batch = ContactBatch(self.batch_size, progress=self.progress)
+        self.locations = LocationResolver()
+        self.companies = CompanyResolver()
+        self._location = None
+
+        reader = csv.reader(source)
+        try:
+            headers = [_decode(header).lstrip(u'\ufeff')
+                       for header in reader.next()]
+        except StopIteration:
+            headers = []
+        self.columns = self.map_columns(headers)
+        self.reject_writer = None
+        if self.rejects is not None:
+            self.reject_writer = csv.writer(self.rejects)
+            self.reject_writer.writerow(
+                [header.encode('utf-8') for header in headers] + ['error'])
+
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        self.import_chunk(chunk)
+
+        self.batch.flush()
+        stats = self.batch.stats
+        stats.location_hits = self.locations.hits
+        stats.location_misses = self.locations.misses
+        stats.company_hits = self.companies.hits
+        stats.company_misses = self.companies.misses
+        return stats
+
+    def map_columns(self, headers):
+        """
+        Return ``(index, field)`` pairs for the columns to read.
+        """
+        columns = []
+        for index, header in enumerate(headers):
+            if self.mapping is None:
+                field = header in COLUMNS and header or None
+            else:
+                field = self.mapping.get(header)
+            if field is not None:
+                if field not in COLUMNS:
+                    raise ValueError('Unknown field %r for column %r' % (
+                        field, header))
+                columns.append((index, field))
+        return columns
+
+    def import_chunk(self, rows):
+        """
+        Validate ``rows`` and queue the valid ones for writing.
+        """
+        valid = []
+        for row in rows:
+            self.batch.stats.read += 1
+            try:
+                valid.append(self.clean_row(row))
+            except ValidationError, e:
+                self.reject(row, u'; '.join(e.messages))
+
+        for values, organisation, children in valid:
+            if values.pop('is_company'):
+                pk = self.companies.resolve(organisation, **values)
+                self.batch.add_children(pk, children)
+            else:
+                if organisation:
+                    values['company_id'] = self.companies.resolve(organisation)
+                self.batch.add(Contact(**values), children)
+
+    def reject(self, row, error):
+        self.batch.stats.skipped += 1
+        if self.reject_writer is not None:
+            self.reject_writer.writerow(row + [error.encode('utf-8')])
+
+    def clean_row(self, row):
+        """
+        Return the contact values, company name and child rows of ``row``,
+        raising ``ValidationError`` if it can not be imported.
+        """
+        cells = {}
+        for index, field in self.columns:
+            if index < len(row):
+                value = _decode(row[index])
+                if value:
+                    cells[field] = value
+
+        is_company = cells.get('kind', 'person').lower() == 'company'
+        values = {'is_company': is_company}
+        for field in CONTACT_FIELDS:
+            if field in cells:
+                values[field] = _clean(Contact, field, cells[field])
+
+        if is_company:
+            organisation = values.pop('name', None) or cells.get('company')
+            if not organisation:
+                raise ValidationError(u'A company needs a name.')
+            for field in ('prefix', 'first_name', 'middle_name', 'last_name',
+                          'suffix', 'title'):
+                values.pop(field, None)
+        else:
+            organisation = cells.get('company')
+            if organisation:
+                _clean(Contact, 'name', organisation)
+            if not (values.get('first_name') or values.get('last_name')):
+                raise ValidationError(u'A person needs a first or last name.')
+            values['slug'] = slugify(u'%s %s' % (
+                values.get('first_name') or u'',
+                values.get('last_name') or u''))[:50]
+
+        children = []
+        for column, model, field in MULTI_VALUE_FIELDS:
+            for value in cells.get(column, u'').split(u';'):
+                value = value.strip()
+                if value:
+                    children.append(model(**{
+                        field: _clean(model, field, value),
+                        'location': self.location_for(),
+                    }))
+
+        address = dict((field, _clean(StreetAddress, field, cells[field]))
+                       for field in ADDRESS_FIELDS if field in cells)
+        if address:
+            children.append(StreetAddress(location=self.location_for(),
+                                          **address))
+
+        if 'birthday' in cells:
+            try:
+                date = datetime.datetime.strptime(cells['birthday'],
+                                                  '%Y-%m-%d').date()
+            except ValueError:
+                raise ValidationError(u'birthday: Enter a date as YYYY-MM-DD.')
+            children.append(SpecialDate(occasion='Birthday', date=date,
+                                        every_year=True))
+
+        return values, organisation, children
+
+    def location_for(self):
+        if self._location is None:
+            self._location = self.locations.resolve(name=self.location)
+        return self._location
@@ -0,0 +1,53 @@
+from django.template.defaultfilters import slugify
+
+from contacts.models import Location
+
+
+class LocationResolver(object):
+    """
+    Resolve imported locations to existing ``Location`` rows.
+
+    The locations table is read once when the resolver is created; after
+    that lookups are served from memory and a missing location is created
+    only the first time it is asked for. Use one resolver per import.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._by_slug = {}
+        self._by_name = {}
+        for location in Location.objects.all():
+            self._remember(location)
+
+    def _remember(self, location):
+        if location.slug:
+            self._by_slug.setdefault(location.slug, location)
+        if location.name:
+            self._by_name.setdefault(location.name.lower(), location)
+
+    def get(self, name=None, slug=None):
+        """
+        Return the known location matching ``slug`` or ``name``, or None.
+        """
+        slug = slug or slugify(name or '')
+        location = self._by_slug.get(slug)
+        if location is None and name:
+            location = self._by_name.get(name.lower())
+        return location
+
+    def resolve(self, name=None, slug=None, **attrs):
+        """
+        Return the location matching ``slug`` or ``name``, creating it with
+        ``attrs`` if there is none yet.
+        """
+        location = self.get(name, slug)
+        if location is not None:
+            self.hits += 1
+            return location
+
+        self.misses += 1
+        location = Location(name=name or slug, slug=slug or slugify(name),
+                            **attrs)
+        location.save()
+        self._remember(location)
+        return location
@@ -0,0 +1,347 @@
+"""
+Streaming importer for vCard 3.0 and 4.0 files.
+
+Cards are read one at a time from a file of any size. FN, N, NICKNAME,
+TITLE, NOTE and ORG fill in the contact; TEL, EMAIL, ADR, URL, IMPP, BDAY
+and ANNIVERSARY become child rows, with their TYPE parameter mapped to a
+``Location``. A card describing an organisation (``KIND:org``, or an ORG
+with no separate person name) is merged into the company of that name;
+the ORG of any other card is resolved to its company, which is created
+if need be.
+"""
+from __future__ import absolute_import
+
+import datetime
+import io
+import re
+
+from django.template.defaultfilters import slugify
+
+from contacts.importers.base import ContactBatch
+from contacts.importers.companies import CompanyResolver
+from contacts.importers.locations import LocationResolver
+from contacts.models import (Contact, PhoneNumber, EmailAddress,
+                             InstantMessenger, WebSite, StreetAddress,
+                             SpecialDate)
+
+# Structured properties whose components are separated by ";".
+STRUCTURED = ('N', 'ADR', 'ORG')
+
+# TYPE parameters and the locations they map to, most specific first.
+# Phone-only locations are flagged so that they are offered for phone
+# numbers alone.
+PHONE_TYPES = (
+    ('cell', 'Mobile', True),
+    ('fax', 'Fax', True),
+    ('pager', 'Pager', True),
+)
+PLACE_TYPES = (
+    ('work', 'Work', False),
+    ('home', 'Home', False),
+)
+OTHER_LOCATION = 'Other'
+
+# IMPP URI schemes and the matching ``InstantMessenger.service``.
+IM_SCHEMES = {
+    'aim': 'aim',
+    'msn': 'msn',
+    'msnim': 'msn',
+    'icq': 'icq',
+    'xmpp': 'jabber',
+    'ymsgr': 'yahoo',
+    'skype': 'skype',
+    'qq': 'qq',
+    'sametime': 'sametime',
+    'gg': 'gadu-gadu',
+    'gtalk': 'google-talk',
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y%m%d')
+
+ESCAPES = {'n': '\n', 'N': '\n', ',': ',', ';': ';', '\\': '\\'}
+
+
+def unescape(value):
+    return re.sub(r'\\(.)', lambda m: ESCAPES.get(m.group(1), m.group(1)),
+                  value)
+
+
+def split_components(value):
+    """
+    Split a structured value on the semicolons that are not escaped.
+    """
+    return [unescape(part) for part in re.split(r'(?<!\\);', value)]
+
+
+def parse_params(text):
+    """
+    Return the parameters of a content line as a dictionary of lower case
+    names to lists of values. vCard 2.1 style bare types such as ``;WORK``
+    are read as ``TYPE`` values.
+    """
+    params = {}
+    for param in re.findall(r'(?:[^;"]|"[^"]*")+', text):
+        name, sep, value = param.partition('=')
+        if not sep:
+            name, value = 'type', name
+        values = params.setdefault(name.strip().lower(), [])
+        for item in value.strip().strip('"').split(','):
+            values.append(item.strip().lower())
+    return params
+
+
+def parse_line(line):
+    """
+    Split an unfolded content line into its upper case property name,
+    parameters and raw value. Returns None for lines that are not
+    properties.
+    """
+    match = re.match(r'^(?:[\w-]+\.)?([\w-]+)((?:;(?:[^:"]|"[^"]*")*)?):(.*)$',
+                     line)
+    if match is None:
+        return None
+    name, params, value = match.groups()
+    return name.upper(), parse_params(params[1:]), value
+
+
+def unfold(lines):
+    """
+    Join folded content lines, which continue on lines starting with a
+    space or a tab.
+    """
+    current = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line.lstrip(u'\ufeff')
+    if current is not None:
+        yield current
+
+
+def read_cards(lines):
+    """
+    Yield the properties of each card in ``lines`` as a list of
+    ``(name, params, value)`` tuples.
+    """
+    card = None
+    for line in unfold(lines):
+        prop = parse_line(line)
+        if prop is None:
+            continue
+        name, params, value = prop
+        if name == 'BEGIN' and value.strip().upper() == 'VCARD':
+            card = []
+        elif name == 'END' and value.strip().upper() == 'VCARD':
+            if card is not None:
+                yield card
+            card = None
+        elif card is not None:
+            card.append(prop)
+
+
+def parse_date(value):
+    value = value.split('T')[0].strip()
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def clip(model, field, value):
+    """
+    Cut ``value`` down to the length of ``model.field``.
+    """
+    max_length = model._meta.get_field(field).max_length
+    if value and max_length:
+        return value[:max_length]
+    return value
+
+
+class VCardImporter(object):
+    """
+    Import contacts from a vCard file, writing them in ``bulk_create``
+    batches. Locations and companies are resolved through one
+    ``LocationResolver`` and ``CompanyResolver`` per run.
+    """
+    def __init__(self, batch_size=500, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def run(self, source):
+        """
+        Import every card in ``source``, a path or file object, and return
+        the ``ImportStats``.
+        """
+        batch = ContactBatch(self.batch_size, progress=self.progress)
+        self.locations = LocationResolver()
+        self.companies = CompanyResolver()
+
+        if isinstance(source, basestring):
+            with io.open(source, 'rb') as lines:
+                self.read(lines, batch)
+        else:
+            self.read(source, batch)
+
+        batch.flush()
+        batch.stats.location_hits = self.locations.hits
+        batch.stats.location_misses = self.locations.misses
+        batch.stats.company_hits = self.companies.hits
+        batch.stats.company_misses = self.companies.misses
+        return batch.stats
+
+    def read(self, lines, batch):
+        for properties in read_cards(lines):
+            batch.stats.read += 1
+            card = self.parse_card(properties)
+            if card is None:
+                batch.stats.skipped += 1
+                continue
+
+            values, organisation, children = card
+            if values.pop('is_company'):
+                pk = self.companies.resolve(organisation, **values)
+                batch.add_children(pk, children)
+            else:
+                if organisation:
+                    values['company_id'] = self.companies.resolve(organisation)
+                batch.add(Contact(**values), children)
+
+    def parse_card(self, properties):
+        """
+        Return the contact field values, organisation name and child rows
+        of a card, or None if it names nobody.
+        """
+        values = {}
+        children = []
+        formatted_name = organisation = kind = None
+
+        for name, params, value in properties:
+            if name in STRUCTURED:
+                parts = split_components(value)
+            else:
+                value = unescape(value).strip()
+
+            if name == 'FN':
+                formatted_name = value
+            elif name == 'N':
+                parts += [''] * (5 - len(parts))
+                for field, part in zip(('last_name', 'first_name',
+                                        'middle_name', 'prefix', 'suffix'),
+                                       parts):
+                    if part.strip():
+                        values[field] = clip(Contact, field, part.strip())
+            elif name == 'ORG':
+                organisation = parts[0].strip() or None
+            elif name == 'KIND':
+                kind = value.lower()
+            elif name == 'X-ABSHOWAS' and value.upper() == 'COMPANY':
+                kind = 'org'
+            elif name == 'NICKNAME':
+                values['nickname'] = clip(Contact, 'nickname',
+                                          value.split(',')[0].strip())
+            elif name == 'TITLE':
+                values['title'] = clip(Contact, 'title', value)
+            elif name == 'NOTE':
+                values['about'] = value
+            else:
+                child = self.parse_child(name, params,
+                                         parts if name in STRUCTURED
+                                         else value)
+                if child is not None:
+                    children.append(child)
+
+        has_name = any(values.get(field) for field in
+                       ('first_name', 'last_name', 'middle_name'))
+        is_company = bool(organisation) and (
+            kind == 'org' or
+            (not has_name and formatted_name in (None, '', organisation)))
+        values['is_company'] = is_company
+
+        if is_company:
+            values.pop('title', None)
+            for field in ('last_name', 'first_name', 'middle_name', 'prefix',
+                          'suffix'):
+                values.pop(field, None)
+        elif not has_name:
+            if not formatted_name:
+                return None
+            words = formatted_name.split()
+            values['first_name'] = clip(Contact, 'first_name', words[0])
+            if len(words) > 1:
+                values['last_name'] = clip(Contact, 'last_name',
+                                           ' '.join(words[1:]))
+
+        if not is_company:
+            full_name = ' '.join(values.get(field) or '' for field in
+                                 ('first_name', 'last_name'))
+            values['slug'] = slugify(full_name)[:50]
+        return values, organisation, children
+
+    def parse_child(self, name, params, value):
+        types = params.get('type', [])
+        if name == 'TEL':
+            if value.lower().startswith('tel:'):
+                value = value[4:]
+            if value:
+                return PhoneNumber(
+                    phone_number=clip(PhoneNumber, 'phone_number', value),
+                    location=self.location_for(types, PHONE_TYPES))
+        elif name == 'EMAIL':
+            if value:
+                return EmailAddress(
+                    email_address=clip(EmailAddress, 'email_address', value),
+                    location=self.location_for(types))
+        elif name == 'URL':
+            if value:
+                return WebSite(url=clip(WebSite, 'url', value),
+                               location=self.location_for(types))
+        elif name == 'IMPP':
+            scheme, sep, account = value.partition(':')
+            if not sep:
+                scheme, account = '', value
+            if account:
+                return InstantMessenger(
+                    im_account=clip(InstantMessenger, 'im_account', account),
+                    service=IM_SCHEMES.get(scheme.lower(),
+                                           InstantMessenger.OTHER),
+                    location=self.location_for(types))
+        elif name == 'ADR':
+            value += [''] * (7 - len(value))
+            po_box, extended, street, city, province, postal_code, country = [
+                part.strip() for part in value[:7]]
+            if any((po_box, extended, street, city, province, postal_code,
+                    country)):
+                return StreetAddress(
+                    street=street,
+                    street2=' '.join(part for part in (extended, po_box)
+                                     if part),
+                    city=clip(StreetAddress, 'city', city),
+                    province=clip(StreetAddress, 'province', province),
+                    postal_code=clip(StreetAddress, 'postal_code',
+                                     postal_code),
+                    country=clip(StreetAddress, 'country', country),
+                    location=self.location_for(types))
+        elif name in ('BDAY', 'ANNIVERSARY'):
+            date = parse_date(value)
+            if date is not None:
+                return SpecialDate(
+                    occasion=name == 'BDAY' and 'Birthday' or 'Anniversary',
+                    date=date, every_year=True)
+        return None
+
+    def location_for(self, types, specific=()):
+        """
+        Return the location for a property with the given TYPE values.
+        """
+        for type, name, is_phone in tuple(specific) + PLACE_TYPES:
+            if type in types:
+                return self.locations.resolve(name=name, is_phone=is_phone)
+        return self.locations.resolve(name=OTHER_LOCATION)
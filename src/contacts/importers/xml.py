@@ -0,0 +1,234 @@
+"""
+Streaming importer for XML contact dumps.
+
+A dump is any document holding ``<Contact>`` elements laid out the way
+``Contact.create_from_xml`` reads them: one child element per field, plus
+``<PhoneNumber>``, ``<EmailAddress>``, ``<StreetAddress>``, ``<WebSite>``,
+``<InstantMessenger>`` and ``<SpecialDate>`` elements for the child rows,
+each of which may carry a ``<Location>``. A person's company is named by a
+``<company>`` element.
+"""
+from __future__ import absolute_import
+
+from lxml import etree
+
+from django.core.exceptions import ValidationError
+
+from contacts import objectcache, search
+from contacts.importers.base import ContactBatch
+from contacts.importers.companies import CompanyResolver
+from contacts.importers.locations import LocationResolver
+from contacts.models import (Contact, Location, PhoneNumber, EmailAddress,
+                             InstantMessenger, WebSite, StreetAddress,
+                             SpecialDate)
+from contacts.normalize import email_key
+
+CHILD_ELEMENTS = {
+    'PhoneNumber': PhoneNumber,
+    'EmailAddress': EmailAddress,
+    'InstantMessenger': InstantMessenger,
+    'WebSite': WebSite,
+    'StreetAddress': StreetAddress,
+    'SpecialDate': SpecialDate,
+}
+
+
+def element_fields(model):
+    """
+    Return the fields of ``model`` carried as XML child elements, keyed by
+    element tag. Primary keys and relations are left out.
+    """
+    return dict((f.name, f) for f in model._meta.fields
+                if not f.primary_key and not f.rel)
+
+
+def element_values(model, element):
+    """
+    Convert the field elements under ``element`` into keyword arguments
+    for ``model``.
+    """
+    fields = element_fields(model)
+    values = {}
+    for child in element:
+        field = fields.get(child.tag)
+        if field is None:
+            continue
+        if child.text is None and not field.null:
+            continue
+        values[field.attname] = field.to_python(child.text)
+    return values
+
+
+# People are linked to their company this many at a time, which keeps
+# each query under the parameter limits of SQLite and Oracle.
+LOOKUP_BATCH_SIZE = 500
+
+
+def name_key(name):
+    return (name or u'').strip().lower()
+
+
+class XMLImporter(object):
+    """
+    Import contacts from an XML dump with ``iterparse``.
+
+    Each ``<Contact>`` element is cleared as soon as it has been read, so
+    memory use depends on the batch size rather than on the document.
+    Locations are shared through a ``LocationResolver`` instead of being
+    created once per child row.
+
+    Company elements are imported as companies of their own. The
+    ``<company>`` of a person is looked up among the companies of the
+    dump first, wherever they appear in it, then among the existing
+    companies by name, and is created if there is none. The keys of the
+    dump's companies are kept for the whole run, as are those of the
+    people whose company had not been written yet when they were read;
+    these are linked once the last batch is written.
+
+    With ``merge_companies`` a company element is instead merged into an
+    existing company of the same name, keeping that company's fields,
+    and is not counted as an imported contact.
+    """
+    tag = 'Contact'
+
+    def __init__(self, batch_size=500, progress=None, merge_companies=False):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.merge_companies = merge_companies
+
+    def run(self, source):
+        """
+        Import every contact in ``source``, a path or file object, and
+        return the ``ImportStats``.
+        """
+        batch = ContactBatch(self.batch_size, progress=self.progress)
+        self.locations = LocationResolver()
+        self.companies = CompanyResolver()
+        # The keys of the companies of the dump by name, and the people
+        # waiting for their company by company name.
+        self.file_companies = {}
+        self.queued_companies = {}
+        self.queued_people = []
+        self.unlinked = {}
+
+        for event, element in etree.iterparse(source, events=('end',),
+                                              tag=self.tag):
+            batch.stats.read += 1
+            try:
+                values, organisation, children = self.parse_contact(element)
+            except ValidationError:
+                batch.stats.skipped += 1
+            else:
+                self.add(batch, values, organisation, children)
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        batch.flush()
+        self.written()
+        self.link_people()
+        batch.stats.location_hits = self.locations.hits
+        batch.stats.location_misses = self.locations.misses
+        batch.stats.company_hits = self.companies.hits
+        batch.stats.company_misses = self.companies.misses
+        return batch.stats
+
+    def add(self, batch, values, organisation, children):
+        """
+        Queue a contact, linking a person to its company when the company
+        has been written already.
+        """
+        if values.get('is_company') and self.merge_companies \
+                and values.get('name'):
+            name = values.pop('name')
+            del values['is_company']
+            values.pop('slug', None)
+            batch.add_children(self.companies.resolve(name, **values),
+                               children)
+            return
+
+        contact = Contact(**values)
+        if contact.is_company:
+            key = name_key(contact.name)
+            if key and key not in self.file_companies \
+                    and key not in self.queued_companies:
+                self.queued_companies[key] = contact
+        elif organisation:
+            company_id = self.file_companies.get(name_key(organisation))
+            if company_id is not None:
+                contact.company_id = company_id
+            else:
+                self.queued_people.append((organisation, contact))
+
+        batches = batch.stats.batches
+        batch.add(contact, children)
+        if batch.stats.batches != batches:
+            self.written()
+
+    def written(self):
+        """
+        Keep the keys of the queued companies and of the people still
+        waiting for their company once they have been written.
+        """
+        for key, company in self.queued_companies.items():
+            self.file_companies[key] = company.pk
+        self.queued_companies = {}
+        for organisation, person in self.queued_people:
+            self.unlinked.setdefault(name_key(organisation), (
+                organisation.strip(), []))[1].append(person.pk)
+        self.queued_people = []
+
+    def link_people(self):
+        """
+        Link the people read before their company, looking the company up
+        among those of the dump first and by name after that.
+        """
+        for key, (organisation, people) in self.unlinked.items():
+            company_id = self.file_companies.get(key)
+            if company_id is None:
+                company_id = self.companies.resolve(organisation)
+            company = Contact.objects.get(pk=company_id)
+            for start in range(0, len(people), LOOKUP_BATCH_SIZE):
+                ids = people[start:start + LOOKUP_BATCH_SIZE]
+                with objectcache.atomic():
+                    Contact.objects.filter(pk__in=ids).update(
+                        company=company_id)
+                    search.index_company(company, ids)
+                    objectcache.invalidate(ids)
+        self.unlinked = {}
+
+    def parse_contact(self, element):
+        """
+        Return the contact field values, company name and child rows of a
+        ``<Contact>`` element.
+        """
+        values = element_values(Contact, element)
+        organisation = None
+        if not values.get('is_company'):
+            organisation = element.findtext('company') or None
+        children = []
+        addresses = set()
+        for child in element:
+            model = CHILD_ELEMENTS.get(child.tag)
+            if model is None:
+                continue
+            row = self.parse_child(model, child)
+            if model is EmailAddress:
+                # Drop addresses repeated with different case.
+                key = email_key(row.email_address)
+                if key in addresses:
+                    continue
+                addresses.add(key)
+            children.append(row)
+        return values, organisation, children
+
+    def parse_child(self, model, element):
+        values = element_values(model, element)
+        location_element = element.find('Location')
+        if location_element is not None:
+            values['location'] = self.location_for(location_element)
+        return model(**values)
+
+    def location_for(self, element):
+        return self.locations.resolve(**element_values(Location, element))
@@ -0,0 +1,33 @@
+from django.db import transaction
+
+
+def backfill(queryset, fields, batch_size=500, progress=None):
+    """
+    Call ``denormalize()`` on every row of ``queryset`` and write back
+    ``fields``, ``batch_size`` rows per transaction. The columns are
+    written with ``update()``, so no signals are sent. Rows are read in primary key
+    order by seeking past the last key, so each batch costs the same.
+    Returns the number of rows updated.
+    """
+    count = 0
+    last_pk = None
+    while True:
+        rows = queryset.order_by('pk')
+        if last_pk is not None:
+            rows = rows.filter(pk__gt=last_pk)
+        rows = list(rows[:batch_size])
+        if not rows:
+            break
+
+        manager = queryset.model._default_manager
+        with transaction.atomic():
+            for row in rows:
+                row.denormalize()
+                manager.filter(pk=row.pk).update(
+                    **dict((field, getattr(row, field)) for field in fields))
+
+        count += len(rows)
+        last_pk = rows[-1].pk
+        if progress is not None:
+            progress(count)
+    return count
@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts.management.commands._backfill import backfill
+from contacts.models import EmailAddress
+
+
+class Command(BaseCommand):
+    help = 'Fills in the normalized lookup column of every email address.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of email addresses updated per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(count):
+            if verbosity > 1:
+                self.stdout.write('%d email addresses updated' % count)
+
+        count = backfill(EmailAddress.objects.all(), ['normalized_address'],
+                         options['batch_size'], progress)
+
+        if verbosity:
+            self.stdout.write('Updated %d email addresses.' % count)
@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts.management.commands._backfill import backfill
+from contacts.models import PhoneNumber
+
+
+class Command(BaseCommand):
+    help = 'Fills in the normalized lookup columns of every phone number.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of phone numbers updated per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(count):
+            if verbosity > 1:
+                self.stdout.write('%d phone numbers updated' % count)
+
+        count = backfill(PhoneNumber.objects.all(),
+                         ['normalized_number', 'reversed_number'],
+                         options['batch_size'], progress)
+
+        if verbosity:
+            self.stdout.write('Updated %d phone numbers.' % count)
@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts.management.commands._backfill import backfill
+from contacts.models import SpecialDate
+
+
+class Command(BaseCommand):
+    help = 'Fills in the calendar columns of every special date.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of special dates updated per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(count):
+            if verbosity > 1:
+                self.stdout.write('%d special dates updated' % count)
+
+        count = backfill(SpecialDate.objects.all(),
+                         ['month_day', 'next_occurrence'],
+                         options['batch_size'], progress)
+
+        if verbosity:
+            self.stdout.write('Updated %d special dates.' % count)
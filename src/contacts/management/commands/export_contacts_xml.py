@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.exporters.xml import export_xml
+
+
+class Command(BaseCommand):
+    args = '<file.xml>'
+    help = 'Exports every contact and its child rows to an XML dump.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=500,
+                    help='Number of contacts read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: export_contacts_xml %s' % self.args)
+
+        try:
+            count = export_xml(args[0], chunk_size=options['chunk_size'])
+        except IOError, e:
+            raise CommandError(str(e))
+
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('Exported %d contacts.' % count)
@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts.dedupe import DuplicateFinder
+
+
+class Command(BaseCommand):
+    help = ('Finds contacts that may be duplicates and lists them in the '
+            'duplicate candidates table for review.')
+    option_list = BaseCommand.option_list + (
+        make_option('--threshold', dest='threshold', type='float',
+                    default=0.5,
+                    help='Lowest score, from 0 to 1, of a pair to list.'),
+        make_option('--max-block-size', dest='max_block_size', type='int',
+                    default=50,
+                    help='Skip blocking keys shared by more contacts than '
+                         'this.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=250,
+                    help='Number of pairs scored per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(finder):
+            if verbosity > 1:
+                self.stdout.write('%d pairs scored, %d candidates' % (
+                    finder.pairs, finder.candidates))
+
+        finder = DuplicateFinder(options['threshold'],
+                                 options['max_block_size'],
+                                 options['batch_size'], progress)
+        finder.run()
+
+        if verbosity:
+            self.stdout.write(
+                'Built %d blocking keys; scored %d pairs from %d blocks '
+                '(%d too large to score); found %d candidates.' % (
+                    finder.keys, finder.pairs, finder.blocks,
+                    finder.oversized_blocks, finder.candidates))
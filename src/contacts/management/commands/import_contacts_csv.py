@@ -0,0 +1,69 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.importers.csv import CSVImporter
+
+
+class Command(BaseCommand):
+    args = '<file.csv>'
+    help = 'Imports contacts from a CSV file in bulk batches.'
+    option_list = BaseCommand.option_list + (
+        make_option('--map', dest='mapping', action='append',
+                    metavar='COLUMN=FIELD',
+                    help='Read the CSV column COLUMN into FIELD. May be '
+                         'repeated; without it, columns named after fields '
+                         'are read.'),
+        make_option('--rejects', dest='rejects',
+                    help='Write rows that can not be imported to this file.'),
+        make_option('--location', dest='location', default='Other',
+                    help='Location of the imported phone numbers, email '
+                         'addresses, web sites and street addresses.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of contacts written per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: import_contacts_csv %s' % self.args)
+
+        mapping = None
+        if options.get('mapping'):
+            mapping = {}
+            for item in options['mapping']:
+                column, sep, field = item.rpartition('=')
+                if not sep or not column or not field:
+                    raise CommandError('--map takes COLUMN=FIELD, not %r'
+                                       % item)
+                mapping[column.decode('utf-8')] = field
+
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(stats):
+            if verbosity:
+                self.stdout.write('%d rows read (%.1f rows/sec)' % (
+                    stats.read, stats.read_rate))
+
+        rejects = None
+        try:
+            if options.get('rejects'):
+                rejects = open(options['rejects'], 'wb')
+            importer = CSVImporter(mapping, batch_size=options['batch_size'],
+                                   location=options['location'],
+                                   rejects=rejects, progress=progress)
+            stats = importer.run(args[0])
+        except (IOError, ValueError), e:
+            raise CommandError(str(e))
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        if verbosity:
+            self.stdout.write(
+                'Read %d rows in %.1f seconds: imported %d contacts and %d '
+                'child rows, rejected %d.' % (
+                    stats.read, stats.elapsed, stats.contacts,
+                    stats.children, stats.skipped))
+            self.stdout.write('Companies: %d reused, %d created.' % (
+                stats.company_hits, stats.company_misses))
@@ -0,0 +1,51 @@
+from optparse import make_option
+
+from lxml import etree
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.importers.xml import XMLImporter
+
+
+class Command(BaseCommand):
+    args = '<file.xml>'
+    help = 'Imports contacts from an XML dump in bulk batches.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of contacts written per batch.'),
+        make_option('--merge-companies', action='store_true',
+                    dest='merge_companies', default=False,
+                    help='Merge companies into existing companies of the '
+                         'same name instead of importing them.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: import_contacts_xml %s' % self.args)
+
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(stats):
+            if verbosity:
+                self.stdout.write('%d contacts imported (%.1f contacts/sec)' % (
+                    stats.contacts, stats.rate))
+
+        importer = XMLImporter(batch_size=options['batch_size'],
+                               progress=progress,
+                               merge_companies=options['merge_companies'])
+        try:
+            stats = importer.run(args[0])
+        except (IOError, etree.XMLSyntaxError), e:
+            raise CommandError(str(e))
+
+        if verbosity:
+            self.stdout.write(
+                'Imported %d contacts and %d child rows in %.1f seconds '
+                '(%.1f contacts/sec, %d skipped).' % (
+                    stats.contacts, stats.children, stats.elapsed,
+                    stats.rate, stats.skipped))
+            self.stdout.write('Locations: %d reused, %d created.' % (
+                stats.location_hits, stats.location_misses))
+            self.stdout.write('Companies: %d reused, %d created.' % (
+                stats.company_hits, stats.company_misses))
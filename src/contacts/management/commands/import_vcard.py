@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contacts.importers.vcard import VCardImporter
+
+
+class Command(BaseCommand):
+    args = '<file.vcf>'
+    help = 'Imports contacts from a vCard file in bulk batches.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of contacts written per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: import_vcard %s' % self.args)
+
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(stats):
+            if verbosity:
+                self.stdout.write('%d cards read (%.1f cards/sec)' % (
+                    stats.read, stats.read_rate))
+
+        importer = VCardImporter(batch_size=options['batch_size'],
+                                 progress=progress)
+        try:
+            stats = importer.run(args[0])
+        except IOError, e:
+            raise CommandError(str(e))
+
+        if verbosity:
+            self.stdout.write(
+                'Read %d cards in %.1f seconds (%.1f cards/sec): imported '
+                '%d contacts and %d child rows, %d skipped.' % (
+                    stats.read, stats.elapsed, stats.read_rate,
+                    stats.contacts, stats.children, stats.skipped))
+            self.stdout.write('Locations: %d reused, %d created.' % (
+                stats.location_hits, stats.location_misses))
+            self.stdout.write('Companies: %d reused, %d created.' % (
+                stats.company_hits, stats.company_misses))
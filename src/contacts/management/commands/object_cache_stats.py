@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts import objectcache
+
+
+class Command(BaseCommand):
+    help = ('Shows the hits and misses of the cache behind the person, '
+            'company and group detail pages.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset',
+                    default=False,
+                    help='Set the counters back to zero afterwards.'),
+    )
+
+    def handle(self, *args, **options):
+        stats = objectcache.stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = lookups and 100.0 * stats['hits'] / lookups or 0.0
+        self.stdout.write('%d hits, %d misses (%.1f%% hit rate).' % (
+            stats['hits'], stats['misses'], ratio))
+        if options['reset']:
+            objectcache.reset_stats()
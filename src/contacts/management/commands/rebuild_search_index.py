@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from contacts.exporters.base import iter_contacts
+from contacts.search import index_contacts
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the contact search index.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of contacts indexed per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+
+        batch = []
+        count = 0
+        for contact in iter_contacts(chunk_size=batch_size):
+            batch.append(contact)
+            if len(batch) >= batch_size:
+                index_contacts(batch)
+                count += len(batch)
+                batch = []
+                if verbosity > 1:
+                    self.stdout.write('%d contacts indexed' % count)
+        if batch:
+            index_contacts(batch)
+            count += len(batch)
+
+        if verbosity:
+            self.stdout.write('Indexed %d contacts.' % count)
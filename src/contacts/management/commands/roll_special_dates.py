@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from contacts.models import SpecialDate
+
+
+class Command(BaseCommand):
+    help = ('Moves the next occurrence of yearly special dates that have '
+            'passed on to their next anniversary. Run it daily.')
+
+    def handle(self, *args, **options):
+        moved = SpecialDate.objects.roll_forward()
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('Rolled forward %d special dates.' % moved)
@@ -1,18 +1,101 @@
+import calendar
 import datetime
 
 from django.db.models import Manager, Q
 
+from contacts.normalize import (phone_digits, email_key, month_day,
+                               next_anniversary)
 
-class CompanyManager(Manager):
+
+class ContactManager(Manager):
+        def search(self, query, limit=50):
+                """
+                Return the contacts matching ``query``, best match first.
+                """
+                from contacts.search import search
+                return search(query, self.get_queryset(), limit)
+
+        def complete(self, query, limit=10):
+                """
+                Return the contacts whose names start with the words of
+                ``query``, for autocompletion.
+                """
+                from contacts.search import complete
+                return complete(query, self.get_queryset(), limit)
+
+
+class CompanyManager(ContactManager):
         def get_queryset(self):
                 return super(CompanyManager, self).get_queryset().filter(is_company=True)
 
 
-class PersonManager(Manager):
+class PersonManager(ContactManager):
         def get_queryset(self):
                 return super(PersonManager, self).get_queryset().filter(is_company=False)
 
 
+class PhoneNumberManager(Manager):
+        # Numbers are compared on at most their last MATCH_DIGITS digits,
+        # so that a number stored with or without its country code still
+        # matches, and not at all below MIN_MATCH_DIGITS.
+        MATCH_DIGITS = 10
+        MIN_MATCH_DIGITS = 7
+
+        def matching(self, number):
+                """
+                Return the phone numbers ending in the digits of ``number``.
+                """
+                suffix = phone_digits(number)[-self.MATCH_DIGITS:]
+                if len(suffix) < self.MIN_MATCH_DIGITS:
+                        return self.get_queryset().none()
+                return self.get_queryset().filter(
+                        reversed_number__startswith=suffix[::-1])
+
+        def lookup(self, number):
+                """
+                Return the contact owning ``number``, or None. An exact match
+                on the normalized number wins over a suffix match.
+                """
+                digits = phone_digits(number)
+                matches = list(self.matching(number)
+                               .select_related('contact')
+                               .order_by('pk')[:20])
+                if not matches:
+                        return None
+                for match in matches:
+                        if match.normalized_number == digits:
+                                return match.contact
+                return matches[0].contact
+
+
+class EmailAddressManager(Manager):
+        # Addresses are looked up this many at a time, which keeps each
+        # query under the parameter limits of SQLite and Oracle.
+        LOOKUP_BATCH_SIZE = 500
+
+        def owners_of(self, addresses):
+                """
+                Return a dictionary mapping each of ``addresses`` that is
+                on file, in its normalized form, to the list of contacts
+                using it. Case and surrounding white space are ignored.
+                """
+                keys = sorted(set(email_key(address) for address in addresses
+                                  if address))
+                owners = {}
+                for start in range(0, len(keys), self.LOOKUP_BATCH_SIZE):
+                        batch = keys[start:start + self.LOOKUP_BATCH_SIZE]
+                        rows = (self.get_queryset()
+                                .filter(normalized_address__in=batch)
+                                .select_related('contact')
+                                .order_by('contact'))
+                        for row in rows:
+                                contacts = owners.setdefault(
+                                        row.normalized_address, [])
+                                if row.contact not in contacts:
+                                        contacts.append(row.contact)
+                return owners
+
+
 class SpecialDateManager(Manager):
 
         def get_dates_for_day(self, date=None):
@@ -25,7 +108,7 @@ class SpecialDateManager(Manager):
 
                 special_dates = self.get_queryset().filter(
                         Q(date=date) |
-                        Q(every_year=True, date__month=date.month, date__day=date.day)
+                        Q(every_year=True, month_day=month_day(date))
                 )
 
                 return special_dates
@@ -38,9 +121,14 @@ class SpecialDateManager(Manager):
                 if not date:
                         date = datetime.date.today()
 
+                first = date.replace(day=1)
+                last = first.replace(
+                        day=calendar.monthrange(date.year, date.month)[1])
+
                 special_dates = self.get_queryset().filter(
-                        Q(date__month=date.month, date__year=date.year) |
-                        Q(every_year=True, date__month=date.month)
+                        Q(date__range=(first, last)) |
+                        Q(every_year=True,
+                          month_day__range=(month_day(first), month_day(last)))
                 )
 
                 return special_dates
@@ -59,3 +147,63 @@ class SpecialDateManager(Manager):
                 )
 
                 return special_dates
+
+        def get_dates_between(self, start, end):
+                """
+                Return the list of special days from ``start`` to ``end``,
+                both included. Dates recurring every year are matched on
+                their month and day, wrapping around the end of the year
+                when the range does.
+                """
+                if end < start:
+                        return self.get_queryset().none()
+
+                if (end - start).days >= 365:
+                        recurring = Q(every_year=True)
+                elif start.year == end.year:
+                        recurring = Q(every_year=True,
+                                      month_day__range=(month_day(start),
+                                                        month_day(end)))
+                else:
+                        recurring = Q(every_year=True) & (
+                                Q(month_day__gte=month_day(start)) |
+                                Q(month_day__lte=month_day(end)))
+
+                return self.get_queryset().filter(
+                        Q(date__range=(start, end)) | recurring)
+
+        def upcoming(self, days=30, limit=50, today=None):
+                """
+                Return up to ``limit`` special days falling within ``days``
+                days from today, soonest first, with one range scan on
+                ``next_occurrence``. Run ``roll_special_dates`` daily so
+                that dates recurring every year stay current.
+                """
+                today = today or datetime.date.today()
+                end = today + datetime.timedelta(days=days)
+                return (self.get_queryset()
+                        .filter(next_occurrence__range=(today, end))
+                        .order_by('next_occurrence', 'pk')[:limit])
+
+        def roll_forward(self, today=None):
+                """
+                Move the next occurrence of every yearly date that has
+                passed on to its next anniversary, with one UPDATE per
+                day of the year. Returns the number of dates moved.
+                Dates without a month and day are left alone; run
+                ``backfill_special_dates`` to fill them in.
+                """
+                today = today or datetime.date.today()
+                stale = self.get_queryset().filter(
+                        every_year=True, next_occurrence__lt=today,
+                        month_day__isnull=False)
+                moved = 0
+                ordinals = (stale.order_by()
+                            .values_list('month_day', flat=True).distinct())
+                for ordinal in list(ordinals):
+                        # 2000 is a leap year, so 29 February is valid.
+                        date = datetime.date(2000, ordinal // 100,
+                                             ordinal % 100)
+                        moved += stale.filter(month_day=ordinal).update(
+                                next_occurrence=next_anniversary(date, today))
+                return moved
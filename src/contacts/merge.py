@@ -0,0 +1,271 @@
+"""
+Merging duplicate contacts.
+
+``merge_contacts`` folds any number of source contacts into their targets
+inside one transaction. Child rows, the people of a company and group
+memberships are moved with one ``UPDATE ... CASE`` per table, which maps
+each source to its target, rather than one query per row or target.
+Child rows that the target already has (the same phone number, email
+address, instant messenger account, web site, street address or special
+date) are dropped instead of moved, and blank fields of the target are
+filled in from its sources the same way, one UPDATE per field. The
+sources are then deleted, so the number of queries does not grow with the
+number of contacts merged.
+"""
+from django.db import connection
+from django.utils import timezone
+
+from contacts import objectcache, search
+from contacts.models import (Contact, Group, PhoneNumber, EmailAddress,
+                             InstantMessenger, WebSite, StreetAddress,
+                             SpecialDate, SearchToken, BlockingKey,
+                             DuplicateCandidate)
+
+# The values that make two child rows of a contact the same.
+CHILD_IDENTITIES = (
+    (PhoneNumber, ('normalized_number',)),
+    (EmailAddress, ('normalized_address',)),
+    (InstantMessenger, ('service', 'im_account')),
+    (WebSite, ('url',)),
+    (StreetAddress, ('street', 'street2', 'city', 'province', 'postal_code',
+                     'country')),
+    (SpecialDate, ('occasion', 'date', 'every_year')),
+)
+
+# This app's tables whose rows are dropped with a merged source, and
+# their references to it.
+OWN_REFERENCES = (
+    (SearchToken, ('contact',)),
+    (BlockingKey, ('contact',)),
+    (DuplicateCandidate, ('contact', 'duplicate')),
+)
+
+# Fields of the target filled in from a source when they are blank.
+FILLED_FIELDS = ('name', 'first_name', 'middle_name', 'last_name', 'prefix',
+                 'suffix', 'nickname', 'title', 'about', 'company_id')
+
+# Contacts are looked up this many at a time, which keeps each query
+# under the parameter limits of SQLite and Oracle.
+LOOKUP_BATCH_SIZE = 500
+
+# Rows are updated this many keys at a time. Each key takes three
+# parameters in an ``UPDATE ... CASE``.
+UPDATE_BATCH_SIZE = 300
+
+
+def _in_batches(ids, size=LOOKUP_BATCH_SIZE):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _update_by_key(model, field, key_field, values):
+    """
+    Set ``field`` of each ``model`` row whose ``key_field`` is a key of
+    ``values`` to the value under that key, with one ``UPDATE ... CASE``
+    per ``UPDATE_BATCH_SIZE`` keys.
+    """
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(field)
+    key_column = qn(model._meta.get_field(key_field).column)
+    for keys in _in_batches(values, UPDATE_BATCH_SIZE):
+        params = []
+        for key in keys:
+            params.append(key)
+            params.append(field.get_db_prep_save(values[key], connection))
+        params.extend(keys)
+        connection.cursor().execute(
+            'UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+                qn(model._meta.db_table), qn(field.column), key_column,
+                ' '.join(['WHEN %s THEN %s'] * len(keys)), key_column,
+                ', '.join(['%s'] * len(keys))),
+            params)
+
+
+def _identity(values):
+    return tuple(isinstance(value, basestring) and value.strip().lower()
+                 or value for value in values)
+
+
+def resolve_targets(pairs):
+    """
+    Return a dictionary mapping each source key in ``pairs`` of
+    ``(source, target)`` keys to its final target, following chains such
+    as A into B and B into C. Raises ``ValueError`` for a contact merged
+    into itself, directly or through a cycle, or into two targets.
+    """
+    targets = {}
+    for source, target in pairs:
+        if source == target:
+            raise ValueError('Can not merge contact %s into itself' % source)
+        if targets.get(source, target) != target:
+            raise ValueError('Contact %s is merged into more than one '
+                             'contact' % source)
+        targets[source] = target
+
+    resolved = {}
+    for source in targets:
+        target = targets[source]
+        seen = set([source])
+        while target in targets:
+            if target in seen:
+                raise ValueError('Contact %s is merged into itself' % source)
+            seen.add(target)
+            target = targets[target]
+        resolved[source] = target
+    return resolved
+
+
+def _move_children(targets, sources_of):
+    """
+    Drop the source child rows the targets already have, and move the
+    rest with one UPDATE per table.
+    """
+    contact_ids = set(targets) | set(sources_of)
+    for model, fields in CHILD_IDENTITIES:
+        rows = []
+        for ids in _in_batches(contact_ids):
+            rows.extend(model.objects.filter(contact__in=ids)
+                        .values_list('pk', 'contact', *fields))
+        rows.sort(key=lambda row: (row[1] in targets, row[0]))
+
+        seen = {}
+        for row in rows:
+            if row[1] in sources_of:
+                seen.setdefault(row[1], set()).add(_identity(row[2:]))
+
+        duplicates = []
+        for row in rows:
+            contact_id = row[1]
+            if contact_id in targets:
+                target = targets[contact_id]
+                identity = _identity(row[2:])
+                known = seen.setdefault(target, set())
+                if identity in known:
+                    duplicates.append(row[0])
+                else:
+                    known.add(identity)
+
+        for ids in _in_batches(duplicates):
+            model.objects.filter(pk__in=ids)._raw_delete(connection.alias)
+        _update_by_key(model, 'contact', 'contact', targets)
+
+
+def _move_memberships(through, field, targets, sources_of):
+    """
+    Move the group memberships of the sources to their targets, dropping
+    those in groups the target already belongs to.
+    """
+    column = '%s_id' % field
+    rows = []
+    for ids in _in_batches(set(targets) | set(sources_of)):
+        rows.extend(through.objects.filter(**{'%s__in' % column: ids})
+                    .values_list('pk', column, 'group_id'))
+    rows.sort(key=lambda row: (row[1] in targets, row[0]))
+
+    groups = set()
+    duplicates = []
+    for pk, contact_id, group_id in rows:
+        key = (targets.get(contact_id, contact_id), group_id)
+        if key in groups:
+            duplicates.append(pk)
+        else:
+            groups.add(key)
+
+    for ids in _in_batches(duplicates):
+        through.objects.filter(pk__in=ids)._raw_delete(connection.alias)
+    _update_by_key(through, field, field, targets)
+
+
+def _delete_sources(sources):
+    """
+    Delete the sources. Their search tokens, blocking keys and duplicate
+    candidates are dropped first with one DELETE per table; the sources
+    themselves go through ``QuerySet.delete()``, so that the
+    ``on_delete`` of any other model referring to them is honoured.
+    """
+    for ids in _in_batches(sources):
+        Contact.objects.filter(pk__in=ids).update(user=None)
+        for model, fields in OWN_REFERENCES:
+            for field in fields:
+                model.objects.filter(**{'%s__in' % field: ids})._raw_delete(
+                    connection.alias)
+        Contact.objects.filter(pk__in=ids).delete()
+
+
+def _fill_targets(targets, sources_of):
+    """
+    Fill in blank fields of each target from its sources, in key order.
+    Returns the targets and the new values of the filled fields, keyed by
+    field and target.
+    """
+    contacts = {}
+    for ids in _in_batches(set(targets) | set(sources_of)):
+        contacts.update(Contact.objects.in_bulk(ids))
+
+    missing = (set(targets) | set(sources_of)) - set(contacts)
+    if missing:
+        raise Contact.DoesNotExist('Contacts %s do not exist' % ', '.join(
+            str(pk) for pk in sorted(missing)))
+
+    filled = {}
+    for target_id, sources in sources_of.items():
+        target = contacts[target_id]
+        for source_id in sorted(sources):
+            source = contacts[source_id]
+            if source.is_company != target.is_company:
+                raise ValueError('Can not merge a company and a person: '
+                                 '%s into %s' % (source_id, target_id))
+            for field in FILLED_FIELDS:
+                value = getattr(source, field)
+                if field == 'company_id' and value in targets:
+                    value = targets[value]
+                if value in (None, '') or value == target_id:
+                    continue
+                if getattr(target, field) in (None, ''):
+                    setattr(target, field, value)
+                    name = field == 'company_id' and 'company' or field
+                    filled.setdefault(name, {})[target_id] = value
+            if target.user_id is None and source.user_id is not None:
+                target.user_id = source.user_id
+                filled.setdefault('user', {})[target_id] = source.user_id
+    return [contacts[target_id] for target_id in sources_of], filled
+
+
+def merge_contacts(pairs):
+    """
+    Merge each source into its target for ``pairs`` of ``(source,
+    target)`` contacts or keys, and return the number of contacts merged.
+    """
+    pairs = [(getattr(source, 'pk', source), getattr(target, 'pk', target))
+             for source, target in pairs]
+    targets = resolve_targets(pairs)
+    if not targets:
+        return 0
+
+    sources_of = {}
+    for source, target in targets.items():
+        sources_of.setdefault(target, []).append(source)
+
+    with objectcache.atomic():
+        contacts, filled = _fill_targets(targets, sources_of)
+
+        _move_children(targets, sources_of)
+        _update_by_key(Contact, 'company', 'company', targets)
+        _move_memberships(Group.people.through, 'person', targets,
+                          sources_of)
+        _move_memberships(Group.companies.through, 'company', targets,
+                          sources_of)
+        _delete_sources(targets)
+
+        changed = set()
+        for field, values in filled.items():
+            _update_by_key(Contact, field, 'id', values)
+            changed.update(values)
+        for ids in _in_batches(changed):
+            Contact.objects.filter(pk__in=ids).update(
+                date_modified=timezone.now())
+        search.index_contacts(contacts)
+        objectcache.invalidate(set(targets) | set(sources_of))
+
+    return len(targets)
@@ -1,10 +1,25 @@
+import datetime
+
 from django.db import models
 from django.db.models import permalink
 from django.contrib.auth.models import User
 # from django.contrib.comments.models import Comment
-from contacts.managers import SpecialDateManager, CompanyManager, PersonManager
+from contacts.managers import (SpecialDateManager, ContactManager,
+                               CompanyManager, PersonManager,
+                               PhoneNumberManager, EmailAddressManager)
+from contacts.normalize import (phone_digits, email_key, month_day,
+                               next_anniversary)
 from lxml import etree
-import xml.etree.ElementTree as ET
+
+
+def isoformat(value):
+        """
+        Return a date or time as an ISO 8601 string for ``simplify()``, so
+        that its result can be JSON encoded.
+        """
+        if value is None:
+                return None
+        return value.isoformat()
 
 
 class Contact(models.Model):
@@ -47,14 +62,16 @@ class Contact(models.Model):
         nickname = models.CharField('nickname',
                                     max_length=50, blank=True, null=True)
         slug = models.SlugField('slug',
-                                blank=True, max_length=50)
+                                blank=True, null=True, max_length=50)
         about = models.TextField('about',
                                  blank=True)
 
         date_added = models.DateTimeField('date added',
-                                          auto_now_add=True)
+                                          auto_now_add=True,
+                                          db_index=True)
         date_modified = models.DateTimeField('date modified',
-                                             auto_now=True)
+                                             auto_now=True,
+                                             db_index=True)
 
         """ New attributes of combined model. """
         is_company = models.BooleanField('is company',
@@ -64,12 +81,18 @@ class Contact(models.Model):
                                   max_length=50,
                                   blank=True, null=True)
 
+        objects = ContactManager()
+
         class Meta:
                 db_table = 'contacts_contacts'
+                index_together = [['is_company', 'date_added'],
+                                  ['is_company', 'date_modified']]
+                unique_together = [['is_company', 'slug']]
                 verbose_name = 'contact'
                 verbose_name_plural = 'contacts'
 
         def create_from_xml(self, xml_string):
+            from contacts.importers.locations import LocationResolver
             contact_element = etree.XML(xml_string)
             child_list = list(contact_element)
             foreign_key_elements = {
@@ -91,47 +114,76 @@ class Contact(models.Model):
             # save
             self.save()
             # parse the FK objects, and pass the constructors
-            # for them the contact we just saved.
+            # for them the contact we just saved. The children share
+            # one resolver so each location is looked up only once.
+            location_resolver = LocationResolver()
             for (element, ModelClass) in wait_till_the_end:
                 newInstance = ModelClass(xml=etree.tostring(element),
-                                         contact=self)
+                                         contact=self,
+                                         location_resolver=location_resolver)
                 newInstance.save()
             self.save()
             return self
 
+        def create_xml_version(self):
+            """
+            Return the <Contact> element for this contact and its child
+            rows, in the layout create_from_xml reads.
+            """
+            from contacts.exporters.xml import contact_element
+            return contact_element(self)
+
+        def save(self, *args, **kwargs):
+                # Rows without a slug store NULL, which the unique index on
+                # (is_company, slug) lets any number of rows share.
+                if not self.slug:
+                        self.slug = None
+                super(Contact, self).save(*args, **kwargs)
+
+        def merge_into(self, target):
+            """
+            Merge this contact into ``target`` and delete it. See
+            ``contacts.merge.merge_contacts``, which merges many pairs at
+            once.
+            """
+            from contacts.merge import merge_contacts
+            merge_contacts([(self, target)])
+
         def __unicode__(self):
                 return self.fullname
 
         def simplify(self):
-            result = {}  # Object()
-            result.name = self.name
-            result.logo = self.logo
-            result.first_name = self.first_name
-            result.last_name = self.last_name
-            result.middle_name = self.middle_name
-            result.suffix = self.suffix
-            result.title = self.title
-            if self.company:
-                result.company = self.company.simplify()
+            result = {}
+            result['name'] = self.name
+            result['logo'] = self.logo.name or None
+            result['first_name'] = self.first_name
+            result['last_name'] = self.last_name
+            result['middle_name'] = self.middle_name
+            result['suffix'] = self.suffix
+            result['title'] = self.title
+            if self.company_id:
+                result['company'] = self.company.simplify()
             # No simplify() for user yet
-            # result.user = self.user.simplify()
-            result.photo = self.photo
-            result.nickname = self.nickname
-            result.slug = self.slug
-            result.about = self.about
-            result.date_added = self.date_added
-            result.date_modified = self.date_modified
-            result.is_company = self.is_company
-            result.prefix = self.prefix
-            result.phone_number = [child.simplify() for child in
-                                   self.phone_number.all()]
-            result.street_address = [address.simplify() for address in
-                                     self.street_address.all()]
-            result.web_site = [site.simplify() for site in self.web_site.all()]
-            result.email_address = [email.simplify() for email in
-                                    self.email_address.all()]
-            # Just like phone_number, for street_address ,
-            # email_address, web_site (or website?)
+            # result['user'] = self.user.simplify()
+            result['photo'] = self.photo.name or None
+            result['nickname'] = self.nickname
+            result['slug'] = self.slug
+            result['about'] = self.about
+            result['date_added'] = isoformat(self.date_added)
+            result['date_modified'] = isoformat(self.date_modified)
+            result['is_company'] = self.is_company
+            result['prefix'] = self.prefix
+            result['phone_number'] = [child.simplify() for child in
+                                      self.phone_number.all()]
+            result['street_address'] = [address.simplify() for address in
+                                        self.street_address.all()]
+            result['web_site'] = [site.simplify() for site in self.web_site.all()]
+            result['email_address'] = [email.simplify() for email in
+                                       self.email_address.all()]
+            result['instant_messenger'] = [im.simplify() for im in
+                                           self.instant_messenger.all()]
+            result['special_date'] = [date.simplify() for date in
+                                      self.special_date.all()]
             return result
 
         @property
@@ -142,19 +194,26 @@ class Contact(models.Model):
                         return u"%s %s" % (self.first_name,
                                            self.last_name)
 
+        def _url_prefix(self):
+                # There are no contact views; link to the person or
+                # company views instead.
+                if self.is_company:
+                        return 'contacts_company'
+                return 'contacts_person'
+
         @permalink
         def get_absolute_url(self):
-                return ('contacts_contact_detail', None, {
+                return ('%s_detail' % self._url_prefix(), None, {
                         'pk': self.pk})
 
         @permalink
         def get_update_url(self):
-                return ('contacts_contact_update', None, {
+                return ('%s_update' % self._url_prefix(), None, {
                         'pk': self.pk})
 
         @permalink
         def get_delete_url(self):
-                return ('contacts_contact_delete', None, {
+                return ('%s_delete' % self._url_prefix(), None, {
                         'pk': self.pk})
 
 
@@ -229,7 +288,8 @@ class Person(Contact):
 class Group(models.Model):
         """Group model."""
         name = models.CharField('name', max_length=200)
-        slug = models.SlugField('slug', blank=True, max_length=50)
+        slug = models.SlugField('slug', blank=True, null=True,
+                                max_length=50, unique=True)
         about = models.TextField('about', blank=True)
 
         people = models.ManyToManyField(Person,
@@ -252,6 +312,11 @@ class Group(models.Model):
         def __unicode__(self):
                 return u"%s" % self.name
 
+        def save(self, *args, **kwargs):
+                if not self.slug:
+                        self.slug = None
+                super(Group, self).save(*args, **kwargs)
+
         @permalink
         def get_absolute_url(self):
                 return ('contacts_group_detail', None, {
@@ -268,6 +333,18 @@ class Group(models.Model):
                         'pk': self.pk})
 
 
+def location_from_xml(element, resolver=None):
+        """
+        Return the Location described by a <Location> element, reusing an
+        existing row with the same slug or name.
+        """
+        from contacts.importers.locations import LocationResolver
+        from contacts.importers.xml import element_values
+        if resolver is None:
+                resolver = LocationResolver()
+        return resolver.resolve(**element_values(Location, element))
+
+
 class Location(models.Model):
         """Location model."""
         WEIGHT_CHOICES = [(i, i) for i in range(11)]
@@ -296,33 +373,11 @@ class Location(models.Model):
                 return self
 
         def create_xml_version(self):
-                location = ET.Element("location")
-                elements_dict = {
-                        'name': 'str',
-                        'slug': 'str',
-                        'is_phone': 'bool',
-                        'is_street_address': 'bool',
-                        'date_added': 'date',
-                        'date_modified': 'date'}
-                for elementName, elementType in elements_dict.iteritems():
-                        newElement = ET.SubElement(location, elementName)
-                        if elementType == 'str':
-                                newElement.text = getattr(self, elementName)
-                        elif elementType == 'bool':
-                                bool_var = getattr(self, elementName)
-                                newElement.text = str(bool_var)
-                        elif elementType == 'date':
-                                # do something else
-                                date = getattr(self, elementName)
-                                date_as_string = date.strftime('%Y-%m-%d')
-                                newElement.text = date_as_string
-                        else:
-                                print "Don't know what to do here."
-                                print "unknown element type."
-                                print 5/0
-                ET.dump(location)
-                return(ET)
-                # tree = ET.ElementTree("location")
+                """
+                Return the <Location> element for this location.
+                """
+                from contacts.exporters.xml import location_element
+                return location_element(self)
 
         def __unicode__(self):
                 return u"%s" % (self.name)
@@ -335,13 +390,13 @@ class Location(models.Model):
 
         def simplify(self):
                 result = {}
-                result.name = self.name
-                result.slug = self.slug
-                result.is_phone = self.is_phone
-                result.is_street_address = self.is_street_address
-                result.weight = self.weight
-                result.date_added = self.date_added
-                result.date_modified = self.date_modified
+                result['name'] = self.name
+                result['slug'] = self.slug
+                result['is_phone'] = self.is_phone
+                result['is_street_address'] = self.is_street_address
+                result['weight'] = self.weight
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
                 return result
 
 
@@ -355,17 +410,42 @@ class PhoneNumber(models.Model):
                 Location,
                 limit_choices_to={'is_street_address': False})
 
+        normalized_number = models.CharField('normalized number',
+                                             max_length=50,
+                                             blank=True,
+                                             editable=False,
+                                             db_index=True)
+        reversed_number = models.CharField('reversed number',
+                                           max_length=50,
+                                           blank=True,
+                                           editable=False,
+                                           db_index=True)
+
         date_added = models.DateTimeField('date added',
                                           auto_now_add=True)
         date_modified = models.DateTimeField('date modified',
                                              auto_now=True)
 
+        objects = PhoneNumberManager()
+
+        def denormalize(self):
+                """
+                Set the digits-only copies of the number used for lookups.
+                The reversed copy lets a suffix match use an index.
+                """
+                self.normalized_number = phone_digits(self.phone_number)
+                self.reversed_number = self.normalized_number[::-1]
+
+        def save(self, *args, **kwargs):
+                self.denormalize()
+                super(PhoneNumber, self).save(*args, **kwargs)
+
         def simplify(self):
                 result = {}
-                result.phone_number = self.phone_number
-                result.location = self.location.simplify()
-                result.date_added = self.date_added
-                result.date_modified = self.date_modified
+                result['phone_number'] = self.phone_number
+                result['location'] = self.location.simplify()
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
                 return result
 
         def __init__(self, *args, **kwargs):
@@ -373,15 +453,15 @@ class PhoneNumber(models.Model):
                         content_object_value = kwargs['content_object']
                         del kwargs['content_object']
                 elif 'xml' in kwargs:
+                        location_resolver = kwargs.pop('location_resolver',
+                                                       None)
                         xml_phone_number_element = etree.fromstring(
                                 kwargs['xml'])
                         child_list = list(xml_phone_number_element)
                         for child in child_list:
                                 if child.tag == "Location":
-                                        location_object = Location()
-                                        new_location = location_object.create_from_xml(child) # noqa
-                                        new_location.save()
-                                        kwargs['location'] = new_location
+                                        kwargs['location'] = location_from_xml(
+                                                child, location_resolver)
                                 else:
                                         kwargs[child.tag] = child.text
                         del kwargs['xml']
@@ -407,16 +487,35 @@ class EmailAddress(models.Model):
                 limit_choices_to={'is_street_address': False,
                                   'is_phone': False})
 
+        normalized_address = models.CharField('normalized address',
+                                              max_length=75,
+                                              blank=True,
+                                              editable=False,
+                                              db_index=True)
+
         date_added = models.DateTimeField('date added',
                                           auto_now_add=True)
         date_modified = models.DateTimeField('date modified',
                                              auto_now=True)
 
+        objects = EmailAddressManager()
+
+        def denormalize(self):
+                """
+                Set the lower case copy of the address used for lookups.
+                """
+                self.normalized_address = email_key(self.email_address)
+
+        def save(self, *args, **kwargs):
+                self.denormalize()
+                super(EmailAddress, self).save(*args, **kwargs)
+
         def simplify(self):
                 result = {}
-                result.email_address = self.email_address
-                result.date_added = self.date_added
-                result.date_modified = self.date_modified
+                result['email_address'] = self.email_address
+                result['location'] = self.location.simplify()
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
                 return result
 
         def __init__(self, *args, **kwargs):
@@ -427,15 +526,15 @@ class EmailAddress(models.Model):
                         content_object_value = kwargs['content_object']
                         del kwargs['content_object']
                 elif 'xml' in kwargs:
+                        location_resolver = kwargs.pop('location_resolver',
+                                                       None)
                         xml_email_address_element = etree.fromstring(
                                 kwargs['xml'])
                         child_list = list(xml_email_address_element)
                         for child in child_list:
                                 if child.tag == "Location":
-                                        location_object = Location()
-                                        new_location = location_object.create_from_xml(child) # noqa
-                                        new_location.save()
-                                        kwargs['location'] = new_location
+                                        kwargs['location'] = location_from_xml(
+                                                child, location_resolver)
                                 else:
                                         kwargs[child.tag] = child.text
                         del kwargs['xml']
@@ -503,6 +602,15 @@ class InstantMessenger(models.Model):
         def __unicode__(self):
                 return u"%s (%s)" % (self.im_account, self.location)
 
+        def simplify(self):
+                result = {}
+                result['im_account'] = self.im_account
+                result['service'] = self.service
+                result['location'] = self.location.simplify()
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
+                return result
+
         class Meta:
                 db_table = 'contacts_instant_messengers'
                 verbose_name = 'instant messenger'
@@ -528,12 +636,14 @@ class WebSite(models.Model):
                         content_object_value = kwargs['content_object']
                         del kwargs['content_object']
                 elif 'xml' in kwargs:
+                        location_resolver = kwargs.pop('location_resolver',
+                                                       None)
                         xml_website_element = etree.fromstring(kwargs['xml'])
                         child_list = list(xml_website_element)
                         for child in child_list:
                                 if child.tag == "Location":
-                                        location_object = Location()
-                                        kwargs['location'] = location_object.create_from_xml(child)  # noqa
+                                        kwargs['location'] = location_from_xml(
+                                                child, location_resolver)
                                 else:
                                         kwargs[child.tag] = child.text
                         del kwargs['xml']
@@ -548,11 +658,11 @@ class WebSite(models.Model):
 
         def simplify(self):
                 result = {}
-                # result.contact = self.contact.simplify()
-                result.url = self.url
-                result.location = self.location.simplify()
-                result.date_added = self.date_added
-                result.date_modified = self.date_modified
+                # result['contact'] = self.contact.simplify()
+                result['url'] = self.url
+                result['location'] = self.location.simplify()
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
                 return result
 
         class Meta:
@@ -593,15 +703,15 @@ class StreetAddress(models.Model):
                         content_object_value = kwargs['content_object']
                         del kwargs['content_object']
                 elif 'xml' in kwargs:
+                        location_resolver = kwargs.pop('location_resolver',
+                                                       None)
                         xml_street_address_element = etree.fromstring(
                                 kwargs['xml'])
                         child_list = list(xml_street_address_element)
                         for child in child_list:
                                 if child.tag == "Location":
-                                        location_object = Location()
-                                        new_location = location_object.create_from_xml(child)  # noqa
-                                        new_location.save()
-                                        kwargs['location'] = new_location
+                                        kwargs['location'] = location_from_xml(
+                                                child, location_resolver)
                                 else:
                                         kwargs[child.tag] = child.text
                         del kwargs['xml']
@@ -616,15 +726,15 @@ class StreetAddress(models.Model):
 
         def simplify(self):
                 result = {}
-                result.street = self.street
-                result.street2 = self.street2
-                result.city = self.city
-                result.province = self.province
-                result.postal_code = self.postal_code
-                result.country = self.country
-                result.location = self.location.simplify()
-                result.date_added = self.date_added
-                result.date_modified = self.date_modified
+                result['street'] = self.street
+                result['street2'] = self.street2
+                result['city'] = self.city
+                result['province'] = self.province
+                result['postal_code'] = self.postal_code
+                result['country'] = self.country
+                result['location'] = self.location.simplify()
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
                 return result
 
         class Meta:
@@ -641,9 +751,16 @@ class SpecialDate(models.Model):
 
         occasion = models.TextField('occasion',
                                     max_length=200)
-        date = models.DateField('date')
+        date = models.DateField('date', db_index=True)
         every_year = models.BooleanField('every year',
                                          default=True)
+        month_day = models.PositiveSmallIntegerField('month and day',
+                                                     null=True,
+                                                     editable=False)
+        next_occurrence = models.DateField('next occurrence',
+                                           null=True,
+                                           editable=False,
+                                           db_index=True)
 
         date_added = models.DateTimeField('date added',
                                           auto_now_add=True)
@@ -652,6 +769,25 @@ class SpecialDate(models.Model):
 
         objects = SpecialDateManager()
 
+        def denormalize(self, today=None):
+                """
+                Set the month and day of the date, as ``MMDD``, used to find
+                dates that recur every year, and the date it next falls on.
+                """
+                if not self.date:
+                        self.month_day = self.next_occurrence = None
+                        return
+                self.month_day = month_day(self.date)
+                if self.every_year:
+                        self.next_occurrence = next_anniversary(
+                                self.date, today or datetime.date.today())
+                else:
+                        self.next_occurrence = self.date
+
+        def save(self, *args, **kwargs):
+                self.denormalize()
+                super(SpecialDate, self).save(*args, **kwargs)
+
         def __init__(self, *args, **kwargs):
                 # If there is a content_object in the kwarguments,
                 # peel it off into a variable named content_object_value
@@ -667,7 +803,103 @@ class SpecialDate(models.Model):
         def __unicode__(self):
                 return u"%s: %s" % (self.occasion, self.date)
 
+        def simplify(self):
+                result = {}
+                result['occasion'] = self.occasion
+                result['date'] = isoformat(self.date)
+                result['every_year'] = self.every_year
+                result['date_added'] = isoformat(self.date_added)
+                result['date_modified'] = isoformat(self.date_modified)
+                return result
+
         class Meta:
                 db_table = 'contacts_special_dates'
+                index_together = [['every_year', 'month_day']]
                 verbose_name = 'special date'
                 verbose_name_plural = 'special dates'
+
+
+class ListCount(models.Model):
+        """Row count behind a paginated list view, kept up to date by
+        signals so that the list views need not run COUNT(*)."""
+        key = models.CharField('key', max_length=50, unique=True)
+        count = models.IntegerField('count', default=0)
+
+        class Meta:
+                db_table = 'contacts_list_counts'
+                verbose_name = 'list count'
+                verbose_name_plural = 'list counts'
+
+        def __unicode__(self):
+                return u"%s: %s" % (self.key, self.count)
+
+
+class SearchToken(models.Model):
+        """One word of the contact search index."""
+        contact = models.ForeignKey(Contact, related_name='search_tokens')
+        source = models.CharField('source', max_length=50)
+        token = models.CharField('token', max_length=100, db_index=True)
+        weight = models.IntegerField('weight', default=1)
+
+        class Meta:
+                db_table = 'contacts_search_tokens'
+                index_together = [('contact', 'source')]
+                verbose_name = 'search token'
+                verbose_name_plural = 'search tokens'
+
+        def __unicode__(self):
+                return u"%s (%s)" % (self.token, self.weight)
+
+
+class BlockingKey(models.Model):
+        """One blocking key of a contact, used to find duplicate contacts
+        without comparing every pair. Rebuilt by ``find_duplicates``."""
+        contact = models.ForeignKey(Contact, related_name='blocking_keys')
+        key = models.CharField('key', max_length=100, db_index=True)
+
+        class Meta:
+                db_table = 'contacts_blocking_keys'
+                verbose_name = 'blocking key'
+                verbose_name_plural = 'blocking keys'
+
+        def __unicode__(self):
+                return self.key
+
+
+class DuplicateCandidate(models.Model):
+        """A pair of contacts that may be the same, awaiting review."""
+        NEW = 'new'
+        DISMISSED = 'dismissed'
+        STATUS_CHOICES = (
+                (NEW, 'New'),
+                (DISMISSED, 'Dismissed'),
+        )
+
+        contact = models.ForeignKey(Contact, related_name='+')
+        duplicate = models.ForeignKey(Contact, related_name='+')
+        score = models.FloatField('score', db_index=True)
+        reasons = models.CharField('reasons', max_length=200, blank=True)
+        status = models.CharField('status', max_length=10,
+                                  choices=STATUS_CHOICES, default=NEW,
+                                  db_index=True)
+
+        date_added = models.DateTimeField('date added', auto_now_add=True)
+        date_modified = models.DateTimeField('date modified', auto_now=True)
+
+        class Meta:
+                db_table = 'contacts_duplicate_candidates'
+                unique_together = [('contact', 'duplicate')]
+                ordering = ('-score',)
+                verbose_name = 'duplicate candidate'
+                verbose_name_plural = 'duplicate candidates'
+
+        def __unicode__(self):
+                return u"%s / %s (%.2f)" % (self.contact, self.duplicate,
+                                            self.score)
+
+
+# Connect the signal receivers that keep derived data up to date.
+import contacts.counts  # noqa
+import contacts.search  # noqa
+import contacts.recent  # noqa
+import contacts.objectcache  # noqa
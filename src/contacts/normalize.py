@@ -0,0 +1,77 @@
+"""
+Normalized forms of contact details, stored alongside the values people
+type in so that lookups can use an index.
+"""
+import calendar
+import datetime
+import re
+import unicodedata
+
+# Characters that start an extension: "x", "ext", "ext." or "#".
+EXTENSION_RE = re.compile(r'(?:#|ext\.?|x)\s*\d*\s*$', re.IGNORECASE)
+
+
+def phone_digits(value):
+    """
+    Return the digits of a phone number in E.164 order, without the
+    leading "+", international "00" prefix or any extension. For example
+    "+1 (416) 555-0100 ext. 12" and "001 416 555 0100" both become
+    "14165550100".
+    """
+    if not value:
+        return ''
+    value = EXTENSION_RE.sub('', value.strip())
+    digits = re.sub(r'\D', '', value)
+    if not value.startswith('+') and digits.startswith('00'):
+        digits = digits[2:]
+    return digits
+
+
+def email_key(value):
+    """
+    Return the form of an email address used to match it, which ignores
+    case and surrounding white space.
+    """
+    if not value:
+        return ''
+    return value.strip().lower()
+
+
+def month_day(date):
+    """
+    Return the position of ``date`` in the calendar year as an ordinal
+    that sorts by month and then day, e.g. 1231 for 31 December.
+    """
+    return date.month * 100 + date.day
+
+
+def anniversary(date, year):
+    """
+    Return the anniversary of ``date`` in ``year``. 29 February falls on
+    28 February outside leap years.
+    """
+    if date.month == 2 and date.day == 29 and not calendar.isleap(year):
+        return datetime.date(year, 2, 28)
+    return date.replace(year=year)
+
+
+def next_anniversary(date, today):
+    """
+    Return the first anniversary of ``date`` on or after ``today``.
+    """
+    occurrence = anniversary(date, today.year)
+    if occurrence < today:
+        occurrence = anniversary(date, today.year + 1)
+    return occurrence
+
+
+def name_key(value):
+    """
+    Return ``value`` reduced to lower case letters and digits, without
+    accents, for comparing names.
+    """
+    if not value:
+        return u''
+    value = unicodedata.normalize('NFKD', unicode(value))
+    return u''.join(char for char in value.lower()
+                    if char.isalnum() and not unicodedata.combining(char))
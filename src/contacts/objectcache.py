@@ -0,0 +1,208 @@
+"""
+Read-through cache for the person, company and group detail views.
+
+Each entry holds an object fully loaded for its detail page: a person with
+its company and child rows, a company with its child rows, or a group.
+The people of a company and the members of a group are not cached, as
+there is no bound on them; the detail views read them a page at a time.
+Entries are looked up by primary key and stored under a version number
+per object, which signal receivers replace whenever the object or one of
+its child rows is saved or deleted, so a changed object is simply read
+again. A person's entry also records the version of its company.
+Changes to locations replace a generation number shared by every entry.
+
+Writes that bypass the model signals should call ``invalidate()`` with
+the keys of the contacts they changed. Transactions should be run in
+``atomic()``, which replaces the versions they changed again once they
+are committed. ``stats()`` returns the number of hits and misses.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from contacts.models import (Contact, Company, Person, Group, Location,
+                             PhoneNumber, EmailAddress, InstantMessenger,
+                             WebSite, StreetAddress, SpecialDate)
+from contacts.prefetch import prefetch_children
+
+PREFIX = 'contacts:object'
+GENERATION_KEY = 'contacts:object:generation'
+HITS_KEY = 'contacts:object:hits'
+MISSES_KEY = 'contacts:object:misses'
+
+CHILD_MODELS = (PhoneNumber, EmailAddress, InstantMessenger, WebSite,
+                StreetAddress, SpecialDate)
+
+# The version keys replaced inside the ``atomic()`` block of each thread.
+_pending = threading.local()
+
+
+def _version_key(kind, pk):
+    return '%s:version:%s:%s' % (PREFIX, kind, pk)
+
+
+def _replace(keys):
+    """
+    Replace the versions under ``keys``, and again when the enclosing
+    ``atomic()`` block ends.
+    """
+    keys = set(keys)
+    cache.set_many(dict((key, uuid.uuid4().hex) for key in keys))
+    pending = getattr(_pending, 'keys', None)
+    if pending is not None:
+        pending.update(keys)
+
+
+def _versions(keys):
+    """
+    Return the current versions under ``keys``, starting those that are
+    missing.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1):
+            cache.incr(key)
+
+
+def _lookup(name, kind, pk, load):
+    """
+    Return the cached ``name`` entry for the ``kind`` of object ``pk``,
+    calling ``load(pk)`` for it on a miss. ``load`` returns the entry and
+    the keys of the other contacts it shows.
+    """
+    version_key = _version_key(kind, pk)
+    versions = _versions([GENERATION_KEY, version_key])
+    key = '%s:%s:%s:%s:%s' % (PREFIX, name, pk, versions[GENERATION_KEY],
+                              versions[version_key])
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, dependencies = entry
+        if not dependencies or cache.get_many(
+                dependencies.keys()) == dependencies:
+            _count(HITS_KEY)
+            return value
+
+    _count(MISSES_KEY)
+    value, related = load(pk)
+    dependencies = {}
+    if related:
+        dependencies = _versions([_version_key('contact', related_pk)
+                                  for related_pk in related])
+    cache.set(key, (value, dependencies))
+    return value
+
+
+def _load_person(pk):
+    person = Person.objects.select_related('company').get(pk=pk)
+    prefetch_children([person])
+    return person, person.company_id and [person.company_id] or []
+
+
+def _load_company(pk):
+    company = Company.objects.get(pk=pk)
+    prefetch_children([company])
+    return company, []
+
+
+def _load_group(pk):
+    return Group.objects.get(pk=pk), []
+
+
+def get_person(pk):
+    """
+    Return the person ``pk`` with its company, child rows and their
+    locations loaded. Raises ``Person.DoesNotExist``.
+    """
+    return _lookup('person', 'contact', int(pk), _load_person)
+
+
+def get_company(pk):
+    """
+    Return the company ``pk`` with its child rows and their locations
+    loaded. Raises ``Company.DoesNotExist``.
+    """
+    return _lookup('company', 'contact', int(pk), _load_company)
+
+
+def get_group(pk):
+    """
+    Return the group ``pk``. Raises ``Group.DoesNotExist``.
+    """
+    return _lookup('group', 'group', int(pk), _load_group)
+
+
+def invalidate(contact_ids):
+    """
+    Forget the cached entries of the contacts ``contact_ids``.
+    """
+    _replace(_version_key('contact', pk) for pk in contact_ids
+             if pk is not None)
+
+
+@contextmanager
+def atomic():
+    """
+    Run the block in ``transaction.atomic()``, and replace the versions
+    it changed a second time once the transaction has ended. Until then
+    other connections still read the old rows, and may have cached them
+    under the versions replaced inside the block.
+    """
+    if getattr(_pending, 'keys', None) is not None:
+        with transaction.atomic():
+            yield
+        return
+
+    _pending.keys = set()
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        keys, _pending.keys = _pending.keys, None
+        if keys:
+            cache.set_many(dict((key, uuid.uuid4().hex) for key in keys))
+
+
+def stats():
+    """
+    Return the number of cache hits and misses.
+    """
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        'hits': counts.get(HITS_KEY, 0),
+        'misses': counts.get(MISSES_KEY, 0),
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def object_changed(sender, instance, **kwargs):
+    if isinstance(instance, Contact):
+        invalidate([instance.pk])
+    elif isinstance(instance, CHILD_MODELS):
+        invalidate([instance.contact_id])
+    elif isinstance(instance, Group):
+        _replace([_version_key('group', instance.pk)])
+    elif isinstance(instance, Location):
+        _replace([GENERATION_KEY])
@@ -0,0 +1,212 @@
+import base64
+import json
+
+from django.core.paginator import InvalidPage, EmptyPage
+from django.db import connection
+from django.db.models import Q
+
+from contacts.counts import CountPaginator, get_counter
+
+PAGINATE_BY = 20
+MEMBERS_PER_PAGE = 100
+
+
+def encode_cursor(direction, values):
+    return base64.urlsafe_b64encode(json.dumps([direction, values]))
+
+
+def object_cursor(direction, obj, keys):
+    """
+    Return the cursor for the page after (``'next'``) or before
+    (``'previous'``) ``obj`` on ``keys``.
+    """
+    return encode_cursor(direction, [getattr(obj, key) for key in keys])
+
+
+def decode_cursor(cursor):
+    """
+    Return the ``(direction, values)`` pair of a cursor, or None if the
+    cursor is empty or can not be read.
+    """
+    if not cursor:
+        return None
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    if direction not in ('next', 'previous') or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def _nulls_last():
+    return connection.vendor in ('postgresql', 'oracle')
+
+
+def _compare(key, value, after):
+    """
+    Return a Q matching rows that sort strictly after (or before) ``value``
+    on ``key`` in ascending order, or None when no row can. NULLs sort
+    first on SQLite and MySQL and last on PostgreSQL and Oracle.
+    """
+    nulls_last = _nulls_last()
+    if value is None:
+        if after != nulls_last:
+            return Q(**{'%s__isnull' % key: False})
+        return None
+
+    q = Q(**{'%s__%s' % (key, after and 'gt' or 'lt'): value})
+    if after == nulls_last:
+        q |= Q(**{'%s__isnull' % key: True})
+    return q
+
+
+def _equal(key, value):
+    if value is None:
+        return Q(**{'%s__isnull' % key: True})
+    return Q(**{key: value})
+
+
+def seek(queryset, keys, values, after=True):
+    """
+    Filter ``queryset`` to the rows sorting after (or before) the row
+    whose ``keys`` hold ``values``.
+    """
+    condition = None
+    for i, key in enumerate(keys):
+        q = _compare(key, values[i], after)
+        if q is None:
+            continue
+        for j in range(i):
+            q &= _equal(keys[j], values[j])
+        condition = q if condition is None else condition | q
+
+    if condition is None:
+        return queryset.none()
+    return queryset.filter(condition)
+
+
+class KeysetPage(object):
+    """
+    One page of a queryset read by seeking on its ordering keys.
+
+    The cost of a page does not depend on how deep it is, and no COUNT is
+    needed; in exchange pages are reached through ``next_cursor`` and
+    ``previous_cursor`` rather than by number.
+    """
+    def __init__(self, queryset, keys, cursor=None, per_page=PAGINATE_BY):
+        self.keys = keys
+        decoded = decode_cursor(cursor)
+
+        if decoded is None:
+            rows = list(queryset.order_by(*keys)[:per_page + 1])
+            self.has_next = len(rows) > per_page
+            self.has_previous = False
+            rows = rows[:per_page]
+        else:
+            direction, values = decoded
+            if len(values) != len(keys):
+                raise InvalidPage('That cursor is not valid')
+            if direction == 'next':
+                rows = list(seek(queryset, keys, values).order_by(*keys)
+                            [:per_page + 1])
+                self.has_next = len(rows) > per_page
+                self.has_previous = True
+                rows = rows[:per_page]
+            else:
+                ordering = ['-%s' % key for key in keys]
+                rows = list(seek(queryset, keys, values, after=False)
+                            .order_by(*ordering)[:per_page + 1])
+                self.has_previous = len(rows) > per_page
+                self.has_next = True
+                rows = rows[:per_page]
+                rows.reverse()
+
+        self.object_list = rows
+        if not rows:
+            self.has_next = self.has_previous = False
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next:
+            return object_cursor('next', self.object_list[-1], self.keys)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous:
+            return object_cursor('previous', self.object_list[0], self.keys)
+        return None
+
+
+def paginate(request, queryset, page, keys, per_page=PAGINATE_BY,
+             counter=None):
+    """
+    Return the template variables for one page of a list view.
+
+    Pages are numbered as before unless the request carries a ``cursor``
+    parameter, in which case the page is read with a ``KeysetPage`` on
+    ``keys``. An empty cursor asks for the first page. Numbered pages are
+    sorted on ``keys`` as well and carry the cursors of their neighbours,
+    so the list templates can always link with cursors. They take their
+    total from ``counter``, by default the provider named by the
+    ``CONTACTS_LIST_COUNT`` setting.
+    """
+    if 'cursor' in request.GET:
+        try:
+            objects = KeysetPage(queryset, keys, request.GET['cursor'],
+                                 per_page)
+        except InvalidPage:
+            objects = KeysetPage(queryset, keys, None, per_page)
+
+        return {
+            'object_list': objects.object_list,
+            'has_next': objects.has_next,
+            'has_previous': objects.has_previous,
+            'has_other_pages': objects.has_other_pages(),
+            'next_cursor': objects.next_cursor,
+            'previous_cursor': objects.previous_cursor,
+        }
+
+    paginator = CountPaginator(queryset.order_by(*keys), per_page,
+                               counter or get_counter())
+
+    try:
+        objects = paginator.page(page)
+    except (EmptyPage, InvalidPage):
+        objects = paginator.page(paginator.num_pages)
+
+    object_list = list(objects.object_list)
+    return {
+        'object_list': object_list,
+        'has_next': objects.has_next(),
+        'has_previous': objects.has_previous(),
+        'has_other_pages': objects.has_other_pages(),
+        'start_index': objects.start_index(),
+        'end_index': objects.end_index(),
+        'previous_page_number': (objects.has_previous() and
+                                 objects.previous_page_number() or None),
+        'next_page_number': (objects.has_next() and
+                             objects.next_page_number() or None),
+        'next_cursor': (objects.has_next() and object_list and
+                        object_cursor('next', object_list[-1], keys) or
+                        None),
+        'previous_cursor': (objects.has_previous() and object_list and
+                            object_cursor('previous', object_list[0], keys) or
+                            None),
+    }
+
+
+def member_page(queryset, count, page, per_page=MEMBERS_PER_PAGE):
+    """
+    Return one page of the members of a group or the people of a company,
+    given their count. Pages past the last one show the last page.
+    """
+    paginator = CountPaginator(queryset, per_page, lambda qs: count)
+    try:
+        return paginator.page(page)
+    except (EmptyPage, InvalidPage):
+        return paginator.page(paginator.num_pages)
@@ -0,0 +1,43 @@
+from django.db.models.query import prefetch_related_objects
+
+from contacts.models import Location
+
+CHILD_RELATIONS = (
+    'phone_number',
+    'email_address',
+    'instant_messenger',
+    'web_site',
+    'street_address',
+    'special_date',
+)
+
+
+def prefetch_children(contacts, relations=CHILD_RELATIONS):
+    """
+    Load the child rows of ``contacts`` with one query per child table and
+    a single query for all of their locations.
+
+    The rows are cached on each contact, so ``contact.phone_number.all()``
+    and ``phone.location`` no longer hit the database. Returns the contacts
+    as a list.
+    """
+    contacts = list(contacts)
+    if not contacts:
+        return contacts
+
+    prefetch_related_objects(contacts, list(relations))
+
+    rows = []
+    for contact in contacts:
+        for relation in relations:
+            rows.extend(getattr(contact, relation).all())
+
+    location_ids = set(row.location_id for row in rows
+                       if getattr(row, 'location_id', None) is not None)
+    if location_ids:
+        locations = Location.objects.in_bulk(location_ids)
+        for row in rows:
+            if getattr(row, 'location_id', None) in locations:
+                row.location = locations[row.location_id]
+
+    return contacts
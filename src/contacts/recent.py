@@ -0,0 +1,83 @@
+"""
+Cached lists of the most recently added and modified contacts, as shown
+by the ``contacts_tags`` template tags.
+
+Lists are cached under a random generation token that is replaced
+whenever a contact is saved or deleted, so a page showing several lists
+runs no queries until the contacts change. Writes that bypass the model signals
+should call ``invalidate()``.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from contacts.models import Contact, Company, Person
+
+GENERATION_KEY = 'contacts:recent:generation'
+
+ORDERINGS = {
+    'added': '-date_added',
+    'modified': '-date_modified',
+}
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(GENERATION_KEY, generation, None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def recent_contacts(model, order, limit):
+    """
+    Return a list of the ``limit`` instances of ``model`` (``Person`` or
+    ``Company``) most recently ``'added'`` or ``'modified'``.
+    """
+    key = 'contacts:recent:%s:%s:%s:%d' % (_generation(),
+                                           model._meta.model_name,
+                                           order, limit)
+    contacts = cache.get(key)
+    if contacts is None:
+        contacts = list(model.objects.order_by(ORDERINGS[order])[:limit])
+        cache.set(key, contacts)
+    return contacts
+
+
+def recent_bundle(order, people=0, companies=0):
+    """
+    Return a dictionary holding lists of the ``people`` people and
+    ``companies`` companies most recently ``'added'`` or ``'modified'``,
+    cached as a single entry.
+    """
+    key = 'contacts:recent:%s:bundle:%s:%d:%d' % (_generation(), order,
+                                                  people, companies)
+    bundle = cache.get(key)
+    if bundle is None:
+        ordering = ORDERINGS[order]
+        bundle = {'people': [], 'companies': []}
+        if people > 0:
+            bundle['people'] = list(Person.objects.order_by(ordering)
+                                    [:people])
+        if companies > 0:
+            bundle['companies'] = list(Company.objects.order_by(ordering)
+                                       [:companies])
+        cache.set(key, bundle)
+    return bundle
+
+
+def invalidate():
+    """
+    Forget every cached list.
+    """
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def contact_changed(sender, instance, **kwargs):
+    if isinstance(instance, Contact):
+        invalidate()
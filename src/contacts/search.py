@@ -0,0 +1,277 @@
+"""
+Full-text contact search.
+
+Contacts are indexed in ``contacts_search_tokens``: one row per word of a
+contact's names, company, email addresses, phone numbers, street
+addresses, web sites and instant messenger accounts, weighted by where
+the word came from. Every row records its source (the contact itself,
+its company or one child row) so that a change to one child only rewrites
+that child's tokens. Signal receivers keep the index current; bulk writes
+that bypass signals should call ``index_contacts`` themselves, and the
+``rebuild_search_index`` command rebuilds it from scratch.
+
+Searches match each word of the query as a prefix of the indexed tokens
+and rank contacts by the summed weight of their matching tokens.
+Autocompletion matches only the words of names and nicknames, and needs
+every word of the query to match.
+"""
+import re
+import urlparse
+
+from django.db import transaction
+from django.db.models import Min, Q, Sum
+from django.db.models.signals import (post_init, post_save, pre_delete,
+                                      post_delete)
+from django.dispatch import receiver
+
+from contacts.models import (Contact, Company, Person, PhoneNumber,
+                             EmailAddress,
+                             InstantMessenger, WebSite, StreetAddress,
+                             SearchToken)
+from contacts.prefetch import prefetch_children
+
+TOKEN_LENGTH = 100
+
+NAME_WEIGHT = 10
+ACCOUNT_WEIGHT = 6
+COMPANY_WEIGHT = 5
+PLACE_WEIGHT = 3
+TEXT_WEIGHT = 1
+
+INDEXED_CHILDREN = (PhoneNumber, EmailAddress, InstantMessenger, WebSite,
+                    StreetAddress)
+INDEXED_RELATIONS = ('phone_number', 'email_address', 'instant_messenger',
+                     'web_site', 'street_address')
+
+# People are re-indexed this many at a time, which keeps each query under
+# the parameter limits of SQLite and Oracle.
+LOOKUP_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """
+    Split ``text`` into lower case words.
+    """
+    if not text:
+        return []
+    return [word[:TOKEN_LENGTH]
+            for word in re.findall(r'\w+', unicode(text).lower(), re.UNICODE)]
+
+
+def _add(tokens, words, weight):
+    for word in words:
+        tokens[word] = max(tokens.get(word, 0), weight)
+
+
+def contact_tokens(contact):
+    tokens = {}
+    for value in (contact.name, contact.first_name, contact.middle_name,
+                  contact.last_name, contact.nickname):
+        _add(tokens, tokenize(value), NAME_WEIGHT)
+    _add(tokens, tokenize(contact.title), TEXT_WEIGHT)
+    return tokens
+
+
+def company_tokens(company):
+    tokens = {}
+    if company is not None:
+        _add(tokens, tokenize(company.name), COMPANY_WEIGHT)
+        _add(tokens, tokenize(company.nickname), COMPANY_WEIGHT)
+    return tokens
+
+
+def child_tokens(child):
+    tokens = {}
+    if isinstance(child, PhoneNumber):
+        digits = re.sub(r'\D', '', child.phone_number or '')
+        _add(tokens, tokenize(child.phone_number), ACCOUNT_WEIGHT)
+        _add(tokens, tokenize(digits), ACCOUNT_WEIGHT)
+    elif isinstance(child, EmailAddress):
+        address = (child.email_address or '').lower()
+        _add(tokens, [address[:TOKEN_LENGTH]], ACCOUNT_WEIGHT)
+        _add(tokens, tokenize(address), ACCOUNT_WEIGHT)
+    elif isinstance(child, InstantMessenger):
+        _add(tokens, [(child.im_account or '').lower()[:TOKEN_LENGTH]],
+             ACCOUNT_WEIGHT)
+        _add(tokens, tokenize(child.im_account), ACCOUNT_WEIGHT)
+    elif isinstance(child, WebSite):
+        _add(tokens, tokenize(urlparse.urlparse(child.url or '').netloc),
+             PLACE_WEIGHT)
+    elif isinstance(child, StreetAddress):
+        for value in (child.city, child.province, child.postal_code,
+                      child.country):
+            _add(tokens, tokenize(value), PLACE_WEIGHT)
+        _add(tokens, tokenize(child.street), TEXT_WEIGHT)
+        _add(tokens, tokenize(child.street2), TEXT_WEIGHT)
+    tokens.pop('', None)
+    return tokens
+
+
+def child_source(child):
+    return '%s:%s' % (child._meta.model_name, child.pk)
+
+
+def _rows(contact_id, source, tokens):
+    return [SearchToken(contact_id=contact_id, source=source, token=token,
+                        weight=weight)
+            for token, weight in tokens.items()]
+
+
+def index_contacts(contacts):
+    """
+    Rebuild the index entries of ``contacts`` and their child rows.
+    """
+    contacts = prefetch_children(contacts, INDEXED_RELATIONS)
+    if not contacts:
+        return
+
+    company_ids = set(c.company_id for c in contacts if c.company_id)
+    companies = Contact.objects.in_bulk(company_ids) if company_ids else {}
+
+    rows = []
+    for contact in contacts:
+        rows.extend(_rows(contact.pk, 'contact', contact_tokens(contact)))
+        rows.extend(_rows(contact.pk, 'company',
+                          company_tokens(companies.get(contact.company_id))))
+        for relation in INDEXED_RELATIONS:
+            for child in getattr(contact, relation).all():
+                rows.extend(_rows(contact.pk, child_source(child),
+                                  child_tokens(child)))
+
+    with transaction.atomic():
+        SearchToken.objects.filter(
+            contact__in=[contact.pk for contact in contacts]).delete()
+        SearchToken.objects.bulk_create(rows)
+
+
+def _replace(contact_ids, source, tokens):
+    SearchToken.objects.filter(contact__in=contact_ids,
+                               source=source).delete()
+    rows = []
+    for contact_id in contact_ids:
+        rows.extend(_rows(contact_id, source, tokens))
+    SearchToken.objects.bulk_create(rows)
+
+
+def index_company(company, contact_ids):
+    """
+    Rewrite the company tokens of the people ``contact_ids`` for
+    ``company``, or drop them when ``company`` is None.
+    """
+    tokens = company_tokens(company)
+    contact_ids = list(contact_ids)
+    for start in range(0, len(contact_ids), LOOKUP_BATCH_SIZE):
+        _replace(contact_ids[start:start + LOOKUP_BATCH_SIZE], 'company',
+                 tokens)
+
+
+def search(query, queryset=None, limit=50):
+    """
+    Return up to ``limit`` contacts of ``queryset`` matching ``query``,
+    best match first. Each contact has its score in ``search_rank``.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    if queryset is None:
+        queryset = Contact.objects.all()
+
+    match = Q()
+    for term in set(terms):
+        match |= Q(token__startswith=term)
+
+    ranked = list(SearchToken.objects.filter(match)
+                  .filter(contact__in=queryset.values('pk'))
+                  .values_list('contact')
+                  .annotate(rank=Sum('weight'))
+                  .order_by('-rank', 'contact')[:limit])
+
+    contacts = queryset.in_bulk([contact_id for contact_id, rank in ranked])
+    results = []
+    for contact_id, rank in ranked:
+        if contact_id in contacts:
+            contact = contacts[contact_id]
+            contact.search_rank = rank
+            results.append(contact)
+    return results
+
+
+def complete(query, queryset=None, limit=10):
+    """
+    Return up to ``limit`` contacts of ``queryset`` with a name or
+    nickname word starting with each word of ``query``, for
+    autocompletion. Contacts come in the order of their first matching
+    word.
+    """
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not terms:
+        return []
+    if queryset is None:
+        queryset = Contact.objects.all()
+
+    names = SearchToken.objects.filter(source='contact', weight=NAME_WEIGHT)
+    matches = names.filter(token__startswith=terms[0])
+    for term in terms[1:]:
+        matches = matches.filter(contact__in=names.filter(
+            token__startswith=term).values('contact'))
+
+    ranked = list(matches.filter(contact__in=queryset.values('pk'))
+                  .values_list('contact')
+                  .annotate(first=Min('token'))
+                  .order_by('first', 'contact')[:limit])
+
+    contacts = queryset.in_bulk([contact_id for contact_id, first in ranked])
+    return [contacts[contact_id] for contact_id, first in ranked
+            if contact_id in contacts]
+
+
+def _company_names(company):
+    return (company.name, company.nickname)
+
+
+@receiver(post_init, sender=Contact)
+@receiver(post_init, sender=Company)
+@receiver(post_init, sender=Person)
+def remember_company_names(sender, instance, **kwargs):
+    instance._indexed_names = _company_names(instance)
+
+
+@receiver(post_save)
+def index_saved(sender, instance, created, update_fields=None, **kwargs):
+    if isinstance(instance, Contact):
+        with transaction.atomic():
+            _replace([instance.pk], 'contact', contact_tokens(instance))
+            company = None
+            if instance.company_id:
+                company = Contact.objects.filter(pk=instance.company_id).first()
+            _replace([instance.pk], 'company', company_tokens(company))
+            # The people of a company only need new tokens when its
+            # names were saved with new values.
+            names = _company_names(instance)
+            if update_fields is None \
+                    or set(['name', 'nickname']) & set(update_fields):
+                if instance.is_company and not created \
+                        and names != getattr(instance, '_indexed_names', None):
+                    index_company(instance,
+                                  instance.people.values_list('pk', flat=True))
+                instance._indexed_names = names
+    elif isinstance(instance, INDEXED_CHILDREN):
+        _replace([instance.contact_id], child_source(instance),
+                 child_tokens(instance))
+
+
+@receiver(pre_delete)
+def remember_people(sender, instance, **kwargs):
+    if isinstance(instance, Contact) and instance.is_company:
+        instance._indexed_people = list(
+            instance.people.values_list('pk', flat=True))
+
+
+@receiver(post_delete)
+def unindex_deleted(sender, instance, **kwargs):
+    if isinstance(instance, INDEXED_CHILDREN):
+        SearchToken.objects.filter(contact=instance.contact_id,
+                                   source=child_source(instance)).delete()
+    elif isinstance(instance, Contact):
+        # The people of a deleted company lose it, without being saved.
+        index_company(None, getattr(instance, '_indexed_people', ()))
@@ -0,0 +1,28 @@
+from contacts.models import Contact
+from contacts.prefetch import prefetch_children
+
+
+def simplify_many(contacts):
+    """
+    Return ``Contact.simplify()`` for every contact in ``contacts``.
+
+    The contacts' companies are fetched in one query, and the child rows
+    of the contacts and companies with one query per child table plus one
+    for the locations, so the number of queries does not grow with the
+    number of contacts.
+    """
+    contacts = list(contacts)
+
+    company_ids = set(contact.company_id for contact in contacts
+                      if contact.company_id)
+    companies = {}
+    if company_ids:
+        companies = Contact.objects.in_bulk(company_ids)
+
+    prefetch_children(contacts + companies.values())
+
+    for contact in contacts:
+        if contact.company_id in companies:
+            contact.company = companies[contact.company_id]
+
+    return [contact.simplify() for contact in contacts]
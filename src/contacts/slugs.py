@@ -0,0 +1,177 @@
+"""
+Unique slugs for contacts and groups.
+
+Slugs are unique per type: a person and a company may share one, two
+people may not. The database enforces this with a unique index, which
+also serves the lookups here. A taken slug gets the number after the
+highest suffix in use, so a third John Smith becomes ``john-smith-3``.
+Only the highest slug is read back, never every slug sharing the name.
+"""
+from django.db import IntegrityError
+from django.db.models import Q
+from django.template.defaultfilters import slugify
+
+from contacts import objectcache
+from contacts.models import Contact, Group
+
+SLUG_LENGTH = 50
+
+# Room kept at the end of a long slug for a suffix, so that every
+# candidate for a slug starts with the same stem.
+SUFFIX_LENGTH = 8
+
+# The fields that slugs are unique within, by model.
+SCOPE_FIELDS = {
+    Contact: ('is_company',),
+    Group: (),
+}
+
+# Stems are looked up this many at a time by ``allocate_slugs``, which
+# keeps each query under the parameter limits of SQLite and Oracle.
+LOOKUP_BATCH_SIZE = 200
+
+# How often ``save_with_slug`` tries again when another writer takes the
+# slug first.
+MAX_ATTEMPTS = 5
+
+
+def base_slug(value, default):
+    slug = slugify(value or u'')[:SLUG_LENGTH].strip('-')
+    return slug or default
+
+
+def candidate(base, number):
+    """
+    Return ``base`` with the suffix ``number``, cut to fit ``SLUG_LENGTH``.
+    """
+    if number < 2:
+        return base
+    suffix = u'-%d' % number
+    return base[:SLUG_LENGTH - len(suffix)].rstrip('-') + suffix
+
+
+def _stem(base):
+    return base[:SLUG_LENGTH - SUFFIX_LENGTH]
+
+
+def _stem_range(stem):
+    return Q(slug__range=(stem, stem + u'\uffff'))
+
+
+def _suffix_patterns(base):
+    """
+    Return ``[prefix, fewest, most]`` for the suffixed slugs of ``base``,
+    longest suffixes first: the text before the digits and the numbers
+    of digits that follow it. A short base has a single prefix; a long
+    one is cut shorter for each longer suffix.
+    """
+    patterns = []
+    for digits in range(SUFFIX_LENGTH - 1, 0, -1):
+        prefix = candidate(base, max(2, 10 ** (digits - 1)))[:-digits]
+        if patterns and patterns[-1][0] == prefix:
+            patterns[-1][1] = digits
+        else:
+            patterns.append([prefix, digits, digits])
+    return patterns
+
+
+def highest_suffix(queryset, base):
+    """
+    Return the highest suffix number of a slug made from ``base`` in
+    ``queryset``, or 1 if there is none.
+
+    Each suffix prefix costs one query on the slug index that returns
+    only its longest and then greatest slug. A short base has a single
+    prefix; a base cut for its suffixes takes a query per prefix until
+    one matches, longest suffixes first.
+    """
+    for prefix, fewest, most in _suffix_patterns(base):
+        slugs = list(queryset.filter(
+            _stem_range(_stem(base)),
+            slug__regex=r'^%s[0-9]{%d,%d}$' % (prefix, fewest, most))
+            .extra(select={'slug_length': 'LENGTH(slug)'})
+            .order_by('-slug_length', '-slug')
+            .values_list('slug', flat=True)[:1])
+        if slugs:
+            return int(slugs[0][len(prefix):])
+    return 1
+
+
+def _scope(instance):
+    model = instance._meta.concrete_model
+    fields = SCOPE_FIELDS[model]
+    return model, tuple((field, getattr(instance, field)) for field in fields)
+
+
+def unique_slug(instance, value):
+    """
+    Return a slug made from ``value`` that no other row of the type of
+    ``instance`` has.
+    """
+    model, scope = _scope(instance)
+    base = base_slug(value, model._meta.model_name)
+    queryset = model._default_manager.filter(**dict(scope))
+    if instance.pk is not None:
+        queryset = queryset.exclude(pk=instance.pk)
+    if not queryset.filter(slug=base).exists():
+        return base
+    return candidate(base, highest_suffix(queryset, base) + 1)
+
+
+def save_with_slug(instance, value):
+    """
+    Save ``instance`` with a unique slug made from ``value``. If another
+    writer takes the slug between the lookup and the save, the unique
+    index refuses the row and a new slug is tried.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        instance.slug = unique_slug(instance, value)
+        try:
+            with objectcache.atomic():
+                instance.save()
+            return instance
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def allocate_slugs(instances):
+    """
+    Replace the slug of each unsaved instance in ``instances`` with a
+    unique one, using it as the base. Instances without a slug are left
+    without one. Slugs are unique among ``instances`` too. Which bases
+    are taken is read with one query per ``LOOKUP_BATCH_SIZE`` bases, and
+    only the taken ones have their highest suffix looked up.
+    """
+    groups = {}
+    for instance in instances:
+        if instance.slug:
+            instance.slug = base_slug(instance.slug, None)
+        if instance.slug:
+            groups.setdefault(_scope(instance), []).append(instance)
+        else:
+            instance.slug = None
+
+    for (model, scope), members in groups.items():
+        queryset = model._default_manager.filter(**dict(scope))
+        bases = sorted(set(instance.slug for instance in members))
+        taken = set()
+        for start in range(0, len(bases), LOOKUP_BATCH_SIZE):
+            taken.update(queryset.filter(
+                slug__in=bases[start:start + LOOKUP_BATCH_SIZE])
+                .values_list('slug', flat=True))
+
+        numbers = {}
+        used = set()
+        for instance in members:
+            base = instance.slug
+            if base not in numbers:
+                numbers[base] = base in taken and highest_suffix(
+                    queryset, base) or 0
+            number = numbers[base] + 1
+            while candidate(base, number) in used:
+                number += 1
+            numbers[base] = number
+            instance.slug = candidate(base, number)
+            used.add(instance.slug)
+    return instances
@@ -0,0 +1,80 @@
+/*
+ * Suggestions for the company field of the person forms.
+ *
+ * Each text input with a data-autocomplete-url asks that URL for the
+ * companies matching what has been typed, lists them in its datalist and
+ * copies the id of the chosen company into the hidden input named by
+ * data-autocomplete-for. Text that names no suggested company clears the
+ * choice.
+ */
+(function () {
+	var DELAY = 200;
+
+	function attach(input) {
+		var hidden = document.getElementById(input.getAttribute('data-autocomplete-for'));
+		var list = document.getElementById(input.getAttribute('list'));
+		var url = input.getAttribute('data-autocomplete-url');
+		var initial = {name: input.value, id: hidden.value};
+		var ids = {};
+		var timer = null;
+		var request = null;
+
+		function show(results) {
+			ids = {};
+			list.innerHTML = '';
+			for (var i = 0; i < results.length; i++) {
+				var option = document.createElement('option');
+				option.value = results[i].name;
+				if (results[i].nickname) {
+					option.label = results[i].nickname;
+				}
+				list.appendChild(option);
+				ids[results[i].name] = results[i].id;
+			}
+		}
+
+		function fetch() {
+			var query = input.value.replace(/^\s+|\s+$/g, '');
+			if (request) {
+				request.abort();
+			}
+			if (!query) {
+				show([]);
+				return;
+			}
+			request = new XMLHttpRequest();
+			request.open('GET', url + '?q=' + encodeURIComponent(query));
+			request.onload = function () {
+				if (this.status === 200) {
+					show(JSON.parse(this.responseText).results);
+					select();
+				}
+			};
+			request.send();
+		}
+
+		function select() {
+			if (ids.hasOwnProperty(input.value)) {
+				hidden.value = ids[input.value];
+			} else if (input.value && input.value === initial.name) {
+				hidden.value = initial.id;
+			} else {
+				hidden.value = '';
+			}
+		}
+
+		input.addEventListener('input', function () {
+			select();
+			clearTimeout(timer);
+			timer = setTimeout(fetch, DELAY);
+		});
+		input.addEventListener('change', select);
+	}
+
+	document.addEventListener('DOMContentLoaded', function () {
+		var inputs = document.querySelectorAll('input[data-autocomplete-url]');
+		for (var i = 0; i < inputs.length; i++) {
+			attach(inputs[i]);
+		}
+	});
+})();
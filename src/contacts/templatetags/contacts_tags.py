@@ -4,6 +4,8 @@ from django import template
 from django.conf import settings
 from django.db import models
 
+from contacts.recent import ORDERINGS, recent_contacts, recent_bundle
+
 Person = models.get_model('contacts', 'person')
 Company = models.get_model('contacts', 'company')
 
@@ -22,7 +24,11 @@ def base_tag(parser, token, cls):
     
     format_string, var_name = m.groups()
     
-    return cls(format_string[0], var_name)
+    limit = format_string.strip()
+    if not limit.isdigit():
+        raise template.TemplateSyntaxError, "%s tag requires a number as its limit" % tag_name
+    
+    return cls(limit, var_name)
 
 class RecentModifiedCompanies(template.Node):
     """
@@ -33,7 +39,7 @@ class RecentModifiedCompanies(template.Node):
         self.var_name = var_name
     
     def render(self, context):
-        companies = Company.objects.all().order_by("-date_modified")[:int(self.limit)]
+        companies = recent_contacts(Company, 'modified', int(self.limit))
         if (int(self.limit) == 1):
             context[self.var_name] = companies[0]
         else:
@@ -61,7 +67,7 @@ class RecentCreatedCompanies(template.Node):
         self.var_name = var_name
     
     def render(self, context):
-        companies = Company.objects.all().order_by("-date_added")[:int(self.limit)]
+        companies = recent_contacts(Company, 'added', int(self.limit))
         if (int(self.limit) == 1):
             context[self.var_name] = companies[0]
         else:
@@ -89,7 +95,7 @@ class RecentModifiedPeople(template.Node):
         self.var_name = var_name
 
     def render(self, context):
-        people = Person.objects.all().order_by("-date_modified")[:int(self.limit)]
+        people = recent_contacts(Person, 'modified', int(self.limit))
         if (int(self.limit) == 1):
             context[self.var_name] = people[0]
         else:
@@ -117,7 +123,7 @@ class RecentCreatedPeople(template.Node):
         self.var_name = var_name
 
     def render(self, context):
-        people = Person.objects.all().order_by("-date_added")[:int(self.limit)]
+        people = recent_contacts(Person, 'added', int(self.limit))
         if (int(self.limit) == 1):
             context[self.var_name] = people[0]
         else:
@@ -134,4 +140,59 @@ def get_recent_added_people(parser, token):
 
         {% get_recent_added_people [limit] as [var_name] %}
     """
-    return base_tag(parser, token, RecentCreatedPeople)
\ No newline at end of file
+    return base_tag(parser, token, RecentCreatedPeople)
+
+class RecentContacts(template.Node):
+    """
+    Gets the recent people and companies as one cached bundle.
+    """
+    def __init__(self, limits, order, var_name):
+        self.limits = limits
+        self.order = order
+        self.var_name = var_name
+
+    def render(self, context):
+        limits = {}
+        for kind, limit in self.limits.items():
+            try:
+                limits[kind] = int(limit.resolve(context))
+            except (TypeError, ValueError):
+                limits[kind] = 0
+        context[self.var_name] = recent_bundle(self.order,
+                                               limits.get('people', 0),
+                                               limits.get('companies', 0))
+        return ''
+
+@register.tag
+def get_recent_contacts(parser, token):
+    """
+    Gets the recent people and companies in one go, as a dictionary with
+    ``people`` and ``companies`` lists. Either count may be left out, and
+    ``order`` is ``added`` (the default) or ``modified``.
+
+    Syntax::
+
+        {% get_recent_contacts people=[limit] companies=[limit] order=[order] as [var_name] %}
+    """
+    bits = token.split_contents()
+    tag_name = bits.pop(0)
+    if len(bits) < 2 or bits[-2] != 'as':
+        raise template.TemplateSyntaxError, "%s tag requires 'as [var_name]'" % tag_name
+    var_name = bits[-1]
+
+    limits = {}
+    order = 'added'
+    for bit in bits[:-2]:
+        name, sep, value = bit.partition('=')
+        if not sep or not value:
+            raise template.TemplateSyntaxError, "%s tag had invalid argument '%s'" % (tag_name, bit)
+        if name == 'order':
+            order = value.strip('"\'')
+            if order not in ORDERINGS:
+                raise template.TemplateSyntaxError, "%s tag order must be one of %s" % (tag_name, ', '.join(sorted(ORDERINGS)))
+        elif name in ('people', 'companies'):
+            limits[name] = parser.compile_filter(value)
+        else:
+            raise template.TemplateSyntaxError, "%s tag had invalid argument '%s'" % (tag_name, bit)
+
+    return RecentContacts(limits, order, var_name)
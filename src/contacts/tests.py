@@ -1,7 +1,35 @@
+import csv
+import datetime
+import json
+import tempfile
+from io import BytesIO
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.template import Template, Context, TemplateSyntaxError
+from django.db import IntegrityError
 from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.db import connection
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from contacts.models import Company, Person
+from django.utils.http import urlquote
+from contacts import counts, objectcache, recent
+from contacts.dedupe import DuplicateFinder
+from contacts.merge import merge_contacts
+from contacts.exporters.xml import export_xml
+from contacts.forms import PersonUpdateForm, PhoneNumberFormSet, EmailAddressFormSet, InstantMessengerFormSet, WebSiteFormSet, StreetAddressFormSet, SpecialDateFormSet
+from contacts.exporters.csv import iter_csv
+from contacts.importers.csv import CSVImporter
+from contacts.importers.vcard import VCardImporter
+from contacts.importers.xml import XMLImporter
+from contacts.models import Contact, Company, Person, Group, Location, ListCount, SearchToken, PhoneNumber, EmailAddress, SpecialDate, DuplicateCandidate
+from contacts.normalize import phone_digits
+from contacts.serializers import simplify_many
+from contacts.slugs import unique_slug, save_with_slug, allocate_slugs
 
 class ContactsTest(TestCase):
 	fixtures = ['contacts.json',]
@@ -34,3 +62,1164 @@ class ContactsTest(TestCase):
 	def testViewPersonDetail(self):
 		response = self.client.get(self.person_mb.get_absolute_url())
 		self.failUnlessEqual(response.status_code, 200)
+
+
+CONTACTS_XML = """<?xml version="1.0" encoding="utf-8"?>
+<Contacts>
+	<Contact>
+		<first_name>Myles</first_name>
+		<last_name>Braithwaite</last_name>
+		<company>Monkey in your Soul</company>
+		<PhoneNumber>
+			<phone_number>416-555-0100</phone_number>
+			<Location><name>Work</name><slug>work</slug></Location>
+		</PhoneNumber>
+		<EmailAddress>
+			<email_address>me@example.com</email_address>
+			<Location><name>Home</name><slug>home</slug></Location>
+		</EmailAddress>
+	</Contact>
+	<Contact>
+		<name>Monkey in your Soul</name>
+		<is_company>True</is_company>
+		<WebSite>
+			<url>http://monkeyinyoursoul.com/</url>
+			<Location><name>Work</name><slug>work</slug></Location>
+		</WebSite>
+	</Contact>
+	<Contact>
+		<first_name>Bruce</first_name>
+		<last_name>Braithwaite</last_name>
+		<SpecialDate>
+			<occasion>Birthday</occasion>
+			<date>1950-05-28</date>
+			<every_year>True</every_year>
+		</SpecialDate>
+	</Contact>
+</Contacts>
+"""
+
+class XMLImporterTest(TestCase):
+
+	def testImportInBatches(self):
+		batches = []
+		importer = XMLImporter(batch_size=1, progress=lambda stats: batches.append(stats.contacts))
+		stats = importer.run(BytesIO(CONTACTS_XML))
+		self.failUnlessEqual(stats.contacts, 3)
+		self.failUnlessEqual(stats.children, 4)
+		self.failUnlessEqual(batches, [1, 2, 3])
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (0, 0))
+		
+		person = Person.objects.get(first_name='Myles')
+		self.failUnlessEqual(person.phone_number.get().phone_number, '416-555-0100')
+		self.failUnlessEqual(person.email_address.get().location.slug, 'home')
+		company = Company.objects.get()
+		self.failUnlessEqual(company.name, 'Monkey in your Soul')
+		self.failUnlessEqual(company.web_site.get().url, 'http://monkeyinyoursoul.com/')
+		self.failUnlessEqual(person.company_id, company.pk)
+		bruce = Person.objects.get(first_name='Bruce')
+		self.failUnlessEqual(bruce.special_date.get().date, datetime.date(1950, 5, 28))
+		self.failUnlessEqual(bruce.company_id, None)
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('monkey')], [company.pk, person.pk])
+	
+	def testImportKeepsCompaniesOfTheSameName(self):
+		existing = Company.objects.create(name='Monkey in your Soul')
+		XMLImporter().run(BytesIO(CONTACTS_XML))
+		self.failUnlessEqual(Company.objects.count(), 2)
+		company = Company.objects.exclude(pk=existing.pk).get()
+		self.failUnlessEqual(company.web_site.get().url, 'http://monkeyinyoursoul.com/')
+		self.failUnlessEqual(Person.objects.get(first_name='Myles').company_id, company.pk)
+		self.failIf(existing.web_site.exists())
+	
+	def testImportMergesCompaniesOnRequest(self):
+		existing = Company.objects.create(name='Monkey in your Soul')
+		stats = XMLImporter(merge_companies=True).run(BytesIO(CONTACTS_XML))
+		self.failUnlessEqual(stats.contacts, 2)
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (2, 0))
+		self.failUnlessEqual(Company.objects.get(), existing)
+		self.failUnlessEqual(existing.web_site.get().url, 'http://monkeyinyoursoul.com/')
+		self.failUnlessEqual(Person.objects.get(first_name='Myles').company_id, existing.pk)
+	
+	def testImportCreatesCompaniesMissingFromTheDump(self):
+		stats = XMLImporter().run(BytesIO(CONTACTS_XML.replace('Monkey in your Soul</company>', 'Acme</company>')))
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (0, 1))
+		acme = Company.objects.get(name='Acme')
+		self.failUnlessEqual(Person.objects.get(first_name='Myles').company_id, acme.pk)
+	
+	def testImportCommand(self):
+		with tempfile.NamedTemporaryFile(suffix='.xml') as dump:
+			dump.write(CONTACTS_XML)
+			dump.flush()
+			out = StringIO()
+			call_command('import_contacts_xml', dump.name, stdout=out)
+		self.failUnlessEqual(Contact.objects.count(), 3)
+		self.assertTrue('Imported 3 contacts' in out.getvalue())
+		self.assertTrue('Companies: 0 reused, 0 created.' in out.getvalue())
+	
+	def testImportReusesLocations(self):
+		Location.objects.create(name='Home', slug='home')
+		stats = XMLImporter().run(BytesIO(CONTACTS_XML))
+		self.failUnlessEqual(Location.objects.count(), 2)
+		self.failUnlessEqual(stats.location_hits, 2)
+		self.failUnlessEqual(stats.location_misses, 1)
+	
+	def testCreateFromXMLReusesLocations(self):
+		work = Location.objects.create(name='Work', slug='work')
+		contact = Contact().create_from_xml("""<Contact>
+			<first_name>Myles</first_name>
+			<PhoneNumber><phone_number>1</phone_number><Location><name>Work</name></Location></PhoneNumber>
+			<WebSite><url>http://example.com/</url><Location><slug>work</slug></Location></WebSite>
+		</Contact>""")
+		self.failUnlessEqual(contact.phone_number.get().location, work)
+		self.failUnlessEqual(contact.web_site.get().location, work)
+		self.failUnlessEqual(Location.objects.count(), 1)
+
+class XMLExporterTest(TestCase):
+
+	def testExportRoundTrips(self):
+		XMLImporter().run(BytesIO(CONTACTS_XML))
+		dump = BytesIO()
+		self.failUnlessEqual(export_xml(dump, chunk_size=2), 3)
+		
+		self.failUnlessEqual(dump.getvalue().count('<company>Monkey in your Soul</company>'), 1)
+		
+		Contact.objects.all().delete()
+		stats = XMLImporter().run(BytesIO(dump.getvalue()))
+		self.failUnlessEqual(stats.contacts, 3)
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (0, 0))
+		self.failUnlessEqual(stats.location_misses, 0)
+		person = Person.objects.get(first_name='Myles')
+		self.failUnlessEqual(person.company_id, Company.objects.get().pk)
+		self.failUnlessEqual(person.phone_number.get().location.slug, 'work')
+		self.failUnlessEqual(person.email_address.get().email_address, 'me@example.com')
+		self.failUnless(Company.objects.get().is_company)
+		bruce = Person.objects.get(first_name='Bruce')
+		self.failUnlessEqual(bruce.special_date.get().date, datetime.date(1950, 5, 28))
+	
+	def testLocationXMLVersion(self):
+		location = Location.objects.create(name='Work', slug='work', is_phone=True)
+		element = location.create_xml_version()
+		self.failUnlessEqual(element.tag, 'Location')
+		self.failUnlessEqual(element.findtext('slug'), 'work')
+		self.failUnlessEqual(element.findtext('is_phone'), 'True')
+
+class SimplifyTest(TestCase):
+
+	def setUp(self):
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.company.web_site.create(url='http://monkeyinyoursoul.com/', location=self.work)
+		for i in range(5):
+			person = Person.objects.create(first_name='Person %d' % i, last_name='Smith', company=self.company)
+			person.phone_number.create(phone_number='555-010%d' % i, location=self.work)
+			person.email_address.create(email_address='p%d@example.com' % i, location=self.work)
+			person.special_date.create(occasion='Birthday', date=datetime.date(1980, 1, i + 1))
+	
+	def testSimplify(self):
+		result = Person.objects.get(first_name='Person 0').simplify()
+		self.failUnlessEqual(result['first_name'], 'Person 0')
+		self.failUnlessEqual(result['phone_number'][0]['location']['slug'], 'work')
+		self.failUnlessEqual(result['company']['web_site'][0]['url'], 'http://monkeyinyoursoul.com/')
+		self.failUnlessEqual(result['special_date'][0]['date'], '1980-01-01')
+		self.failUnlessEqual(json.loads(json.dumps(result)), result)
+	
+	def testSimplifyManyQueryCount(self):
+		people = Person.objects.all()
+		# contacts, companies, six child tables and the locations
+		with self.assertNumQueries(9):
+			results = simplify_many(people)
+		self.failUnlessEqual(len(results), 5)
+		self.failUnlessEqual(results, [person.simplify() for person in Person.objects.all()])
+
+class ListPaginationTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		for i in range(45):
+			Person.objects.create(first_name='Person %02d' % (i % 7), last_name='Smith %d' % (i % 3))
+		Person.objects.create(first_name='No', last_name=None)
+	
+	def testPageNumbers(self):
+		response = self.client.get(reverse('contacts_person_list'))
+		self.failUnlessEqual(response.status_code, 200)
+		self.failUnlessEqual(len(response.context['object_list']), 20)
+		response = self.client.get(reverse('contacts_person_list_paginated', args=[4000]))
+		self.failUnlessEqual(len(response.context['object_list']), 6)
+	
+	def testCursorPages(self):
+		expected = [p.pk for p in Person.objects.order_by('last_name', 'first_name', 'id')]
+		seen, pages, cursor = [], [], ''
+		while cursor is not None:
+			response = self.client.get(reverse('contacts_person_list'), {'cursor': cursor})
+			self.failUnlessEqual(response.status_code, 200)
+			pages.append(response.context['previous_cursor'])
+			seen.extend(p.pk for p in response.context['object_list'])
+			cursor = response.context['next_cursor']
+		self.failUnlessEqual(seen, expected)
+		self.failUnlessEqual(len(pages), 3)
+		
+		response = self.client.get(reverse('contacts_person_list'), {'cursor': pages[1]})
+		self.failUnlessEqual([p.pk for p in response.context['object_list']], expected[:20])
+		self.failIf(response.context['has_previous'])
+	
+	def testCursorLinks(self):
+		expected = [p.pk for p in Person.objects.order_by('last_name', 'first_name', 'id')]
+		response = self.client.get(reverse('contacts_person_list_paginated', args=[2]))
+		self.failUnlessEqual([p.pk for p in response.context['object_list']], expected[20:40])
+		for name, page in (('next_cursor', expected[40:]), ('previous_cursor', expected[:20])):
+			cursor = response.context[name]
+			self.assertContains(response, 'href="?cursor=%s"' % urlquote(cursor))
+			following = self.client.get(reverse('contacts_person_list'), {'cursor': cursor})
+			self.failUnlessEqual([p.pk for p in following.context['object_list']], page)
+		self.assertNotContains(following, 'Previous')
+		self.assertContains(following, 'Next')
+	
+	def testInvalidCursor(self):
+		response = self.client.get(reverse('contacts_company_list'), {'cursor': 'garbage'})
+		self.failUnlessEqual(response.status_code, 200)
+		response = self.client.get(reverse('contacts_group_list'), {'cursor': ''})
+		self.failUnlessEqual(response.status_code, 200)
+
+class ListCountTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		for i in range(3):
+			Person.objects.create(first_name='Person %d' % i)
+		Company.objects.create(name='Monkey in your Soul')
+	
+	def testCachedCount(self):
+		self.failUnlessEqual(counts.cached_count(Person.objects.all()), 3)
+		with self.assertNumQueries(0):
+			self.failUnlessEqual(counts.cached_count(Person.objects.all()), 3)
+		Person.objects.create(first_name='Another')
+		self.failUnlessEqual(counts.cached_count(Person.objects.all()), 4)
+	
+	@override_settings(CONTACTS_LIST_COUNT='table')
+	def testTableCount(self):
+		self.failUnlessEqual(counts.table_count(Person.objects.all()), 3)
+		person = Person.objects.create(first_name='Another')
+		Company.objects.create(name='Braithwaite Technology Consultants Inc.')
+		with self.assertNumQueries(1):
+			self.failUnlessEqual(counts.table_count(Person.objects.all()), 4)
+		person.delete()
+		self.failUnlessEqual(counts.table_count(Person.objects.all()), 3)
+		self.failUnlessEqual(counts.table_count(Company.objects.all()), 2)
+	
+	def testCounterTableOnlyKeptForTableProvider(self):
+		ListCount.objects.create(key='person', count=3)
+		with CaptureQueriesContext(connection) as queries:
+			Person.objects.create(first_name='Another')
+		self.failIf([query for query in queries.captured_queries if 'contacts_list_counts' in query['sql']])
+	
+	def testEvictedGenerationDoesNotReviveCounts(self):
+		self.failUnlessEqual(counts.cached_count(Person.objects.all()), 3)
+		Person.objects.create(first_name='Another')
+		cache.delete(counts.GENERATION_KEY)
+		self.failUnlessEqual(counts.cached_count(Person.objects.all()), 4)
+	
+	def testTableCountRace(self):
+		manager = Person._default_manager
+		def count():
+			# Another request builds the counter while this one counts.
+			ListCount.objects.create(key='person', count=7)
+			return 3
+		manager.count = count
+		try:
+			self.failUnlessEqual(counts.table_count(Person.objects.all()), 7)
+		finally:
+			del manager.count
+		self.failUnlessEqual(ListCount.objects.get(key='person').count, 7)
+	
+	def testEstimateFallsBackToExactCount(self):
+		self.failUnlessEqual(counts.estimated_count(Company.objects.all()), 1)
+	
+	@override_settings(CONTACTS_LIST_COUNT='table')
+	def testListViewUsesCounter(self):
+		ListCount.objects.create(key='person', count=100)
+		response = self.client.get(reverse('contacts_person_list_paginated', args=[5]))
+		self.failUnlessEqual(response.status_code, 200)
+		self.failUnlessEqual(response.context['start_index'], 81)
+		self.failUnlessEqual(len(response.context['object_list']), 0)
+
+class DetailQueryCountTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		work = Location.objects.create(name='Work', slug='work')
+		home = Location.objects.create(name='Home', slug='home')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.person = Person.objects.create(first_name='Myles', last_name='Braithwaite', company=self.company)
+		for contact in (self.person, self.company):
+			for i in range(10):
+				location = i % 2 and work or home
+				contact.phone_number.create(phone_number='555-01%02d' % i, location=location)
+				contact.email_address.create(email_address='me%d@example.com' % i, location=location)
+				contact.street_address.create(street='%d Queen St' % i, city='Toronto', country='Canada', location=location)
+				contact.web_site.create(url='http://example.com/%d' % i, location=location)
+				contact.instant_messenger.create(im_account='me%d' % i, location=location)
+				contact.special_date.create(occasion='Day %d' % i, date=datetime.date(2000, 1, i + 1))
+		ContentType.objects.clear_cache()
+		ContentType.objects.get_for_model(Contact)
+	
+	def testPersonDetail(self):
+		# the person and company, six child tables and the locations
+		with self.assertNumQueries(8):
+			response = self.client.get(self.person.get_absolute_url())
+		self.failUnlessEqual(response.status_code, 200)
+		self.assertContains(response, '555-0109')
+		self.assertContains(response, 'Home', count=25)
+		self.assertContains(response, self.company.get_absolute_url())
+	
+	def testCompanyDetail(self):
+		# the company, six child tables, the locations, and a count and
+		# a page of its people
+		with self.assertNumQueries(10):
+			response = self.client.get(self.company.get_absolute_url())
+		self.failUnlessEqual(response.status_code, 200)
+		self.assertContains(response, 'me9@example.com')
+		self.assertContains(response, self.person.get_absolute_url())
+
+class GroupDetailTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		self.group = Group.objects.create(name='Torontonian')
+		for i in range(150):
+			self.group.people.add(Person.objects.create(first_name='Person', last_name='%03d' % i))
+		for i in range(3):
+			self.group.companies.add(Company.objects.create(name='Company %d' % i))
+	
+	def testQueryCount(self):
+		# the group, two counts and a page of each kind of member
+		with self.assertNumQueries(5):
+			response = self.client.get(self.group.get_absolute_url())
+		self.failUnlessEqual(response.status_code, 200)
+		self.failUnlessEqual(response.context['people_count'], 150)
+		self.failUnlessEqual(len(response.context['people'].object_list), 100)
+		self.failUnlessEqual(response.context['companies_count'], 3)
+	
+	def testMemberPages(self):
+		response = self.client.get(self.group.get_absolute_url(), {'people_page': 2})
+		self.failUnlessEqual(len(response.context['people'].object_list), 50)
+		response = self.client.get(self.group.get_absolute_url(), {'people_page': 99})
+		self.failUnlessEqual(response.context['people'].number, 2)
+
+class SearchTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		work = Location.objects.create(name='Work', slug='work')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite', company=self.company)
+		self.myles.email_address.create(email_address='me@mylesbraithwaite.com', location=work)
+		self.myles.phone_number.create(phone_number='(416) 555-0100', location=work)
+		self.bruce = Person.objects.create(first_name='Bruce', last_name='Toronto')
+		self.bruce.street_address.create(street='1 Yonge St', city='Toronto', country='Canada', location=work)
+	
+	def testSearchChildRows(self):
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('me@mylesbraithwaite.com')], [self.myles.pk])
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('4165550100')], [self.myles.pk])
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('monkey')], [self.company.pk, self.myles.pk])
+		self.failUnlessEqual([c.pk for c in Person.objects.search('monkey')], [self.myles.pk])
+	
+	def testRanking(self):
+		self.bruce.street_address.get().delete()
+		self.myles.street_address.create(street='1 Queen St', city='Toronto', country='Canada', location=Location.objects.get())
+		results = Contact.objects.search('toronto')
+		self.failUnlessEqual([c.pk for c in results], [self.bruce.pk, self.myles.pk])
+		self.failUnless(results[0].search_rank > results[1].search_rank)
+	
+	def testIndexFollowsChanges(self):
+		self.myles.phone_number.get().delete()
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('4165550100')], [])
+		self.company.name = 'Asgard Project'
+		self.company.save()
+		self.failUnlessEqual([c.pk for c in Person.objects.search('asgard')], [self.myles.pk])
+		self.failUnlessEqual([c.pk for c in Person.objects.search('monkey')], [])
+	
+	def testCompanySaveRewritesPeopleOnlyForNewNames(self):
+		tokens = SearchToken.objects.filter(contact=self.myles, source='company')
+		tokens.delete()
+		company = Company.objects.get(pk=self.company.pk)
+		company.title = 'Label'
+		company.save()
+		company.name = 'Asgard Project'
+		company.save(update_fields=['title'])
+		self.failIf(tokens.exists())
+		company.save(update_fields=['name'])
+		self.failUnlessEqual([c.pk for c in Person.objects.search('asgard')], [self.myles.pk])
+	
+	def testDeletedCompanyLeavesNoTokens(self):
+		self.company.delete()
+		self.failIf(SearchToken.objects.filter(contact=self.myles, source='company').exists())
+		self.failUnlessEqual([c.pk for c in Person.objects.search('monkey')], [])
+	
+	def testRebuildAndView(self):
+		SearchToken.objects.all().delete()
+		call_command('rebuild_search_index', verbosity=0)
+		response = self.client.get(reverse('contacts_search'), {'q': 'myl'})
+		self.failUnlessEqual(response.status_code, 200)
+		self.failUnlessEqual([c.pk for c in response.context['object_list']], [self.myles.pk])
+		self.assertContains(response, self.myles.get_absolute_url())
+
+class PhoneLookupTest(TestCase):
+	def setUp(self):
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.bruce = Person.objects.create(first_name='Bruce', last_name='Wayne')
+		self.myles.phone_number.create(phone_number='(416) 555-0100 ext. 12', location=self.work)
+		self.bruce.phone_number.create(phone_number='+44 20 7946 0958', location=self.work)
+	
+	def testPhoneDigits(self):
+		self.failUnlessEqual(phone_digits('+1 (416) 555-0100 x12'), '14165550100')
+		self.failUnlessEqual(phone_digits('001 416 555 0100'), '14165550100')
+		self.failUnlessEqual(phone_digits(''), '')
+	
+	def testLookup(self):
+		self.failUnlessEqual(PhoneNumber.objects.lookup('+1 416 555 0100').pk, self.myles.pk)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('416.555.0100').pk, self.myles.pk)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('00442079460958').pk, self.bruce.pk)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('020 7946 0958').pk, self.bruce.pk)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('0100'), None)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('416 555 0199'), None)
+	
+	def testExactMatchWins(self):
+		self.bruce.phone_number.create(phone_number='+1 416-555-0100', location=self.work)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('4165550100').pk, self.myles.pk)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('1 416 555 0100').pk, self.bruce.pk)
+	
+	def testBackfill(self):
+		PhoneNumber.objects.update(normalized_number='', reversed_number='')
+		call_command('backfill_phone_numbers', batch_size=1, verbosity=0)
+		self.failUnlessEqual(PhoneNumber.objects.lookup('4165550100').pk, self.myles.pk)
+		self.failUnlessEqual(sorted(PhoneNumber.objects.values_list('normalized_number', flat=True)), ['4165550100', '442079460958'])
+
+class EmailLookupTest(TestCase):
+	def setUp(self):
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.bruce = Person.objects.create(first_name='Bruce', last_name='Wayne')
+		self.myles.email_address.create(email_address='Me@MylesBraithwaite.com', location=self.work)
+		self.bruce.email_address.create(email_address='info@example.com', location=self.work)
+		self.myles.email_address.create(email_address='INFO@example.com', location=self.work)
+	
+	def testOwnersOf(self):
+		with self.assertNumQueries(1):
+			owners = EmailAddress.objects.owners_of([' me@mylesbraithwaite.COM', 'Info@Example.com', 'nobody@example.com', ''])
+		self.failUnlessEqual(sorted(owners.keys()), ['info@example.com', 'me@mylesbraithwaite.com'])
+		self.failUnlessEqual([c.pk for c in owners['me@mylesbraithwaite.com']], [self.myles.pk])
+		self.failUnlessEqual([c.pk for c in owners['info@example.com']], [self.myles.pk, self.bruce.pk])
+		self.failUnlessEqual(EmailAddress.objects.owners_of([]), {})
+	
+	def testImportDropsRepeatedAddresses(self):
+		XMLImporter().run(BytesIO("""<Contacts><Contact>
+			<first_name>Tony</first_name>
+			<EmailAddress><email_address>tony@example.com</email_address><Location><name>Work</name></Location></EmailAddress>
+			<EmailAddress><email_address>Tony@Example.com</email_address><Location><name>Work</name></Location></EmailAddress>
+		</Contact></Contacts>"""))
+		tony = Person.objects.get(first_name='Tony')
+		self.failUnlessEqual(tony.email_address.get().normalized_address, 'tony@example.com')
+	
+	def testBackfill(self):
+		EmailAddress.objects.update(normalized_address='')
+		call_command('backfill_email_addresses', verbosity=0)
+		self.failUnlessEqual(EmailAddress.objects.owners_of(['ME@mylesbraithwaite.com']).keys(), ['me@mylesbraithwaite.com'])
+
+class SpecialDateCalendarTest(TestCase):
+	def setUp(self):
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.birthday = self.myles.special_date.create(occasion='Birthday', date=datetime.date(1980, 12, 30))
+		self.new_year = self.myles.special_date.create(occasion='New Year', date=datetime.date(1990, 1, 1))
+		self.launch = self.myles.special_date.create(occasion='Launch', date=datetime.date(2014, 1, 2), every_year=False)
+	
+	def occasions(self, special_dates):
+		return sorted(d.occasion for d in special_dates)
+	
+	def testMonthDay(self):
+		self.failUnlessEqual(SpecialDate.objects.get(pk=self.birthday.pk).month_day, 1230)
+	
+	def testDayAndMonth(self):
+		self.failUnlessEqual(self.occasions(SpecialDate.objects.get_dates_for_day(datetime.date(2014, 12, 30))), ['Birthday'])
+		self.failUnlessEqual(self.occasions(SpecialDate.objects.get_dates_for_day(datetime.date(2014, 1, 2))), ['Launch'])
+		self.failUnlessEqual(self.occasions(SpecialDate.objects.get_dates_for_month(datetime.date(2014, 1, 15))), ['Launch', 'New Year'])
+		self.failUnlessEqual(self.occasions(SpecialDate.objects.get_dates_for_month(datetime.date(2015, 1, 15))), ['New Year'])
+	
+	def testBetweenWrapsAroundYear(self):
+		between = SpecialDate.objects.get_dates_between
+		self.failUnlessEqual(self.occasions(between(datetime.date(2013, 12, 28), datetime.date(2014, 1, 1))), ['Birthday', 'New Year'])
+		self.failUnlessEqual(self.occasions(between(datetime.date(2014, 12, 31), datetime.date(2015, 1, 5))), ['New Year'])
+		self.failUnlessEqual(self.occasions(between(datetime.date(2014, 1, 2), datetime.date(2014, 12, 29))), ['Launch'])
+		self.failUnlessEqual(self.occasions(between(datetime.date(2010, 1, 1), datetime.date(2011, 6, 1))), ['Birthday', 'New Year'])
+		self.failUnlessEqual(list(between(datetime.date(2014, 2, 1), datetime.date(2014, 1, 1))), [])
+	
+	def testBackfill(self):
+		SpecialDate.objects.update(month_day=None)
+		call_command('backfill_special_dates', verbosity=0)
+		self.failUnlessEqual(self.occasions(SpecialDate.objects.get_dates_for_day(datetime.date(2020, 1, 1))), ['New Year'])
+
+class UpcomingSpecialDateTest(TestCase):
+	def setUp(self):
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.today = datetime.date.today()
+		for i, days in enumerate([-3, 10, 2, 40]):
+			date = self.today + datetime.timedelta(days=days)
+			self.myles.special_date.create(occasion='Day %d' % i, date=date.replace(year=date.year - 20))
+		self.myles.special_date.create(occasion='Once', date=self.today + datetime.timedelta(days=5), every_year=False)
+		self.myles.special_date.create(occasion='Gone', date=self.today - datetime.timedelta(days=5), every_year=False)
+	
+	def testUpcoming(self):
+		with self.assertNumQueries(1):
+			upcoming = [d.occasion for d in SpecialDate.objects.upcoming(days=30)]
+		self.failUnlessEqual(upcoming, ['Day 2', 'Once', 'Day 1'])
+		self.failUnlessEqual([d.occasion for d in SpecialDate.objects.upcoming(days=30, limit=1)], ['Day 2'])
+	
+	def testLeapDay(self):
+		leap_day = self.myles.special_date.create(occasion='Leap', date=datetime.date(1980, 2, 29))
+		leap_day.denormalize(today=datetime.date(2015, 1, 1))
+		self.failUnlessEqual(leap_day.next_occurrence, datetime.date(2015, 2, 28))
+		leap_day.denormalize(today=datetime.date(2016, 1, 1))
+		self.failUnlessEqual(leap_day.next_occurrence, datetime.date(2016, 2, 29))
+	
+	def testRollForward(self):
+		later = self.today + datetime.timedelta(days=30)
+		self.failUnlessEqual(SpecialDate.objects.roll_forward(today=later), 2)
+		upcoming = [d.occasion for d in SpecialDate.objects.upcoming(days=365, today=later)]
+		self.failUnlessEqual(upcoming, ['Day 3', 'Day 0', 'Day 2', 'Day 1'])
+		self.failUnlessEqual(SpecialDate.objects.roll_forward(today=later), 0)
+	
+	def testRollForwardSkipsDatesWithoutMonthDay(self):
+		later = self.today + datetime.timedelta(days=30)
+		SpecialDate.objects.filter(occasion='Day 1').update(month_day=None)
+		self.failUnlessEqual(SpecialDate.objects.roll_forward(today=later), 1)
+
+class RecentContactsTagTest(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.company = Company.objects.create(name='Monkey')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.bruce = Person.objects.create(first_name='Bruce', last_name='Wayne')
+	
+	def render(self):
+		return Template("{% load contacts_tags %}"
+			"{% get_recent_added_people 5 as added %}{% get_recent_modified_people 5 as modified %}"
+			"{% get_recent_added_companies 5 as companies %}{% get_recent_modified_companies 1 as company %}"
+			"{% for p in added %}{{ p.first_name }} {% endfor %}|{% for p in modified %}{{ p.first_name }} {% endfor %}|{{ company.name }}"
+		).render(Context())
+	
+	def testCachedUntilChanged(self):
+		with self.assertNumQueries(4):
+			self.failUnlessEqual(self.render(), 'Bruce Myles |Bruce Myles |Monkey')
+		with self.assertNumQueries(0):
+			self.render()
+		self.myles.save()
+		with self.assertNumQueries(4):
+			self.failUnlessEqual(self.render(), 'Bruce Myles |Myles Bruce |Monkey')
+		self.bruce.delete()
+		self.failUnlessEqual(self.render(), 'Myles |Myles |Monkey')
+	
+	def testEvictedGenerationDoesNotReviveLists(self):
+		self.render()
+		self.bruce.delete()
+		cache.delete(recent.GENERATION_KEY)
+		self.failUnlessEqual(self.render(), 'Myles |Myles |Monkey')
+	
+	def testMultiDigitLimit(self):
+		for i in range(12):
+			Person.objects.create(first_name='Person %d' % i)
+		output = Template("{% load contacts_tags %}{% get_recent_added_people 12 as people %}{{ people|length }}").render(Context())
+		self.failUnlessEqual(output, '12')
+	
+	def testRecentContactsBundle(self):
+		template = Template("{% load contacts_tags %}{% get_recent_contacts people=n companies=1 order=modified as recent %}"
+			"{% for p in recent.people %}{{ p.first_name }} {% endfor %}|{% for c in recent.companies %}{{ c.name }}{% endfor %}")
+		with self.assertNumQueries(2):
+			self.failUnlessEqual(template.render(Context({'n': 2})), 'Bruce Myles |Monkey')
+		with self.assertNumQueries(0):
+			template.render(Context({'n': 2}))
+		self.failUnlessEqual(Template("{% load contacts_tags %}{% get_recent_contacts people=1 as recent %}{{ recent.people.0.first_name }}{{ recent.companies|length }}").render(Context()), 'Bruce0')
+	
+	def testRecentContactsSyntax(self):
+		for tag in ['{% get_recent_contacts people=1 %}', '{% get_recent_contacts people as x %}', '{% get_recent_contacts order=newest as x %}', '{% get_recent_contacts groups=1 as x %}', '{% get_recent_added_people many as x %}']:
+			self.assertRaises(TemplateSyntaxError, Template, '{% load contacts_tags %}' + tag)
+
+VCARDS = """BEGIN:VCARD
+VERSION:3.0
+N:Braithwaite;Myles;;Mr.;
+FN:Myles Braithwaite
+ORG:Monkey in your Soul
+TITLE:Developer
+TEL;TYPE=WORK,VOICE:(416) 555-0100
+TEL;TYPE=CELL:+1 416 555 0199
+EMAIL;TYPE=INTERNET,HOME:me@mylesbraithwaite.com
+ADR;TYPE=WORK:;Suite 4;1 Yonge St;Toronto;ON;M5E 1E5;Canada
+URL:http://mylesbraithwaite.com/
+IMPP:xmpp:myles@example.com
+BDAY:1980-12-30
+NOTE:Line one\\nline two\\, with a comma
+END:VCARD
+BEGIN:VCARD
+VERSION:4.0
+KIND:org
+FN:Monkey in your Soul
+ORG:Monkey in your Soul
+TEL;VALUE=uri;TYPE="work,voice":tel:+1-416-555-0111
+END:VCARD
+BEGIN:VCARD
+VERSION:3.0
+FN:Bruce
+  Wayne
+EMAIL:bruce@example.com
+BDAY:19500528
+END:VCARD
+BEGIN:VCARD
+VERSION:3.0
+NOTE:Nobody
+END:VCARD
+"""
+
+class VCardImporterTest(TestCase):
+	def testImport(self):
+		stats = VCardImporter(batch_size=1).run(BytesIO(VCARDS))
+		self.failUnlessEqual((stats.read, stats.contacts, stats.skipped), (4, 2, 1))
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (1, 1))
+		
+		company = Company.objects.get()
+		self.failUnlessEqual(company.name, 'Monkey in your Soul')
+		self.failUnlessEqual(company.phone_number.get().normalized_number, '14165550111')
+		
+		myles = Person.objects.get(last_name='Braithwaite')
+		self.failUnlessEqual((myles.first_name, myles.prefix, myles.title, myles.company_id), ('Myles', 'Mr.', 'Developer', company.pk))
+		self.failUnlessEqual(myles.about, 'Line one\nline two, with a comma')
+		self.failUnlessEqual(sorted((p.phone_number, p.location.name) for p in myles.phone_number.all()), [('(416) 555-0100', 'Work'), ('+1 416 555 0199', 'Mobile')])
+		self.failUnlessEqual(myles.email_address.get().location.name, 'Home')
+		address = myles.street_address.get()
+		self.failUnlessEqual((address.street, address.street2, address.city, address.postal_code), ('1 Yonge St', 'Suite 4', 'Toronto', 'M5E 1E5'))
+		self.failUnlessEqual(myles.web_site.get().location.name, 'Other')
+		self.failUnlessEqual((myles.instant_messenger.get().service, myles.instant_messenger.get().im_account), ('jabber', 'myles@example.com'))
+		self.failUnlessEqual(myles.special_date.get().date, datetime.date(1980, 12, 30))
+		
+		bruce = Person.objects.get(first_name='Bruce')
+		self.failUnlessEqual((bruce.last_name, bruce.slug), ('Wayne', 'bruce-wayne'))
+		self.failUnlessEqual(bruce.special_date.get().occasion, 'Birthday')
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('yonge')], [myles.pk])
+		self.failUnlessEqual(Location.objects.get(name='Mobile').is_phone, True)
+	
+	def testImportCommand(self):
+		with tempfile.NamedTemporaryFile(suffix='.vcf') as vcf:
+			vcf.write(VCARDS)
+			vcf.flush()
+			out = StringIO()
+			call_command('import_vcard', vcf.name, stdout=out)
+		self.failUnlessEqual(Contact.objects.count(), 3)
+		self.assertTrue('Read 4 cards' in out.getvalue())
+		self.assertTrue('cards/sec' in out.getvalue())
+
+class ExportViewTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		VCardImporter().run(BytesIO(VCARDS))
+		staff = User.objects.create_user('staff', 'staff@example.com', 'secret')
+		staff.is_staff = True
+		staff.save()
+		User.objects.create_user('user', 'user@example.com', 'secret')
+		self.client.login(username='staff', password='secret')
+	
+	def testExportNeedsStaff(self):
+		self.client.logout()
+		for name in ('contacts_export_vcard', 'contacts_export_csv'):
+			self.failUnlessEqual(self.client.get(reverse(name)).status_code, 403)
+		self.client.login(username='user', password='secret')
+		for name in ('contacts_export_vcard', 'contacts_export_csv'):
+			self.failUnlessEqual(self.client.get(reverse(name)).status_code, 403)
+	
+	def testVCardExportRoundTrip(self):
+		response = self.client.get(reverse('contacts_export_vcard'))
+		self.failUnlessEqual(response['Content-Type'], 'text/vcard; charset=utf-8')
+		self.failUnless(response.streaming)
+		content = ''.join(response.streaming_content)
+		self.failUnless('ORG:Monkey in your Soul\r\n' in content)
+		self.failUnless('TEL;TYPE=VOICE,cell:+1 416 555 0199\r\n' in content)
+		self.failUnless('NOTE:Line one\\nline two\\, with a comma\r\n' in content)
+		self.failUnless(all(len(line) <= 75 for line in content.split('\r\n')))
+		
+		Contact.objects.all().delete()
+		stats = VCardImporter().run(BytesIO(content))
+		self.failUnlessEqual((stats.read, stats.contacts, stats.skipped), (3, 2, 0))
+		myles = Person.objects.get(last_name='Braithwaite')
+		self.failUnlessEqual(myles.company.name, 'Monkey in your Soul')
+		self.failUnlessEqual(myles.phone_number.count(), 2)
+		self.failUnlessEqual(myles.instant_messenger.get().service, 'jabber')
+		self.failUnlessEqual(Company.objects.get().phone_number.count(), 1)
+	
+	def testCSVExport(self):
+		# The session and user, then the export itself.
+		with self.assertNumQueries(11):
+			response = self.client.get(reverse('contacts_export_csv'))
+			rows = list(csv.DictReader(BytesIO(''.join(response.streaming_content))))
+		self.failUnlessEqual(len(rows), 3)
+		myles = [row for row in rows if row['last_name'] == 'Braithwaite'][0]
+		self.failUnlessEqual((myles['kind'], myles['company'], myles['birthday']), ('person', 'Monkey in your Soul', '1980-12-30'))
+		self.failUnlessEqual(myles['phone'], '(416) 555-0100; +1 416 555 0199')
+		self.failUnlessEqual(myles['about'], 'Line one\nline two, with a comma')
+
+class CSVImporterTest(TestCase):
+	CSV = (
+		'Given,Family,Employer,E-mail,Telephone,Born,Ignored\r\n'
+		'Myles,Braithwaite,Monkey in your Soul,me@mylesbraithwaite.com; myles@example.com,416-555-0100,1980-12-30,x\r\n'
+		'Bruce,Wayne,monkey in your soul,,,,x\r\n'
+		',,Nobody Inc,,,,x\r\n'
+		'Tony,Stark,Stark Industries,,,1970-13-01,x\r\n'
+		'Happy,Hogan,Stark Industries,not-an-email,,,x\r\n'
+		'Pepper,Potts,Stark Industries,pepper@example.com,,,x\r\n'
+	)
+	MAPPING = {'Given': 'first_name', 'Family': 'last_name', 'Employer': 'company', 'E-mail': 'email', 'Telephone': 'phone', 'Born': 'birthday'}
+	
+	def testImport(self):
+		rejects = BytesIO()
+		stats = CSVImporter(self.MAPPING, batch_size=2, chunk_size=2, rejects=rejects).run(BytesIO(self.CSV))
+		self.failUnlessEqual((stats.read, stats.contacts, stats.skipped), (6, 3, 3))
+		self.failUnlessEqual((stats.company_hits, stats.company_misses), (1, 2))
+		self.failUnlessEqual(Person.objects.get(first_name='Bruce').company_id, Company.objects.get(name='Monkey in your Soul').pk)
+		
+		myles = Person.objects.get(first_name='Myles')
+		self.failUnlessEqual(myles.slug, 'myles-braithwaite')
+		self.failUnlessEqual(myles.company.name, 'Monkey in your Soul')
+		self.failUnlessEqual(sorted(e.email_address for e in myles.email_address.all()), ['me@mylesbraithwaite.com', 'myles@example.com'])
+		self.failUnlessEqual(myles.phone_number.get().location.name, 'Other')
+		self.failUnlessEqual(myles.special_date.get().date, datetime.date(1980, 12, 30))
+		self.failUnlessEqual(Person.objects.get(first_name='Pepper').company.name, 'Stark Industries')
+		
+		rejected = list(csv.reader(BytesIO(rejects.getvalue())))
+		self.failUnlessEqual(rejected[0][-1], 'error')
+		self.failUnlessEqual([row[0] for row in rejected[1:]], ['', 'Tony', 'Happy'])
+		self.failUnless(rejected[2][-1].startswith('birthday:'))
+		self.failUnless(rejected[3][-1].startswith('email_address:'))
+	
+	def testExportedFileImportsWithoutMapping(self):
+		VCardImporter().run(BytesIO(VCARDS))
+		exported = ''.join(iter_csv())
+		Contact.objects.all().delete()
+		stats = CSVImporter().run(BytesIO(exported))
+		self.failUnlessEqual((stats.contacts, stats.skipped), (2, 0))
+		self.failUnlessEqual(Company.objects.get().phone_number.count(), 1)
+		self.failUnlessEqual(Person.objects.get(first_name='Myles').street_address.get().city, 'Toronto')
+	
+	def testImportCommand(self):
+		with tempfile.NamedTemporaryFile(suffix='.csv') as source:
+			source.write(self.CSV)
+			source.flush()
+			out = StringIO()
+			call_command('import_contacts_csv', source.name, mapping=['%s=%s' % item for item in self.MAPPING.items()], stdout=out)
+		self.failUnlessEqual(Person.objects.count(), 3)
+		self.assertTrue('rejected 3' in out.getvalue())
+
+class DuplicateFinderTest(TestCase):
+	def setUp(self):
+		work = Location.objects.create(name='Work', slug='work')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.myles2 = Person.objects.create(first_name='M.', last_name='Braithwaite')
+		self.myles3 = Person.objects.create(first_name='Myles', last_name='Braithwaite-Smith')
+		self.other = Person.objects.create(first_name='Mary', last_name='Jones')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.company2 = Company.objects.create(name='Monkey in Your Soul!')
+		self.myles.email_address.create(email_address='me@mylesbraithwaite.com', location=work)
+		self.myles3.email_address.create(email_address='ME@mylesbraithwaite.com', location=work)
+		self.myles2.phone_number.create(phone_number='416-555-0100', location=work)
+		self.myles.phone_number.create(phone_number='+1 416 555 0100', location=work)
+		for i in range(4):
+			person = Person.objects.create(first_name='Person %d' % i, last_name='Other %d' % i)
+			person.email_address.create(email_address='person%d@example.com' % i, location=work)
+	
+	def pairs(self):
+		return sorted((c.contact_id, c.duplicate_id) for c in DuplicateCandidate.objects.all())
+	
+	def testFindDuplicates(self):
+		finder = DuplicateFinder(threshold=0.5, max_block_size=3)
+		self.failUnlessEqual(finder.run(), 3)
+		self.failUnlessEqual(self.pairs(), sorted([(self.myles.pk, self.myles2.pk), (self.myles.pk, self.myles3.pk), (self.company.pk, self.company2.pk)]))
+		self.failUnlessEqual(finder.oversized_blocks, 1)
+		candidate = DuplicateCandidate.objects.get(contact=self.myles, duplicate=self.myles3)
+		self.failUnless('email' in candidate.reasons)
+		self.failUnless(DuplicateCandidate.objects.get(contact=self.myles, duplicate=self.myles2).reasons.endswith('phone'))
+	
+	def testReviewedPairsAreKept(self):
+		DuplicateFinder().run()
+		DuplicateCandidate.objects.filter(contact=self.company).update(status=DuplicateCandidate.DISMISSED)
+		call_command('find_duplicates', verbosity=0)
+		self.failUnlessEqual(DuplicateCandidate.objects.filter(status=DuplicateCandidate.NEW).count(), 2)
+		self.failUnlessEqual(DuplicateCandidate.objects.count(), 3)
+	
+	def testSmallChunks(self):
+		DuplicateFinder(batch_size=1).run()
+		self.failUnlessEqual(DuplicateCandidate.objects.count(), 3)
+	
+	def testPairsSharingBlocksComeOnce(self):
+		for batch_size in (1, 250):
+			finder = DuplicateFinder(max_block_size=3, batch_size=batch_size)
+			finder.build_keys()
+			pairs = list(finder.candidate_pairs())
+			self.failUnlessEqual(len(pairs), len(set(pairs)))
+			self.failUnless((self.myles.pk, self.myles2.pk) in pairs)
+			self.failUnless((self.myles.pk, self.myles3.pk) in pairs)
+
+class MergeTest(TestCase):
+	def setUp(self):
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.home = Location.objects.create(name='Home', slug='home')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.company2 = Company.objects.create(name='Monkey in Your Soul Inc')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		self.myles2 = Person.objects.create(first_name='Myles', last_name='Braithwaite', nickname='mb', company=self.company2)
+		self.myles.phone_number.create(phone_number='416-555-0100', location=self.work)
+		self.myles2.phone_number.create(phone_number='(416) 555-0100', location=self.work)
+		self.myles2.phone_number.create(phone_number='416-555-0199', location=self.home)
+		self.myles.email_address.create(email_address='me@mylesbraithwaite.com', location=self.work)
+		self.myles2.email_address.create(email_address='ME@mylesbraithwaite.com', location=self.home)
+		self.myles2.special_date.create(occasion='Birthday', date=datetime.date(1980, 12, 30))
+		self.group = Group.objects.create(name='Friends')
+		self.group.people.add(self.myles, self.myles2)
+		self.group2 = Group.objects.create(name='Work')
+		self.group2.people.add(self.myles2)
+		self.group.companies.add(self.company2)
+	
+	def testMergeInto(self):
+		self.myles2.merge_into(self.myles)
+		self.failIf(Contact.objects.filter(pk=self.myles2.pk).exists())
+		myles = Person.objects.get(pk=self.myles.pk)
+		self.failUnlessEqual(myles.nickname, 'mb')
+		self.failUnlessEqual(myles.company_id, self.company2.pk)
+		self.failUnlessEqual(sorted(p.phone_number for p in myles.phone_number.all()), ['416-555-0100', '416-555-0199'])
+		self.failUnlessEqual(myles.email_address.count(), 1)
+		self.failUnlessEqual(myles.special_date.get().occasion, 'Birthday')
+		self.failUnlessEqual(sorted(g.name for g in myles.group_set.all()), ['Friends', 'Work'])
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('mb')], [self.myles.pk])
+	
+	def testBatchMerge(self):
+		DuplicateCandidate.objects.create(contact=self.myles, duplicate=self.myles2, score=0.9)
+		merged = merge_contacts([(self.myles2, self.myles), (self.company2.pk, self.company.pk)])
+		self.failUnlessEqual(merged, 2)
+		myles = Person.objects.get(pk=self.myles.pk)
+		self.failUnlessEqual(myles.company_id, self.company.pk)
+		self.failUnlessEqual(myles.nickname, 'mb')
+		self.failUnlessEqual(list(Company.objects.get().group_set.all()), [self.group])
+		self.failUnlessEqual(Contact.objects.count(), 2)
+		self.failIf(DuplicateCandidate.objects.exists())
+		self.failIf(SearchToken.objects.filter(contact=self.myles2.pk).exists())
+		self.failUnlessEqual(counts.table_count(Person.objects.all()), 1)
+	
+	def pairs(self, count):
+		pairs = []
+		for i in range(count):
+			target = Person.objects.create(first_name='Target %d' % i)
+			source = Person.objects.create(first_name='Source %d' % i, nickname='s%d' % i, company=self.company2)
+			for contact in (target, source):
+				contact.phone_number.create(phone_number='416-555-010%d' % i, location=self.work)
+				contact.email_address.create(email_address='%d-%d@example.com' % (contact.pk, i), location=self.home)
+				self.group.people.add(contact)
+			self.group2.people.add(source)
+			pairs.append((source, target))
+		return pairs
+	
+	def testQueriesDoNotGrowWithPairs(self):
+		one, many = self.pairs(1), self.pairs(5)
+		with CaptureQueriesContext(connection) as first:
+			merge_contacts(one)
+		with self.assertNumQueries(len(first)):
+			merge_contacts(many)
+		for source, target in many:
+			target = Person.objects.get(pk=target.pk)
+			self.failUnlessEqual(target.nickname, source.nickname)
+			self.failUnlessEqual(target.phone_number.count(), 1)
+			self.failUnlessEqual(target.email_address.count(), 2)
+			self.failUnlessEqual(target.group_set.count(), 2)
+	
+	def testChainsAndErrors(self):
+		third = Person.objects.create(first_name='Myles')
+		merge_contacts([(third, self.myles2), (self.myles2, self.myles)])
+		self.failUnlessEqual(Person.objects.count(), 1)
+		self.assertRaises(ValueError, merge_contacts, [(self.myles, self.myles)])
+		self.assertRaises(ValueError, merge_contacts, [(self.company, self.company2), (self.company2, self.company)])
+		self.assertRaises(ValueError, merge_contacts, [(self.company, self.myles)])
+
+class CompanyAutocompleteTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		self.monkey = Company.objects.create(name='Monkey in your Soul', nickname='MIYS')
+		self.monarch = Company.objects.create(name='Monarch Butterfly Ltd')
+		self.myles = Person.objects.create(first_name='Monica', last_name='Braithwaite', company=self.monkey)
+	
+	def complete(self, query, **params):
+		params['q'] = query
+		response = self.client.get(reverse('contacts_company_autocomplete'), params)
+		self.failUnlessEqual(response['Content-Type'], 'application/json')
+		return [result['name'] for result in json.loads(response.content)['results']]
+	
+	def testPrefixes(self):
+		self.failUnlessEqual(self.complete('mon'), ['Monarch Butterfly Ltd', 'Monkey in your Soul'])
+		self.failUnlessEqual(self.complete('monkey so'), ['Monkey in your Soul'])
+		self.failUnlessEqual(self.complete('miy'), ['Monkey in your Soul'])
+		self.failUnlessEqual(self.complete('mon', limit='1'), ['Monarch Butterfly Ltd'])
+		self.failUnlessEqual(self.complete('braithwaite'), [])
+		self.failUnlessEqual(self.complete(''), [])
+	
+	def testFormReadsOnlyTheSelectedCompany(self):
+		form = PersonUpdateForm(instance=self.myles)
+		with self.assertNumQueries(1):
+			html = unicode(form['company'])
+		self.failUnless('value="Monkey in your Soul"' in html)
+		self.failIf('Monarch' in html)
+		form = PersonUpdateForm({'first_name': 'Monica', 'company': self.monarch.pk}, instance=self.myles)
+		self.failUnless(form.is_valid())
+		self.failUnlessEqual(form.save().company_id, self.monarch.pk)
+		form = PersonUpdateForm({'first_name': 'Monica', 'company': self.myles.pk}, instance=self.myles)
+		self.failIf(form.is_valid())
+
+class ChangedOnlySaveTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+		self.client.login(username='admin', password='secret')
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite')
+		for i in range(40):
+			self.myles.phone_number.create(phone_number='416-555-%04d' % i, location=self.work)
+		self.myles.email_address.create(email_address='me@mylesbraithwaite.com', location=self.work)
+	
+	def post_data(self):
+		forms = [PersonUpdateForm(instance=self.myles)]
+		for formset_class in (PhoneNumberFormSet, EmailAddressFormSet, InstantMessengerFormSet, WebSiteFormSet, StreetAddressFormSet, SpecialDateFormSet):
+			formset = formset_class(instance=self.myles)
+			forms.append(formset.management_form)
+			forms.extend(formset.forms)
+		data = {}
+		for form in forms:
+			for field in form:
+				value = field.value()
+				if value is None:
+					value = ''
+				data[field.html_name] = value
+		return data
+	
+	def post(self, data):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.post(self.myles.get_update_url(), data)
+		self.failUnlessEqual(response.status_code, 302)
+		return [q['sql'] for q in queries.captured_queries if 'UPDATE ' in q['sql']]
+	
+	def testUnchangedFormWritesNothing(self):
+		modified = Person.objects.get(pk=self.myles.pk).date_modified
+		self.failUnlessEqual(self.post(self.post_data()), [])
+		self.failUnlessEqual(Person.objects.get(pk=self.myles.pk).date_modified, modified)
+	
+	def testOneChangedRowIsOneUpdate(self):
+		data = self.post_data()
+		phone = self.myles.phone_number.order_by('pk')[3]
+		self.failUnlessEqual(data['phone_number-3-id'], phone.pk)
+		data['phone_number-3-phone_number'] = '(647) 555-9999'
+		updates = self.post(data)
+		self.failUnlessEqual(len(updates), 1)
+		self.failUnless('contacts_phone_numbers' in updates[0])
+		phone = PhoneNumber.objects.get(pk=phone.pk)
+		self.failUnlessEqual((phone.phone_number, phone.normalized_number), ('(647) 555-9999', '6475559999'))
+		self.failUnlessEqual([c.pk for c in Contact.objects.search('6475559999')], [self.myles.pk])
+	
+	def testChangedContactField(self):
+		data = self.post_data()
+		data['title'] = 'Developer'
+		updates = self.post(data)
+		self.failUnlessEqual(len(updates), 1)
+		self.failIf('first_name' in updates[0])
+		self.failUnlessEqual(Person.objects.get(pk=self.myles.pk).title, 'Developer')
+
+class EditPageQueryCountTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+		self.client.login(username='admin', password='secret')
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.mobile = Location.objects.create(name='Mobile', slug='mobile', is_phone=True)
+		self.home = Location.objects.create(name='Home', slug='home', is_street_address=True)
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite', company=self.company)
+	
+	def add_rows(self, count):
+		for i in range(count):
+			self.myles.phone_number.create(phone_number='416-555-%04d' % i, location=self.mobile)
+			self.myles.email_address.create(email_address='me%d@mylesbraithwaite.com' % i, location=self.work)
+			self.myles.web_site.create(url='http://example.com/%d' % i, location=self.work)
+			self.myles.street_address.create(street='%d Queen St' % i, city='Toronto', location=self.home)
+			self.myles.special_date.create(occasion='Day %d' % i, date=datetime.date(2000, 1, i + 1))
+	
+	def get(self):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(self.myles.get_update_url())
+		self.failUnlessEqual(response.status_code, 200)
+		return response, len(queries)
+	
+	def testFixedQueryCount(self):
+		self.add_rows(1)
+		response, small = self.get()
+		self.add_rows(10)
+		response, large = self.get()
+		# Session, user, person, six child tables, locations and the
+		# selected company.
+		self.failUnlessEqual((small, large), (11, 11))
+	
+	def testLocationChoicesFollowLimits(self):
+		self.add_rows(1)
+		response, count = self.get()
+		phone = response.context['phone_formset'].forms[0]
+		email = response.context['email_formset'].forms[0]
+		address = response.context['address_formset'].forms[0]
+		self.failUnlessEqual([pk for pk, label in phone.fields['location'].choices if pk], [self.work.pk, self.mobile.pk])
+		self.failUnlessEqual([pk for pk, label in email.fields['location'].choices if pk], [self.work.pk])
+		self.failUnlessEqual([pk for pk, label in address.fields['location'].choices if pk], [self.work.pk, self.home.pk])
+		self.failUnlessEqual(phone['location'].value(), self.mobile.pk)
+
+class SlugAllocatorTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		for slug in ['john-smith', 'john-smith-2', 'john-smith-7', 'john-smithers']:
+			Person.objects.create(first_name='John', last_name='Smith', slug=slug)
+		Company.objects.create(name='John Smith', slug='john-smith-9')
+	
+	def testNextFreeSuffix(self):
+		# Whether the base is taken, then its highest suffix.
+		with self.assertNumQueries(2):
+			self.failUnlessEqual(unique_slug(Person(), 'John Smith'), 'john-smith-8')
+		self.failUnlessEqual(unique_slug(Company(), 'John Smith'), 'john-smith')
+		self.failUnlessEqual(unique_slug(Group(), 'John Smith'), 'john-smith')
+		self.failUnlessEqual(unique_slug(Person(), 'Jane Smith'), 'jane-smith')
+		self.failUnlessEqual(unique_slug(Person(), '!!!'), 'contact')
+		person = Person.objects.get(slug='john-smith-7')
+		self.failUnlessEqual(unique_slug(person, 'John Smith'), 'john-smith-3')
+		person.slug = 'john-smith-12'
+		person.save()
+		self.failUnlessEqual(unique_slug(Person(), 'John Smith'), 'john-smith-13')
+	
+	def testLongNames(self):
+		name = 'x' * 60
+		first = save_with_slug(Person(first_name=name), name)
+		second = save_with_slug(Person(first_name=name), name)
+		self.failUnlessEqual(first.slug, 'x' * 50)
+		self.failUnlessEqual(second.slug, 'x' * 48 + '-2')
+		Person.objects.create(first_name=name, slug='x' * 47 + '-10')
+		self.failUnlessEqual(unique_slug(Person(), name), 'x' * 47 + '-11')
+	
+	def testUniqueIndex(self):
+		Person.objects.create(first_name='Jane')
+		Person.objects.create(first_name='Jane', slug='')
+		self.assertRaises(IntegrityError, Person.objects.create, first_name='John', slug='john-smith')
+	
+	def testAllocateSlugs(self):
+		people = [Person(slug='john-smith'), Person(slug='john-smith'), Person(slug='jane-doe'), Person(slug='')]
+		# The taken bases, then the highest suffix of john-smith.
+		with self.assertNumQueries(2):
+			allocate_slugs(people)
+		self.failUnlessEqual([p.slug for p in people], ['john-smith-8', 'john-smith-9', 'jane-doe', None])
+	
+	def testCreateViews(self):
+		User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+		self.client.login(username='admin', password='secret')
+		self.client.post(reverse('contacts_person_create'), {'first_name': 'John', 'last_name': 'Smith'})
+		self.client.post(reverse('contacts_group_create'), {'name': 'Friends'})
+		self.client.post(reverse('contacts_group_create'), {'name': 'Friends'})
+		self.failUnlessEqual(Person.objects.order_by('-pk')[0].slug, 'john-smith-8')
+		self.failUnlessEqual(sorted(Group.objects.values_list('slug', flat=True)), ['friends', 'friends-2'])
+
+class ObjectCacheTest(TestCase):
+	urls = 'contacts.testurls'
+	
+	def setUp(self):
+		self.work = Location.objects.create(name='Work', slug='work')
+		self.company = Company.objects.create(name='Monkey in your Soul')
+		self.myles = Person.objects.create(first_name='Myles', last_name='Braithwaite', company=self.company)
+		self.phone = self.myles.phone_number.create(phone_number='416-555-0100', location=self.work)
+		self.group = Group.objects.create(name='Torontonian')
+		objectcache.reset_stats()
+	
+	def testPersonDetail(self):
+		url = self.myles.get_absolute_url()
+		self.client.get(url)
+		with self.assertNumQueries(0):
+			response = self.client.get(url)
+		self.assertContains(response, '416-555-0100')
+		self.assertContains(response, 'Monkey in your Soul')
+		self.failUnlessEqual(objectcache.stats(), {'hits': 1, 'misses': 1})
+		
+		self.phone.phone_number = '416-555-0199'
+		self.phone.save()
+		self.assertContains(self.client.get(url), '416-555-0199')
+		self.company.name = 'Monkey'
+		self.company.save()
+		self.assertNotContains(self.client.get(url), 'Monkey in your Soul')
+		self.work.name = 'Office'
+		self.work.save()
+		self.assertContains(self.client.get(url), 'Office')
+		self.failUnlessEqual(objectcache.stats(), {'hits': 1, 'misses': 4})
+	
+	def testCompanyDetail(self):
+		url = self.company.get_absolute_url()
+		self.assertContains(self.client.get(url), 'Braithwaite')
+		# the people are counted and read a page at a time
+		with self.assertNumQueries(2):
+			self.client.get(url)
+		self.myles.company = None
+		self.myles.save()
+		self.assertNotContains(self.client.get(url), 'Braithwaite')
+		Person.objects.create(first_name='Bruce', last_name='Wayne', company=self.company)
+		self.assertContains(self.client.get(url), 'Wayne')
+		self.company.delete()
+		self.failUnlessEqual(self.client.get(url).status_code, 404)
+		self.failUnlessEqual(self.client.get(self.myles.get_absolute_url()).status_code, 200)
+	
+	def testCompanyPeoplePages(self):
+		for i in range(150):
+			Person.objects.create(first_name='Person', last_name='%03d' % i, company=self.company)
+		url = self.company.get_absolute_url()
+		response = self.client.get(url, {'people_page': 2})
+		self.failUnlessEqual(response.context['people_count'], 151)
+		self.failUnlessEqual(len(response.context['people'].object_list), 51)
+		self.assertContains(response, '?people_page=1#people')
+		response = self.client.get(url, {'people_page': 99})
+		self.failUnlessEqual(response.context['people'].number, 2)
+		self.failIf(isinstance(objectcache.get_company(self.company.pk), tuple))
+	
+	def testGroupDetail(self):
+		url = self.group.get_absolute_url()
+		self.client.get(url)
+		with self.assertNumQueries(4):
+			self.client.get(url)
+		self.group.name = 'Torontonians'
+		self.group.save()
+		self.assertContains(self.client.get(url), 'Torontonians')
+	
+	def testVersionsReplacedAfterCommit(self):
+		key = objectcache._version_key('contact', self.myles.pk)
+		with objectcache.atomic():
+			self.phone.phone_number = '416-555-0199'
+			self.phone.save()
+			replaced = cache.get(key)
+			# Another connection could cache the old rows under this version.
+			objectcache.get_person(self.myles.pk)
+		self.failIfEqual(cache.get(key), replaced)
+		objectcache.get_person(self.myles.pk)
+		self.failUnlessEqual(objectcache.stats(), {'hits': 0, 'misses': 2})
+	
+	def testMergeAndCommand(self):
+		url = self.myles.get_absolute_url()
+		self.client.get(url)
+		other = Person.objects.create(first_name='Myles')
+		other.email_address.create(email_address='me@mylesbraithwaite.com', location=self.work)
+		other.merge_into(self.myles)
+		self.assertContains(self.client.get(url), 'me@mylesbraithwaite.com')
+		out = StringIO()
+		call_command('object_cache_stats', reset=True, stdout=out)
+		self.failUnlessEqual(out.getvalue().strip(), '0 hits, 2 misses (0.0% hit rate).')
+		self.failUnlessEqual(objectcache.stats(), {'hits': 0, 'misses': 0})
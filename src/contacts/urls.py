@@ -33,6 +33,10 @@ urlpatterns = patterns('contacts.views',
 		view = 'company.detail',
 		name = 'contacts_company_detail'
 	),
+	url(r'^companies/autocomplete/$',
+		view = 'company.autocomplete',
+		name = 'contacts_company_autocomplete',
+	),
 	url(r'^companies/$',
 		view = 'company.list',
 		name = 'contacts_company_list',
@@ -111,4 +115,18 @@ urlpatterns = patterns('contacts.views',
 		view = 'group.list',
 		name = 'contacts_group_list'
 	),
-)
+
+	url(r'^search/$',
+		view = 'search.search',
+		name = 'contacts_search',
+	),
+
+	url(r'^export\.vcf$',
+		view = 'export.vcard',
+		name = 'contacts_export_vcard',
+	),
+	url(r'^export\.csv$',
+		view = 'export.csv',
+		name = 'contacts_export_csv',
+	),
+)
\ No newline at end of file
@@ -1,53 +1,59 @@
+import json
+
 from django.core.urlresolvers import reverse
-from django.template.defaultfilters import slugify
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
-from django.http import Http404, HttpResponseForbidden, HttpResponseServerError, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseServerError, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 
-from contacts.models import Company
-from contacts.forms import CompanyCreateForm, CompanyUpdateForm, PhoneNumberFormSet, EmailAddressFormSet, InstantMessengerFormSet, WebSiteFormSet, StreetAddressFormSet, SpecialDateFormSet
+from contacts.models import Company, Person
+from contacts.forms import CompanyCreateForm, CompanyUpdateForm, contact_formsets, save_changes
+from contacts.pagination import member_page, paginate
+from contacts import objectcache
+from contacts.slugs import save_with_slug
+
+KEYSET_ORDERING = ('name', 'id')
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
 
 def list(request, page=1, template='contacts/company/list.html'):
     """List of all the comapnies.
 
+    Pass a ``cursor`` query parameter to page by seeking on
+    ``KEYSET_ORDERING`` instead of by page number.
+
     :param template: Add a custom template.
     """
 
-    company_list = Company.objects.all()
-    paginator = Paginator(company_list, 20)
-
-    try:
-        companies = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        companies = paginator.page(paginator.num_pages)
-
-    kwvars = {
-        'object_list': companies.object_list,
-        'has_next': companies.has_next(),
-        'has_previous': companies.has_previous(),
-        'has_other_pages': companies.has_other_pages(),
-        'start_index': companies.start_index(),
-        'end_index': companies.end_index(),
-        'previous_page_number': companies.previous_page_number(),
-        'next_page_number': companies.next_page_number(),
-    }
+    kwvars = paginate(request, Company.objects.all(), page, KEYSET_ORDERING)
 
     return render_to_response(template, kwvars, RequestContext(request))
 
 def detail(request, pk, slug=None, template='contacts/company/detail.html'):
     """Detail of a company.
 
+    The company's child rows and their locations are loaded up front in
+    a fixed number of queries, and cached until they change. Its people
+    are counted once and listed a page at a time; pass ``people_page`` to
+    move through them.
+
     :param template: Add a custom template.
     """
 
     try:
-        company = Company.objects.get(pk__iexact=pk)
+        company = objectcache.get_company(pk)
     except Company.DoesNotExist:
         raise Http404
 
+    people = Person.objects.filter(company=company).only(
+        'id', 'first_name', 'middle_name', 'last_name', 'suffix', 'title')
+    people_count = people.count()
+
     kwvars = {
         'object': company,
+        'people_count': people_count,
+        'people': member_page(people.order_by('last_name', 'first_name', 'id'),
+                              people_count,
+                              request.GET.get('people_page', 1)),
     }
 
     return render_to_response(template, kwvars, RequestContext(request))
@@ -67,14 +73,7 @@ def create(request, template='contacts/company/create.html'):
         company_form = CompanyCreateForm(request.POST)
         if company_form.is_valid():
             c = company_form.save(commit=False)
-
-            # TODO Make sure that the slug isn't already in the database
-            if c.nickname:
-                c.slug = slugify(c.nickname)
-            else:
-                c.slug = slugify(c.name)
-
-            c.save()
+            save_with_slug(c, c.nickname or c.name)
             return HttpResponseRedirect(c.get_absolute_url())
         else:
             return HttpResponseServerError
@@ -88,6 +87,10 @@ def create(request, template='contacts/company/create.html'):
 def update(request, pk, slug=None, template='contacts/company/update.html'):
     """Update a company.
 
+    The child rows and locations are loaded once and shared by the
+    formsets. Only the forms and rows that changed are written, in one
+    transaction.
+
     :param template: A custom template.
     :param form: A custom form.
     """
@@ -101,45 +104,22 @@ def update(request, pk, slug=None, template='contacts/company/update.html'):
     except Company.DoesNotExist:
         raise Http404
 
-    form = CompanyUpdateForm(instance=company)
-    phone_formset = PhoneNumberFormSet(instance=company)
-    email_formset = EmailAddressFormSet(instance=company)
-    im_formset = InstantMessengerFormSet(instance=company)
-    website_formset = WebSiteFormSet(instance=company)
-    address_formset = StreetAddressFormSet(instance=company)
-    special_date_formset = SpecialDateFormSet(instance=company)
-    
     if request.method == 'POST':
         form = CompanyUpdateForm(request.POST, instance=company)
-        phone_formset = PhoneNumberFormSet(request.POST, instance=company)
-        email_formset = EmailAddressFormSet(request.POST, instance=company)
-        im_formset = InstantMessengerFormSet(request.POST, instance=company)
-        website_formset = WebSiteFormSet(request.POST, instance=company)
-        address_formset = StreetAddressFormSet(request.POST, instance=company)
-        special_date_formset = SpecialDateFormSet(request.POST, instance=company)
-
-        if form.is_valid() and phone_formset.is_valid() and \
-            email_formset.is_valid() and im_formset.is_valid() and \
-            website_formset.is_valid() and address_formset.is_valid():
-            form.save()
-            phone_formset.save()
-            email_formset.save()
-            im_formset.save()
-            website_formset.save()
-            address_formset.save()
-            special_date_formset.save()
+        formsets = contact_formsets(company, request.POST)
+
+        if form.is_valid() and all([f.is_valid() for f in formsets.values()]):
+            save_changes(form, formsets.values())
             return HttpResponseRedirect(company.get_absolute_url())
+    else:
+        form = CompanyUpdateForm(instance=company)
+        formsets = contact_formsets(company)
 
     kwvars = {
         'form': form,
-        'phone_formset': phone_formset,
-        'email_formset': email_formset,
-        'im_formset': im_formset,
-        'website_formset': website_formset,
-        'address_formset': address_formset,
-        'special_date_formset': special_date_formset,
         'object': company,
     }
+    kwvars.update(formsets)
 
     return render_to_response(template, kwvars, RequestContext(request))
 
@@ -170,4 +150,27 @@ def delete(request, pk, slug=None, template='contacts/company/delete.html'):
         'object': company,
     }
 
-    return render_to_response(template, kwvars, RequestContext(request))
\ No newline at end of file
+    return render_to_response(template, kwvars, RequestContext(request))
+
+def autocomplete(request):
+    """Companies whose name or nickname starts with the words of ``q``.
+
+    Answers with JSON for the company field of the person forms. Pass
+    ``limit`` for more or fewer than ``AUTOCOMPLETE_LIMIT`` results.
+    """
+
+    query = request.GET.get('q', '').strip()
+    limit = request.GET.get('limit', '')
+    if limit.isdigit():
+        limit = min(int(limit), MAX_AUTOCOMPLETE_LIMIT)
+    else:
+        limit = AUTOCOMPLETE_LIMIT
+
+    results = [{
+        'id': company.pk,
+        'name': company.name,
+        'nickname': company.nickname,
+    } for company in Company.objects.complete(query, limit)]
+
+    return HttpResponse(json.dumps({'query': query, 'results': results}),
+                        content_type='application/json')
@@ -0,0 +1,35 @@
+from django.http import HttpResponseForbidden, StreamingHttpResponse
+
+from contacts.exporters.csv import iter_csv
+from contacts.exporters.vcard import iter_vcards
+
+
+def _attachment(content, content_type, filename):
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+def vcard(request):
+    """Export every contact as a vCard file.
+
+    The cards are streamed as they are read, a chunk of contacts and
+    their child rows at a time. Only staff may export.
+    """
+
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return _attachment(iter_vcards(), 'text/vcard; charset=utf-8',
+                       'contacts.vcf')
+
+def csv(request):
+    """Export every contact as a CSV file.
+
+    The rows are streamed as they are read, a chunk of contacts and their
+    child rows at a time. Only staff may export.
+    """
+
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return _attachment(iter_csv(), 'text/csv; charset=utf-8', 'contacts.csv')
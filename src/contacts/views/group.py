@@ -1,53 +1,58 @@
 from django.core.urlresolvers import reverse
-from django.template.defaultfilters import slugify
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.http import Http404, HttpResponseForbidden, HttpResponseServerError, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 
 from contacts.models import Group
 from contacts.forms import GroupCreateForm, GroupUpdateForm
+from contacts import objectcache
+from contacts.pagination import member_page, paginate
+from contacts.slugs import save_with_slug
+
+KEYSET_ORDERING = ('name', 'id')
 
 def list(request, page=1, template='contacts/group/list.html'):
     """List of all the groups.
 
+    Pass a ``cursor`` query parameter to page by seeking on
+    ``KEYSET_ORDERING`` instead of by page number.
+
     :param template: Add a custom template.
     """
 
-    group_list = Group.objects.all()
-    paginator = Paginator(group_list, 20)
-
-    try:
-        groups = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        groups = paginator.page(paginator.num_pages)
-
-    kwvars = {
-        'object_list': groups.object_list,
-        'has_next': groups.has_next(),
-        'has_previous': groups.has_previous(),
-        'has_other_pages': groups.has_other_pages(),
-        'start_index': groups.start_index(),
-        'end_index': groups.end_index(),
-        'previous_page_number': groups.previous_page_number(),
-        'next_page_number': groups.next_page_number(),
-    }
+    kwvars = paginate(request, Group.objects.all(), page, KEYSET_ORDERING)
 
     return render_to_response(template, kwvars, RequestContext(request))
 
 def detail(request, pk, slug=None, template='contacts/group/detail.html'):
     """Detail of a group.
 
+    The members are counted once and listed a page at a time; pass
+    ``people_page`` and ``companies_page`` to move through them.
+
     :param template: Add a custom template.
     """
 
     try:
-        group = Group.objects.get(pk__iexact=pk)
+        group = objectcache.get_group(pk)
     except Group.DoesNotExist:
         raise Http404
 
+    people_count = group.people.count()
+    companies_count = group.companies.count()
+
+    people = group.people.only('id', 'first_name', 'middle_name',
+                               'last_name', 'suffix')
+    companies = group.companies.only('id', 'name', 'is_company')
+
     kwvars = {
         'object': group,
+        'people_count': people_count,
+        'companies_count': companies_count,
+        'people': member_page(people, people_count,
+                              request.GET.get('people_page', 1)),
+        'companies': member_page(companies, companies_count,
+                                 request.GET.get('companies_page', 1)),
     }
 
     return render_to_response(template, kwvars, RequestContext(request))
@@ -67,11 +72,7 @@ def create(request, template='contacts/group/create.html'):
         group_form = GroupCreateForm(request.POST)
         if group_form.is_valid():
             g = group_form.save(commit=False)
-
-            # TODO Make sure that the slug isn't already in the database
-            g.slug = slugify(g.name)
-
-            g.save()
+            save_with_slug(g, g.name)
             return HttpResponseRedirect(g.get_absolute_url())
         else:
             return HttpResponseServerError
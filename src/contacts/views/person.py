@@ -1,50 +1,42 @@
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.core.urlresolvers import reverse
 from django.http import Http404, HttpResponseForbidden, HttpResponseServerError, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
-from django.template.defaultfilters import slugify
 
 from contacts.models import Person, Group
-from contacts.forms import PersonCreateForm, PersonUpdateForm, PhoneNumberFormSet, EmailAddressFormSet, InstantMessengerFormSet, WebSiteFormSet, StreetAddressFormSet, SpecialDateFormSet
+from contacts.forms import PersonCreateForm, PersonUpdateForm, contact_formsets, save_changes
+from contacts.pagination import paginate
+from contacts.slugs import save_with_slug
+from contacts import objectcache
+
+KEYSET_ORDERING = ('last_name', 'first_name', 'id')
 
 def list(request, page=1, template='contacts/person/list.html'):
     """List of all the people.
 
+    Pass a ``cursor`` query parameter to page by seeking on
+    ``KEYSET_ORDERING`` instead of by page number.
+
     :param template: Add a custom template.
     """
 
 
-    person_list = Person.objects.all()
-    paginator = Paginator(person_list, 20)
-
-    try:
-        people = paginator.page(page)
-    except (EmptyPage, InvalidPage):
-        people = paginator.page(paginator.num_pages)
-
-    kwvars = {
-        'object_list': people.object_list,
-        'has_next': people.has_next(),
-        'has_previous': people.has_previous(),
-        'has_other_pages': people.has_other_pages(),
-        'start_index': people.start_index(),
-        'end_index': people.end_index(),
-        'previous_page_number': people.previous_page_number(),
-        'next_page_number': people.next_page_number(),
-    }
+    kwvars = paginate(request, Person.objects.all(), page, KEYSET_ORDERING)
 
     return render_to_response(template, kwvars, RequestContext(request))
 
 def detail(request, pk, slug=None, template='contacts/person/detail.html'):
     """Detail of a person.
 
+    The person's company, child rows and their locations are loaded up
+    front in a fixed number of queries, and cached until they change.
+
     :param template: Add a custom template.
     """
 
 
     try:
-        person = Person.objects.get(pk__iexact=pk)
+        person = objectcache.get_person(pk)
     except Person.DoesNotExist:
         raise Http404
 
@@ -70,8 +62,7 @@ def create(request, template='contacts/person/create.html'):
 
         if form.is_valid():
             p = form.save(commit=False)
-            p.slug = slugify("%s %s" % (p.first_name, p.last_name))
-            p.save()
+            save_with_slug(p, u"%s %s" % (p.first_name or '', p.last_name or ''))
             return HttpResponseRedirect(p.get_absolute_url())
     else:
         form = PersonCreateForm()
@@ -85,6 +76,10 @@ def create(request, template='contacts/person/create.html'):
 def update(request, pk, slug=None, template='contacts/person/update.html'):
     """Update a person.
 
+    The child rows and locations are loaded once and shared by the
+    formsets. Only the forms and rows that changed are written, in one
+    transaction.
+
     :param template: A custom template.
     """
 
@@ -100,45 +95,22 @@ def update(request, pk, slug=None, template='contacts/person/update.html'):
 
     if request.method == 'POST':
         form = PersonUpdateForm(request.POST, instance=person)
-        phone_formset = PhoneNumberFormSet(request.POST, instance=person)
-        email_formset = EmailAddressFormSet(request.POST, instance=person)
-        im_formset = InstantMessengerFormSet(request.POST, instance=person)
-        website_formset = WebSiteFormSet(request.POST, instance=person)
-        address_formset = StreetAddressFormSet(request.POST, instance=person)
-        special_date_formset = SpecialDateFormSet(request.POST, instance=person)
-
-        if form.is_valid() and phone_formset.is_valid() and \
-            email_formset.is_valid() and im_formset.is_valid() and \
-            website_formset.is_valid() and address_formset.is_valid():
-            form.save()
-            phone_formset.save()
-            email_formset.save()
-            im_formset.save()
-            website_formset.save()
-            address_formset.save()
-            special_date_formset.save()
+        formsets = contact_formsets(person, request.POST)
+
+        if form.is_valid() and all([f.is_valid() for f in formsets.values()]):
+            save_changes(form, formsets.values())
             return HttpResponseRedirect(person.get_absolute_url())
         else:
             return HttpResponseServerError
 
     form = PersonUpdateForm(instance=person)
-    phone_formset = PhoneNumberFormSet(instance=person)
-    email_formset = EmailAddressFormSet(instance=person)
-    im_formset = InstantMessengerFormSet(instance=person)
-    website_formset = WebSiteFormSet(instance=person)
-    address_formset = StreetAddressFormSet(instance=person)
-    special_date_formset = SpecialDateFormSet(instance=person)
+    formsets = contact_formsets(person)
 
     kwvars = {
         'form': form,
-        'phone_formset': phone_formset,
-        'email_formset': email_formset,
-        'im_formset': im_formset,
-        'website_formset': website_formset,
-        'address_formset': address_formset,
-        'special_date_formset': special_date_formset,
         'object': person,
     }
+    kwvars.update(formsets)
 
     return render_to_response(template, kwvars, RequestContext(request))
 
@@ -0,0 +1,23 @@
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+
+from contacts.models import Contact
+
+def search(request, template='contacts/search.html'):
+    """Search people and companies.
+
+    :param template: Add a custom template.
+    """
+
+    query = request.GET.get('q', '').strip()
+    if query:
+        object_list = Contact.objects.search(query)
+    else:
+        object_list = []
+
+    kwvars = {
+        'query': query,
+        'object_list': object_list,
+    }
+
+    return render_to_response(template, kwvars, RequestContext(request))